@@ -0,0 +1,222 @@
+##
+## Benchmarks of the import scripts' loaders against a scratch SQLite
+## database (see scratch_db.py), filled with synthetic genes, GO terms and
+## gene-function associations at a configurable scale. Each benchmark runs
+## on a fresh database, once to warm up and then timed several times. The
+## JSON report has the same layout as the web app's run_benchmarks, so
+## reports can be compared with benchmarks.compare.
+##
+## > python benchmark_importers.py --genes 5000 --terms 20000 --output importers.json
+##
+import argparse
+import json
+import os
+import random
+import shutil
+import StringIO
+import sys
+import tempfile
+import time
+
+import bulk_load
+import import_functions
+import scratch_db
+from open_struct import OpenStruct
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """
+    Decorator registering a benchmark under a name. A benchmark is a function
+    taking a connection to a fresh database and the scale, doing any setup and
+    returning the function to be timed.
+    """
+    def register(f):
+        BENCHMARKS.append((name, f))
+        return f
+    return register
+
+
+def make_genes(scale, changed=0.0):
+    """
+    Gene records on two chromosomes. A fraction of them, given by changed,
+    get a different start.
+    """
+    random.seed(scale['seed'])
+    genes = []
+    for i in range(scale['genes']):
+        start = 1000 * i + 1
+        if random.random() < changed:
+            start += 10
+        genes.append(OpenStruct(name="SYN%05d" % (i,), chromosome='chromosome' if i % 10 else 'plasmid',
+                                common_name=None, geneid=100000 + i, type='CDS',
+                                start=start, end=start + 899, strand='+-'[i % 2], description="synthetic gene %d" % (i,)))
+    return genes
+
+
+def make_terms(scale):
+    """
+    GO terms forming a tree, each with an is_a link to an earlier term and
+    some with a part_of relationship and an alt_id.
+    """
+    random.seed(scale['seed'])
+    terms = []
+    for i in range(scale['terms']):
+        term = OpenStruct(id="GO:%07d" % (i,), name="synthetic term %d" % (i,), namespace='biological_process')
+        term['def'] = "definition of synthetic term %d" % (i,)
+        if i > 0:
+            term['is_a'] = "GO:%07d" % (random.randrange(i),)
+        if i > 1 and i % 5 == 0:
+            term['relationship'] = "part_of GO:%07d" % (random.randrange(i - 1),)
+        if i % 7 == 0:
+            term['alt_id'] = "GO:%07d" % (scale['terms'] + i,)
+        terms.append(term)
+    return terms
+
+
+def load_genes(con, genes):
+    species_id = bulk_load.get_species_id(con, 'Synthetic species')
+    bulk_load.load_genes(con, species_id, bulk_load.get_chromosome_ids(con, species_id), genes)
+    con.commit()
+
+
+def quietly(f, *args, **kwargs):
+    # the importers report what they did on stdout
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        return f(*args, **kwargs)
+    finally:
+        sys.stdout = stdout
+
+
+@benchmark('load_genes_insert')
+def load_genes_insert(con, scale):
+    genes = make_genes(scale)
+    def run():
+        con.execute("delete from networks_gene")
+        load_genes(con, genes)
+    return run
+
+@benchmark('load_genes_reload')
+def load_genes_reload(con, scale):
+    genes = make_genes(scale)
+    load_genes(con, genes)
+    return lambda: load_genes(con, genes)
+
+@benchmark('load_genes_update')
+def load_genes_update(con, scale):
+    genes = make_genes(scale)
+    changed = make_genes(scale, changed=0.1)
+    def run():
+        load_genes(con, genes)
+        load_genes(con, changed)
+    return run
+
+@benchmark('associations')
+def associations(con, scale):
+    random.seed(scale['seed'])
+    # about one in five associations is a duplicate
+    rows = [ (random.randrange(scale['genes']), random.randrange(scale['terms']), 'microbes online')
+             for i in range(scale['genes'] * scale['associations_per_gene']) ]
+    rows += rows[:len(rows) // 4]
+    def run():
+        con.execute("delete from networks_gene_function")
+        writer = bulk_load.AssociationWriter(con)
+        for gene_id, function_id, source in rows:
+            writer.add(gene_id, function_id, source)
+        writer.close()
+        con.commit()
+    return run
+
+@benchmark('go_terms_insert')
+def go_terms_insert(con, scale):
+    terms = make_terms(scale)
+    def run():
+        for table in ('networks_function', 'networks_function_relationships', 'networks_synonym'):
+            con.execute("delete from %s" % (table,))
+        quietly(import_functions.insert_go_terms, terms, con=con)
+    return run
+
+@benchmark('go_terms_reload')
+def go_terms_reload(con, scale):
+    terms = make_terms(scale)
+    quietly(import_functions.insert_go_terms, terms, con=con)
+    return lambda: quietly(import_functions.insert_go_terms, terms, con=con)
+
+@benchmark('function_closure')
+def function_closure(con, scale):
+    quietly(import_functions.insert_go_terms, make_terms(scale), con=con)
+    return lambda: quietly(import_functions.update_function_closure, con=con)
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    return values[n // 2] if n % 2 == 1 else (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+
+def run(scale, repeat=3, names=None, directory=None, log=None):
+    """
+    Run the benchmarks, each against a new SQLite database in a temporary
+    directory, or in directory if given. Returns a report, as a dictionary
+    that can be saved as JSON.
+    """
+    log = log or (lambda message: None)
+    tmp = directory or tempfile.mkdtemp()
+    results = {}
+    try:
+        for name, f in BENCHMARKS:
+            if names and name not in names:
+                continue
+            path = os.path.join(tmp, name + '.db')
+            if os.path.exists(path):
+                os.remove(path)
+            con = scratch_db.create(path)
+            try:
+                scratch_db.add_species(con, 'Synthetic species', 'syn', [('chromosome', 5000000), ('plasmid', 500000)])
+                run_once = f(con, scale)
+                run_once()
+                times = []
+                for i in range(repeat):
+                    started = time.time()
+                    run_once()
+                    times.append((time.time() - started) * 1000)
+            finally:
+                con.close()
+            results[name] = {'runs':repeat, 'min_ms':round(min(times), 2), 'median_ms':round(median(times), 2),
+                             'max_ms':round(max(times), 2)}
+            log("%s: median %.1f ms" % (name, results[name]['median_ms'],))
+    finally:
+        if directory is None:
+            shutil.rmtree(tmp)
+    return {'time':time.time(), 'database':'sqlite', 'target':scale, 'repeat':repeat, 'results':results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the import scripts\' loaders against a scratch SQLite '
+                                                 'database. Names of benchmarks: ' +
+                                                 ", ".join([ name for name, f in BENCHMARKS ]))
+    parser.add_argument('--genes', type=int, default=5000, help='number of genes')
+    parser.add_argument('--terms', type=int, default=10000, help='number of GO terms')
+    parser.add_argument('--associations-per-gene', type=int, default=5, help='gene-function associations per gene')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random data')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each benchmark')
+    parser.add_argument('--only', action='append', default=None, help='run only the named benchmark, may be repeated')
+    parser.add_argument('--directory', default=None, help='keep the databases in this directory')
+    parser.add_argument('--output', default=None, help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    scale = {'genes':args.genes, 'terms':args.terms, 'associations_per_gene':args.associations_per_gene,
+             'seed':args.seed}
+    report = run(scale, args.repeat, args.only, args.directory, lambda message: sys.stderr.write(message + "\n"))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print json.dumps(report, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
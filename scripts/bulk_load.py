@@ -0,0 +1,320 @@
+##
+## Shared helpers for loading large amounts of data into the network portal's
+## DB. On PostgreSQL, rows are streamed in with COPY FROM STDIN. SQLite, used
+## for development and testing, gets executemany instead.
+##
+import os
+import sqlite3
+import time
+try:
+    import psycopg2
+except ImportError:
+    # only SQLite is available
+    psycopg2 = None
+
+DEFAULT_DSN = "dbname=network_portal user=dj_ango password=django"
+
+# rows to accumulate before writing them to the DB
+BATCH_SIZE = 10000
+
+
+def connect(dsn=None):
+    """
+    Connect to the network portal's DB. The connection string can be given or
+    set in the environment variable NETWORK_PORTAL_DSN. A string of the form
+    sqlite:<path> opens a SQLite database file.
+    """
+    dsn = dsn or os.environ.get('NETWORK_PORTAL_DSN', DEFAULT_DSN)
+    if dsn.startswith('sqlite:'):
+        return sqlite3.connect(dsn[len('sqlite:'):])
+    return psycopg2.connect(dsn)
+
+
+def is_sqlite(con):
+    return isinstance(con, sqlite3.Connection)
+
+
+def placeholders(con, n):
+    """
+    A comma separated list of n parameter placeholders in the style of the
+    connection's DB module.
+    """
+    return ", ".join(["?" if is_sqlite(con) else "%s"] * n)
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if value is True or value is False:
+        return 't' if value else 'f'
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class IteratorFile(object):
+    """
+    A read-only file-like object over rows produced by an iterator, formatted
+    for PostgreSQL's COPY text format, so rows can be copied into the DB
+    without building the whole input in memory.
+    """
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ""
+
+    def _line(self):
+        row = next(self.rows, None)
+        if row is None:
+            return ""
+        return "\t".join([ _copy_value(value) for value in row ]) + "\n"
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            line = self._line()
+            if not line:
+                break
+            self.buffer += line
+        if size < 0:
+            result, self.buffer = self.buffer, ""
+        else:
+            result, self.buffer = self.buffer[:size], self.buffer[size:]
+        return result
+
+    def readline(self, size=-1):
+        if not self.buffer:
+            self.buffer = self._line()
+        i = self.buffer.find("\n")
+        end = len(self.buffer) if i < 0 else i + 1
+        result, self.buffer = self.buffer[:end], self.buffer[end:]
+        return result
+
+
+def batches(rows, size=BATCH_SIZE):
+    """
+    Split an iterable of rows into lists of at most size rows.
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _quoted(columns):
+    return ", ".join([ '"%s"' % (column,) for column in columns ])
+
+
+def copy_rows(con, cur, table, columns, rows):
+    """
+    Insert rows into a table, with COPY on PostgreSQL or executemany on SQLite.
+    Returns the number of rows written.
+    """
+    rows = list(rows)
+    if is_sqlite(con):
+        cur.executemany("insert into %s (%s) values (%s)" % (table, ", ".join(columns), placeholders(con, len(columns)),), rows)
+    else:
+        cur.copy_expert("copy %s (%s) from stdin" % (table, _quoted(columns),), IteratorFile(rows))
+    return len(rows)
+
+
+# the columns of networks_gene we fill in from gene records. transcription_factor
+# is left alone, so curated values survive reloads.
+GENE_COLUMNS = ('species_id', 'chromosome_id', 'name', 'common_name', 'geneid', 'type', 'start', 'end', 'strand', 'description')
+
+
+def load_genes(con, species_id, chromosomes, genes, default_type='CDS'):
+    """
+    Load gene records, objects with the attributes name, chromosome,
+    common_name, geneid, type, start, end, strand and description, into the
+    networks_gene table, updating genes already in the table and inserting new
+    ones. Genes are identified by species and name, so loading the same genes
+    again changes nothing. chromosomes maps chromosome names to ids. If a name
+    occurs more than once, the last record wins.
+    Returns a tuple of (number of genes inserted, number changed).
+    Doesn't commit.
+    """
+    records = {}
+    for gene in genes:
+        records[gene.name] = (species_id, chromosomes[gene.chromosome], gene.name, gene.common_name, gene.geneid,
+                              gene.type or default_type, gene.start, gene.end, gene.strand, gene.description)
+    cur = con.cursor()
+    try:
+        if is_sqlite(con):
+            cur.execute("select %s from networks_gene where species_id=?" % (_quoted(GENE_COLUMNS),), (species_id,))
+            existing = dict([ (row[2], tuple(row)) for row in cur.fetchall() ])
+            # only update genes that changed
+            updates = [ r[1:2] + r[3:] + (species_id, r[2]) for name, r in records.items()
+                        if name in existing and existing[name] != r ]
+            inserts = [ r + (False,) for name, r in records.items() if name not in existing ]
+            cur.executemany("update networks_gene set %s where species_id=? and name=?" %
+                            (", ".join([ '"%s"=?' % (c,) for c in GENE_COLUMNS if c not in ('species_id', 'name') ]),),
+                            updates)
+            cur.executemany("insert into networks_gene (%s, transcription_factor) values (%s)" %
+                            (_quoted(GENE_COLUMNS), placeholders(con, len(GENE_COLUMNS) + 1),), inserts)
+            return len(inserts), len(updates)
+
+        # copy into a temporary table, then update matching genes and insert the rest
+        cur.execute("""
+            create temporary table tmp_genes
+            as select %s from networks_gene limit 0;""" % (_quoted(GENE_COLUMNS),))
+        cur.copy_expert("copy tmp_genes (%s) from stdin" % (_quoted(GENE_COLUMNS),), IteratorFile(records.values()))
+        cur.execute("""
+            update networks_gene g
+            set %s
+            from tmp_genes t
+            where g.species_id=t.species_id and g.name=t.name
+            and (%s);""" %
+            (", ".join([ '"%s"=t."%s"' % (c, c) for c in GENE_COLUMNS if c not in ('species_id', 'name') ]),
+             " or ".join([ 'g."%s" is distinct from t."%s"' % (c, c) for c in GENE_COLUMNS if c not in ('species_id', 'name') ]),))
+        updated = cur.rowcount
+        cur.execute("""
+            insert into networks_gene (%s, transcription_factor)
+            select %s, false from tmp_genes t
+            where not exists (
+              select 1 from networks_gene g
+              where g.species_id=t.species_id and g.name=t.name);""" %
+            (_quoted(GENE_COLUMNS), ", ".join([ 't."%s"' % (c,) for c in GENE_COLUMNS ]),))
+        inserted = cur.rowcount
+        cur.execute("drop table tmp_genes;")
+        return inserted, updated
+    finally:
+        cur.close()
+
+
+def get_species_id(con, species):
+    cur = con.cursor()
+    try:
+        cur.execute("select id from networks_species where name=%s;" % (placeholders(con, 1),), (species,))
+        return cur.fetchone()[0]
+    finally:
+        cur.close()
+
+
+def get_chromosome_ids(con, species_id):
+    """
+    Lookup table from chromosome name to id for a species.
+    """
+    cur = con.cursor()
+    try:
+        cur.execute("select name, id from networks_chromosome where species_id=%s" % (placeholders(con, 1),), (species_id,))
+        return dict(cur.fetchall())
+    finally:
+        cur.close()
+
+
+class AssociationWriter(object):
+    """
+    Accumulates gene-function associations and writes them to
+    networks_gene_function in batches. Associations are deduplicated on
+    (gene_id, function_id, source), both among those added and against those
+    already in the DB, so loading the same associations twice is harmless.
+    Call close() when done. Doesn't commit.
+    """
+    def __init__(self, con, batch_size=BATCH_SIZE):
+        self.con = con
+        self.batch_size = batch_size
+        self.seen = set()
+        self.batch = []
+        self.added = 0
+        self.written = 0
+        self.temp_table = False
+        self.started = time.time()
+        self.seconds = None
+
+    def add(self, gene_id, function_id, source):
+        self.added += 1
+        key = (gene_id, function_id, source)
+        if key in self.seen:
+            return
+        self.seen.add(key)
+        self.batch.append(key)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        cur = self.con.cursor()
+        try:
+            if is_sqlite(self.con):
+                cur.executemany("""
+                    insert into networks_gene_function (gene_id, function_id, source)
+                    select ?, ?, ?
+                    where not exists (
+                      select 1 from networks_gene_function
+                      where gene_id=? and function_id=? and source=?);""",
+                    [ row + row for row in self.batch ])
+                self.written += cur.rowcount
+            else:
+                if not self.temp_table:
+                    cur.execute("""
+                        create temporary table tmp_gene_function
+                        as select gene_id, function_id, source from networks_gene_function limit 0;""")
+                    self.temp_table = True
+                else:
+                    cur.execute("truncate tmp_gene_function;")
+                copy_rows(self.con, cur, 'tmp_gene_function', ('gene_id', 'function_id', 'source'), self.batch)
+                cur.execute("""
+                    insert into networks_gene_function (gene_id, function_id, source)
+                    select t.gene_id, t.function_id, t.source from tmp_gene_function t
+                    where not exists (
+                      select 1 from networks_gene_function gf
+                      where gf.gene_id=t.gene_id and gf.function_id=t.function_id and gf.source=t.source);""")
+                self.written += cur.rowcount
+            self.batch = []
+        finally:
+            cur.close()
+
+    def close(self):
+        """
+        Write any remaining associations. Returns the number of new
+        associations written.
+        """
+        self.flush()
+        if self.temp_table:
+            cur = self.con.cursor()
+            try:
+                cur.execute("drop table tmp_gene_function;")
+            finally:
+                cur.close()
+            self.temp_table = False
+        self.seconds = time.time() - self.started
+        return self.written
+
+    def report(self):
+        seconds = self.seconds if self.seconds is not None else time.time() - self.started
+        return "Wrote %d new gene-function associations of %d added (%d duplicates) in %.1f seconds, %.0f rows/second." % (
+            self.written, self.added, self.added - len(self.seen), seconds, self.added / seconds if seconds > 0 else 0,)
+
+
+def rebuild_function_closure(con):
+    """
+    Recompute the function_closure table, the transitive closure of the
+    function hierarchies, from the function_closure_paths view (see
+    web_app/networks/sql/function.sql). Returns the number of rows. Doesn't
+    commit.
+    """
+    cur = con.cursor()
+    try:
+        cur.execute("delete from function_closure;")
+        cur.execute("""
+            insert into function_closure (ancestor_id, descendant_id, depth, type)
+            select ancestor_id, descendant_id, depth, type from function_closure_paths;""")
+        return cur.rowcount
+    finally:
+        cur.close()
+
+
+def bump_cache_generation(con):
+    """
+    Invalidate everything the web app has cached, once an import is done
+    (see web_app/networks/caching.py). Doesn't commit.
+    """
+    cur = con.cursor()
+    try:
+        cur.execute("update cache_generation set generation=generation+1;")
+    finally:
+        cur.close()
@@ -39,13 +39,28 @@ and link dvu (dvu=DvH), mmp and halo genes to functions.
 > python import_functions.py --species hal --genome-info ../../data/hal/genomeInfo.microbesonline.txt
 
 Note that the genomeInfo file for dvu produces some "unknown gene" warnings. We should add those genes.
+
+GO terms can be reloaded from a new release without dropping anything:
+--go-terms only writes the terms, relationships and alt_ids that changed.
+
+Alternatively, list all of the above in a JSON manifest (see read_manifest)
+and load them in a single run, parsing files in parallel:
+
+> python import_functions.py --manifest ../../data/functions_manifest.json
+
+The insert_* functions take an optional connection, which they use instead
+of opening their own, and leave open.
 """
 
 import argparse
-import psycopg2
+import bulk_load
+import json
+import multiprocessing
+import os
 from species import species_dict
 from open_struct import OpenStruct
 import re
+import time
 
 
 def read_kegg_pathways(filename):
@@ -179,6 +194,15 @@ def read_microbes_online_genome_info(filename):
 def read_go_terms(filename):
     """
     Read a file of GO (gene ontology) terms and return a list of term objects.
+    See iter_go_terms.
+    """
+    return list(iter_go_terms(filename))
+
+
+def iter_go_terms(filename):
+    """
+    Read a file of GO (gene ontology) terms, yielding term objects one at a
+    time as they're read, so the whole ontology needn't be held in memory.
     Based on the ontology file OBO v1.2 downloaded from http://www.geneontology.org/.
     format-version: 1.2
     date: 27:10:2011 14:45
@@ -200,9 +224,6 @@ def read_go_terms(filename):
     # Trailing Modifiers
     # {<name>=<value>, <name=value>, <name=value>}
 
-    # we'll be making and returning a list of term objects
-    terms = []
-
     with open(filename, 'r') as f:
         
         in_term_stanza = False
@@ -216,6 +237,7 @@ def read_go_terms(filename):
                 if line=="":
                     # blank line ends stanza
                     in_term_stanza = False
+                    yield term
                 else:
                     # capture a key/value pair
                     [key,rest] = line.split(': ',1)
@@ -243,9 +265,10 @@ def read_go_terms(filename):
             elif line=="[Term]":
                 in_term_stanza = True
                 term = OpenStruct()
-                terms.append(term)
 
-    return terms
+        # the last stanza may end with the file
+        if in_term_stanza:
+            yield term
 
 
 # no longer used
@@ -402,7 +425,7 @@ def read_cog_categories(filename):
             cog_categories.append(c)
     return cog_categories
 
-def insert_kegg_pathways(pathways):
+def insert_kegg_pathways(pathways, con=None):
     """
     Insert KEGG pathways into DB.
     pathways: a nested list structure as returned by read_kegg_pathways(...).
@@ -410,7 +433,9 @@ def insert_kegg_pathways(pathways):
     and its system of categories and subcategories.
     """
 
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
+    own_con = con is None
+    if own_con:
+        con = bulk_load.connect()
     cur = None
 
     try:
@@ -473,10 +498,10 @@ def insert_kegg_pathways(pathways):
 
     finally:
         if (cur): cur.close()
-        if (con): con.close()
+        if (own_con): con.close()
 
 
-def insert_global_kegg_pathways():
+def insert_global_kegg_pathways(con=None):
     """
     Global pathways are listed on the pathways page: http://www.genome.jp/kegg/pathway.html
     ...but are not in the file we're loading the rest of the pathways from, so let's add
@@ -493,8 +518,31 @@ def insert_global_kegg_pathways():
          ]}
     ]}]
     
-    insert_kegg_pathways(pathways)
+    insert_kegg_pathways(pathways, con)
 
+# lookup tables are cached here while running a pipeline, once all function
+# terms are in the DB. None means don't cache.
+_lookup_cache = None
+
+
+def cached_lookup(f):
+    """
+    Decorator for functions that look up IDs with a cursor. While caching is
+    on, each lookup is done once and the result shared.
+    """
+    def lookup(cur, *args):
+        if _lookup_cache is None:
+            return f(cur, *args)
+        key = (f.__name__,) + args
+        if key not in _lookup_cache:
+            _lookup_cache[key] = f(cur, *args)
+        return _lookup_cache[key]
+    lookup.__name__ = f.__name__
+    lookup.__doc__ = f.__doc__
+    return lookup
+
+
+@cached_lookup
 def get_species_id(cur, name):
     cur.execute("""
         select id from networks_species where name = %s;
@@ -503,6 +551,7 @@ def get_species_id(cur, name):
     return cur.fetchone()[0]
 
 
+@cached_lookup
 def get_gene_id_lookup_table(cur, species_id):
     """
     create lookup table for finding gene id by name
@@ -517,6 +566,7 @@ def get_gene_id_lookup_table(cur, species_id):
     return gene_ids
 
 
+@cached_lookup
 def get_function_id_lookup_table(cur, type):
     """
     Create a dictionary for looking up function IDs by their native_id, the ID
@@ -535,7 +585,7 @@ def get_kegg_pathways():
     """
     Get KEGG pathways from the database.
     """
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
+    con = bulk_load.connect()
     cur = None
 
     try:
@@ -556,7 +606,7 @@ def get_gene_ids(species):
     """
     Get a list of genes for an organism for testing
     """
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
+    con = bulk_load.connect()
     cur = None
 
     try:
@@ -567,14 +617,16 @@ def get_gene_ids(species):
         if (cur): cur.close()
         if (con): con.close()
 
+@cached_lookup
 def get_go_function_id_lookup_table(cur):
     """
     Create a dictionary for looking up GO function IDs by their native_id or alt_id
     """
-    function_ids = get_function_id_lookup_table(cur, 'go')   
+    # copy, so as not to add alt_ids to a cached table
+    function_ids = dict(get_function_id_lookup_table(cur, 'go'))
     cur.execute("""
         select target_id, name from networks_synonym where target_type='function' and type = 'go:alt_id';
-        """, (type,))
+        """)
     for row in cur:
         # it should never happen that an alt_id is also an id, but check anyway.
         if row[1] not in function_ids:
@@ -601,16 +653,19 @@ class Lookup:
     def __repr__(self):
         return __str__(self)
 
-def insert_gene_kegg_function_associations(gene_kegg_pathways, species, translate_genes=Lookup()):
+def insert_gene_kegg_function_associations(gene_kegg_pathways, species, translate_genes=Lookup(), batch_size=bulk_load.BATCH_SIZE, con=None):
     """
     Insert mappings from genes to KEGG pathways.
     gene_kegg_pathways: a map from gene name to a list of pathways as returned by read_gene_kegg_pathways
     species: the name of a species in the database
     translate_genes: a function that takes a gene name and returns the name of
     a gene in the database. Some gene names will need to be translated.
+    batch_size: number of associations to write to the DB at a time
     """
 
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
+    own_con = con is None
+    if own_con:
+        con = bulk_load.connect()
     cur = None
 
     try:
@@ -629,6 +684,7 @@ def insert_gene_kegg_function_associations(gene_kegg_pathways, species, translat
         # create gene id lookup table
         genes = get_gene_id_lookup_table(cur, species_id)
         
+        writer = bulk_load.AssociationWriter(con, batch_size)
         gene_count = 0
         pathway_count = 0
         for gene in gene_kegg_pathways:
@@ -650,51 +706,56 @@ def insert_gene_kegg_function_associations(gene_kegg_pathways, species, translat
                 else:
                     raise Exception("Unknown gene: " + gene)
 
-                cur.execute("""
-                    insert into networks_gene_function
-                    (function_id, gene_id, source)
-                    values (%s, %s, %s)
-                    """,
-                    (function_id, gene_id, 'kegg'))
+                writer.add(gene_id, function_id, 'kegg')
                 pathway_count += 1
-                
+
+        writer.close()
         print "Added %d genes to %d pathways." % (gene_count, pathway_count,)
-        
+        print writer.report()
+
         con.commit()
 
     finally:
         if (cur): cur.close()
-        if (con): con.close()
+        if (own_con): con.close()
 
 
-def insert_go_terms(terms):
+def insert_go_terms(terms, con=None, batch_size=bulk_load.BATCH_SIZE):
     """
-    Takes a list of term objects as returned by read_go_terms and inserts
-    them into the DB. Also inserts relationships.
+    Takes term objects as produced by iter_go_terms or read_go_terms and loads
+    them into the DB, along with their relationships and alt_ids (as
+    synonyms). Terms are compared with the GO terms already in the DB, and
+    only new or changed terms, relationships and synonyms are written, so
+    loading a new GO release touches only what changed. Terms missing from
+    the new release are marked obsolete. New terms are written in batches of
+    batch_size. Only the relationships and alt_ids of the terms are kept in
+    memory, not the terms themselves.
     """
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
+    own_con = con is None
+    if own_con:
+        con = bulk_load.connect()
     cur = None
+    # parameter placeholder
+    p = bulk_load.placeholders(con, 1)
 
     try:
         cur = con.cursor()
-        
-        # insert go terms
-        ids = {}
-        for term in terms:
-            cur.execute("""
-                insert into networks_function 
-                (native_id, name, namespace, description, obsolete, type)
-                values (%s, %s, %s, %s, %s, %s) RETURNING id;""",
-                (term.id,
-                 term.name,
-                 term.namespace,
-                 term['def'],
-                 True if term.is_obsolete else False,
-                 'go',))
-            function_id = cur.fetchone()[0]
-            ids[term.id] = function_id
-        
-        # second pass to insert relationships
+
+        # the GO terms already in the DB, by GO id
+        cur.execute("""
+            select native_id, id, name, namespace, description, obsolete
+            from networks_function where type='go';""")
+        existing = dict([ (row[0], row[1:]) for row in cur.fetchall() ])
+
+        columns = ('native_id', 'name', 'namespace', 'description', 'obsolete', 'type')
+        new_terms = []
+        updates = []
+        relationships = set()
+        alt_ids = set()
+        seen = set()
+        count_terms = 0
+        count_new = 0
+
         # keys are in { id, alt_id,
         #               name, namespace,
         #               def, comment,
@@ -702,49 +763,79 @@ def insert_go_terms(terms):
         #               is_obsolete, replaced_by, consider,
         #               synonym, is_a, subset, disjoint_from, relationship, intersection_of,
         #               xref }
-        count_is_a = 0
-        count_relationships = 0
-        count_synonyms = 0
         for term in terms:
-            function_id = ids[term.id]
-            if 'is_a' in term:
-                for parent in term.get_as_list('is_a'):
-                    target_id = ids[parent]
-                    cur.execute("""
-                        insert into networks_function_relationships
-                        (function_id, target_id, type)
-                        values (%s, %s, %s)
-                        """,
-                        (function_id, target_id, 'is_a',))
-                    count_is_a += 1
-            if 'relationship' in term:
-                for value in term.get_as_list('relationship'):
-                    # so far as I've seen, relationships are of the form: [relation] GO:\d+
-                    [relation, target] = value.split(' ', 1)
-                    target_id = ids[target]
-                    cur.execute("""
-                        insert into networks_function_relationships
-                        (function_id, target_id, type)
-                        values (%s, %s, %s)
-                        """,
-                        (function_id, target_id, relation,))
-                    count_relationships += 1
-            if 'alt_id' in term:
-                for alt_id in term.get_as_list('alt_id'):
-                    cur.execute("""
-                        insert into networks_synonym
-                        (target_id, target_type, name, type)
-                        values (%s, %s, %s, %s)
-                        """,
-                        (function_id, 'function', alt_id, 'go:alt_id',))
-                    count_synonyms += 1
+            count_terms += 1
+            seen.add(term.id)
+            values = (term.name, term.namespace, term['def'], True if term.is_obsolete else False)
+            if term.id not in existing:
+                new_terms.append((term.id,) + values + ('go',))
+                if len(new_terms) >= batch_size:
+                    count_new += bulk_load.copy_rows(con, cur, 'networks_function', columns, new_terms)
+                    new_terms = []
+            elif tuple(existing[term.id][1:]) != values:
+                updates.append(values + (existing[term.id][0],))
+
+            for parent in term.get_as_list('is_a'):
+                relationships.add((term.id, parent, 'is_a'))
+            for value in term.get_as_list('relationship'):
+                # so far as I've seen, relationships are of the form: [relation] GO:\d+
+                [relation, target] = value.split(' ', 1)
+                relationships.add((term.id, target, relation))
+            for alt_id in term.get_as_list('alt_id'):
+                alt_ids.add((term.id, alt_id))
+
+        count_new += bulk_load.copy_rows(con, cur, 'networks_function', columns, new_terms)
+        cur.executemany("""
+            update networks_function
+            set name=%(p)s, namespace=%(p)s, description=%(p)s, obsolete=%(p)s
+            where id=%(p)s;""" % {'p':p}, updates)
+
+        # terms dropped from the ontology
+        dropped = [ (row[0],) for native_id, row in existing.items() if native_id not in seen and not row[4] ]
+        cur.executemany("update networks_function set obsolete=%s where id=%s;" % (p, p,),
+                        [ (True,) + row for row in dropped ])
+
+        # now that all terms are in, relationships and synonyms can refer to them by DB id
+        cur.execute("select native_id, id from networks_function where type='go';")
+        ids = dict(cur.fetchall())
+
+        cur.execute("""
+            select r.function_id, r.target_id, r.type
+            from networks_function_relationships r join networks_function f on r.function_id=f.id
+            where f.type='go';""")
+        existing_relationships = set(cur.fetchall())
+        relationships = set([ (ids[a], ids[b], relation) for a, b, relation in relationships ])
+        new_relationships = relationships - existing_relationships
+        for batch in bulk_load.batches(new_relationships, batch_size):
+            bulk_load.copy_rows(con, cur, 'networks_function_relationships', ('function_id', 'target_id', 'type'), batch)
+        cur.executemany("""
+            delete from networks_function_relationships
+            where function_id=%(p)s and target_id=%(p)s and type=%(p)s;""" % {'p':p},
+            list(existing_relationships - relationships))
+
+        cur.execute("""
+            select target_id, name from networks_synonym
+            where target_type='function' and type='go:alt_id';""")
+        existing_alt_ids = set(cur.fetchall())
+        alt_ids = set([ (ids[term_id], alt_id) for term_id, alt_id in alt_ids ])
+        new_alt_ids = alt_ids - existing_alt_ids
+        for batch in bulk_load.batches(new_alt_ids, batch_size):
+            bulk_load.copy_rows(con, cur, 'networks_synonym', ('target_id', 'target_type', 'name', 'type'),
+                                [ (target_id, 'function', alt_id, 'go:alt_id') for target_id, alt_id in batch ])
+        cur.executemany("""
+            delete from networks_synonym
+            where target_id=%(p)s and name=%(p)s and target_type='function' and type='go:alt_id';""" % {'p':p},
+            list(existing_alt_ids - alt_ids))
 
         con.commit()
-        print "Inserted %d is_a relationships, %d synonyms (alt_id's) and %d other relationships." % (count_is_a, count_synonyms, count_relationships,)
+        print "Read %d GO terms: %d new, %d changed, %d made obsolete." % (count_terms, count_new, len(updates), len(dropped),)
+        print "Relationships: %d added, %d removed. Synonyms (alt_id's): %d added, %d removed." % (
+            len(new_relationships), len(existing_relationships - relationships),
+            len(new_alt_ids), len(existing_alt_ids - alt_ids),)
 
     finally:
         if (cur): cur.close()
-        if (con): con.close()
+        if (own_con): con.close()
 
 # no longer used
 def insert_tigrfams_by_role(tigrfams):
@@ -755,7 +846,7 @@ def insert_tigrfams_by_role(tigrfams):
     Note the TIGRFams flat file is more complete than the TIGRFams by role file.
     """
 
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
+    con = bulk_load.connect()
     cur = None
 
     try:
@@ -824,12 +915,14 @@ def insert_tigrfams_by_role(tigrfams):
         if (con): con.close()
 
 
-def insert_tigrfams(tigrfams):
+def insert_tigrfams(tigrfams, con=None):
     """
     Insert the flat list of TIGRFams as returned by read_tigrfams.
     Note the TIGRFams flat file is more complete than the TIGRFams by role file.
     """
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
+    own_con = con is None
+    if own_con:
+        con = bulk_load.connect()
     cur = None
 
     try:
@@ -858,16 +951,18 @@ def insert_tigrfams(tigrfams):
 
     finally:
         if (cur): cur.close()
-        if (con): con.close()
+        if (own_con): con.close()
 
 
-def insert_tigr_roles(mainroles):
+def insert_tigr_roles(mainroles, con=None):
     """
     Insert mainroles and subroles from the TIGR role hierarchy into the DB.
     Updates roles by adding .function_id attribute, later used to link TIGRFams
     with roles. [SNEAKY SIDE EFFECT]
     """
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
+    own_con = con is None
+    if own_con:
+        con = bulk_load.connect()
     cur = None
 
     try:
@@ -910,15 +1005,17 @@ def insert_tigr_roles(mainroles):
 
     finally:
         if (cur): cur.close()
-        if (con): con.close()
+        if (own_con): con.close()
 
 
-def insert_tigrfam_role_associations(links, roles_by_id):
+def insert_tigrfam_role_associations(links, roles_by_id, con=None):
     """
     Associate TIGRFams with TIGR roles using the SNEAKY SIDE EFFECT from
     insert_tigr_roles, which adds function_ids to the roles.
     """
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
+    own_con = con is None
+    if own_con:
+        con = bulk_load.connect()
     cur = None
     
     try:
@@ -943,7 +1040,7 @@ def insert_tigrfam_role_associations(links, roles_by_id):
 
     finally:
         if (cur): cur.close()
-        if (con): con.close()
+        if (own_con): con.close()
 
 
 # def insert_cogs(cogs):
@@ -980,12 +1077,14 @@ def insert_tigrfam_role_associations(links, roles_by_id):
 #         if (cur): cur.close()
 #         if (con): con.close()
 
-def insert_cogs(cog_categories):
+def insert_cogs(cog_categories, con=None):
     """
     Takes a list of COG objects as returned by read_cogs with an id and a
     description and inserts them into the networks_function table in the DB.
     """
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
+    own_con = con is None
+    if own_con:
+        con = bulk_load.connect()
     cur = None
     
     try:
@@ -1031,9 +1130,9 @@ def insert_cogs(cog_categories):
 
     finally:
         if (cur): cur.close()
-        if (con): con.close()
+        if (own_con): con.close()
 
-def map_genes_to_go_cog_and_tigr_terms(genes, species):
+def map_genes_to_go_cog_and_tigr_terms(genes, species, batch_size=bulk_load.BATCH_SIZE, con=None):
     """
     Takes a list of gene objects as returned by the function read_microbes_online_genome_info
     and creates associations between genes and GO terms.
@@ -1042,8 +1141,11 @@ def map_genes_to_go_cog_and_tigr_terms(genes, species):
     scaffoldId, start, stop, strand,
     sysName, name, desc,
     COG, COGFun, COGDesc, TIGRFam, TIGRRoles, GO, EC, ECDesc
+    batch_size is the number of associations to write to the DB at a time.
     """
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
+    own_con = con is None
+    if own_con:
+        con = bulk_load.connect()
     cur = None
 
     try:
@@ -1056,7 +1158,7 @@ def map_genes_to_go_cog_and_tigr_terms(genes, species):
         cog_function_ids = get_function_id_lookup_table(cur, 'cog')
         tigr_function_ids = get_function_id_lookup_table(cur, 'tigr')
         
-        count_inserts = 0
+        writer = bulk_load.AssociationWriter(con, batch_size)
         for gene in genes:
 
             # find the gene ID
@@ -1084,13 +1186,7 @@ def map_genes_to_go_cog_and_tigr_terms(genes, species):
                 unique_function_ids = set([ go_function_ids[id] for id in gene_go_ids])
                 
                 for function_id in unique_function_ids:
-                    cur.execute("""
-                        insert into networks_gene_function
-                        (function_id, gene_id, source)
-                        values (%s, %s, %s)
-                        """,
-                        (function_id, gene_id, 'microbes online'))
-                    count_inserts += 1
+                    writer.add(gene_id, function_id, 'microbes online')
             
             if len(gene.COG.strip()) > 0:
                 gene_cog_ids = gene.COG.split(',')
@@ -1105,13 +1201,7 @@ def map_genes_to_go_cog_and_tigr_terms(genes, species):
                         function_id = cog_function_ids[fixed_id]
                     else:
                         raise Exception("Unknown COG ID: " + id + "/" + fixed_id)
-                    cur.execute("""
-                        insert into networks_gene_function
-                        (function_id, gene_id, source)
-                        values (%s, %s, %s)
-                        """,
-                        (function_id, gene_id, 'microbes online'))
-                    count_inserts += 1
+                    writer.add(gene_id, function_id, 'microbes online')
 
             if len(gene.TIGRFam.strip()) > 0:
                 tigrfam_id = gene.TIGRFam.split(' ', 1)[0]
@@ -1119,20 +1209,16 @@ def map_genes_to_go_cog_and_tigr_terms(genes, species):
                     function_id = tigr_function_ids[tigrfam_id]
                 else:
                     raise Exception("Unknown TIGRFam ID: " + tigrfam_id)
-                cur.execute("""
-                    insert into networks_gene_function
-                    (function_id, gene_id, source)
-                    values (%s, %s, %s)
-                    """,
-                    (function_id, gene_id, 'microbes online'))
-                count_inserts += 1
+                writer.add(gene_id, function_id, 'microbes online')
 
+        writer.close()
         con.commit()
-        print "Inserted %d functions for %d genes." % (count_inserts,len(genes),)
+        print "Inserted %d functions for %d genes." % (writer.written, len(genes),)
+        print writer.report()
 
     finally:
         if (cur): cur.close()
-        if (con): con.close()
+        if (own_con): con.close()
         
 
 
@@ -1162,6 +1248,175 @@ def print_tigrfams_by_role(tigrfams):
                 print tigrfam.id + " " + tigrfam.name
 
 
+def update_function_closure(con=None):
+    """
+    Rebuild the function_closure table after loading functions or their
+    relationships.
+    """
+    own_con = con is None
+    if own_con:
+        con = bulk_load.connect()
+
+    try:
+        count = bulk_load.rebuild_function_closure(con)
+        con.commit()
+        print "Rebuilt function closure: %d ancestor/descendant pairs." % (count,)
+
+    finally:
+        if (own_con): con.close()
+
+
+def invalidate_cache(con=None):
+    """
+    Tell the web app that its cached pages are out of date.
+    """
+    own_con = con is None
+    if own_con:
+        con = bulk_load.connect()
+
+    try:
+        bulk_load.bump_cache_generation(con)
+        con.commit()
+
+    finally:
+        if (own_con): con.close()
+
+
+def kegg_gene_name_translations(species):
+    """
+    A Lookup translating KEGG's names for a species' genes to those in the DB.
+    """
+    if species=='Desulfovibrio vulgaris Hildenborough':
+        return Lookup({'DVU_tRNA-SeC_p_-1':'DVU_tRNA-SeC(p)-1'})
+    return Lookup()
+
+
+# readers for the files that can be listed in a pipeline manifest
+FUNCTION_READERS = {
+    'kegg_pathways': read_kegg_pathways,
+    'go_terms': read_go_terms,
+    'cogs': read_cogs,
+    'cog_categories': read_cog_categories,
+    'tigrfams': read_tigrfams,
+    'tigr_roles': read_tigr_roles,
+    'tigrfam_role_links': read_tigrfam_role_links,
+}
+GENE_READERS = {
+    'kegg_gene_pathways': read_gene_kegg_pathways,
+    'genome_info': read_microbes_online_genome_info,
+}
+
+
+def read_manifest(filename):
+    """
+    Read a pipeline manifest, a JSON file listing the files to import. Keys
+    are those of FUNCTION_READERS, plus "species", mapping species keys from
+    species_dict to files named by the keys of GENE_READERS, for example:
+    {
+      "kegg_pathways": "ko00001.keg",
+      "go_terms": "gene_ontology_ext.obo.txt",
+      "cog_categories": "cog_categories.txt", "cogs": "COG_whog",
+      "tigrfams": "tigrfam_table.txt",
+      "tigr_roles": "TIGR_ROLE_NAMES", "tigrfam_role_links": "TIGRFAMS_ROLE_LINK",
+      "species": {
+        "mmp": {"kegg_gene_pathways": "mmp/kegg/mmp_pathway.list",
+                "genome_info": "mmp/genomeInfo.microbesonline.txt"}
+      }
+    }
+    Relative paths are relative to the manifest's directory.
+    """
+    with open(filename, 'r') as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(filename))
+    path = lambda name: os.path.join(base, name)
+
+    sources = {}
+    for key, value in manifest.items():
+        if key == 'species':
+            continue
+        if key not in FUNCTION_READERS:
+            raise Exception("Unknown source in manifest: " + key)
+        sources[key] = path(value)
+    for species_key, files in manifest.get('species', {}).items():
+        if species_key not in species_dict:
+            raise Exception("Don't know species: " + species_key)
+        for key, value in files.items():
+            if key not in GENE_READERS:
+                raise Exception("Unknown source in manifest for species %s: %s" % (species_key, key,))
+            sources[(species_key, key)] = path(value)
+
+    # these come in pairs
+    if ('cogs' in sources) ^ ('cog_categories' in sources):
+        raise Exception("Manifest should list cogs and cog_categories together!")
+    if ('tigr_roles' in sources) ^ ('tigrfam_role_links' in sources):
+        raise Exception("Manifest should list tigr_roles and tigrfam_role_links together!")
+    return sources
+
+
+def run_pipeline(sources, processes=None, batch_size=bulk_load.BATCH_SIZE):
+    """
+    Import everything listed in a manifest in one go. Files are parsed
+    concurrently in a pool of processes, while the parsed data is written to
+    the DB over a single connection, in dependency order: function terms
+    first, then their relationships, then gene associations. Lookup tables
+    of IDs are cached once the function terms are in.
+    """
+    global _lookup_cache
+    started = time.time()
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        parsed = {}
+        for key, filename in sources.items():
+            # GO terms are streamed straight from the file into the DB, below
+            if key == 'go_terms':
+                continue
+            reader = FUNCTION_READERS[key] if key in FUNCTION_READERS else GENE_READERS[key[1]]
+            parsed[key] = pool.apply_async(reader, (filename,))
+        pool.close()
+
+        def get(key):
+            return parsed[key].get()
+
+        con = bulk_load.connect()
+        try:
+            # function terms and their hierarchies
+            if 'kegg_pathways' in parsed:
+                insert_kegg_pathways(get('kegg_pathways'), con)
+                insert_global_kegg_pathways(con)
+            if 'go_terms' in sources:
+                insert_go_terms(iter_go_terms(sources['go_terms']), con, batch_size)
+            if 'cogs' in parsed:
+                insert_cogs(get('cog_categories') + get('cogs'), con)
+            if 'tigrfams' in parsed:
+                insert_tigrfams(get('tigrfams'), con)
+            if 'tigr_roles' in parsed:
+                [mainroles, roles_by_id] = get('tigr_roles')
+                insert_tigr_roles(mainroles, con)
+                insert_tigrfam_role_associations(get('tigrfam_role_links'), roles_by_id, con)
+            update_function_closure(con)
+
+            # gene associations, with lookups cached from here on
+            _lookup_cache = {}
+            for key in sorted([ key for key in parsed if isinstance(key, tuple) ]):
+                species_key, source = key
+                species = species_dict[species_key].name
+                print "%s: %s" % (species_key, source,)
+                if source == 'kegg_gene_pathways':
+                    insert_gene_kegg_function_associations(get(key), species, kegg_gene_name_translations(species), batch_size, con)
+                else:
+                    map_genes_to_go_cog_and_tigr_terms(get(key), species, batch_size, con)
+            invalidate_cache(con)
+        finally:
+            _lookup_cache = None
+            con.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    print "Imported %d files in %.1f seconds." % (len(sources), time.time() - started,)
+
+
 def main():
     parser = argparse.ArgumentParser(description='Import gene functions into the network portal\'s DB')
     #parser.add_argument('filenames', metavar='FILE', nargs='*', help='filenames containing function data')
@@ -1177,10 +1432,17 @@ def main():
     parser.add_argument('--cog-categories', metavar='COG_CATEGORIES_FILE', help='import COG functional categories')
     parser.add_argument('-s', '--species', help='for example, hal for halo')
     parser.add_argument('--test', action='store_true', help='Print list functions, rather than adding them to the db')
+    parser.add_argument('--manifest', metavar='MANIFEST_FILE', help='import all the files listed in a JSON manifest in one go. See read_manifest.')
+    parser.add_argument('--processes', type=int, help='number of processes for parsing files listed in a manifest')
+    parser.add_argument('--batch-size', type=int, default=bulk_load.BATCH_SIZE, help='number of gene-function associations to write to the DB at a time')
     parser.add_argument('--list-species', action='store_true', help='Print list of known species. You might have to add one.')
     parser.add_argument('--list-kegg-pathways', action='store_true', help='Print list of KEGG pathways in the DB.')
     args = parser.parse_args()
     
+    if args.manifest:
+        run_pipeline(read_manifest(args.manifest), args.processes, args.batch_size)
+        return
+
     if not ( args.kegg_pathways or args.kegg_gene_pathways or args.go_terms or args.genome_info or
              args.tigrfams or args.tigr_roles or args.tigrfam_role_links or
              args.cogs or args.cog_categories or args.list_species or args.list_kegg_pathways):
@@ -1230,13 +1492,13 @@ def main():
 
     # import GO gene ontology terms
     if args.go_terms:
-        terms = read_go_terms(args.go_terms)
-        print "Read %d GO terms." % (len(terms),)
         if args.test:
+            terms = read_go_terms(args.go_terms)
+            print "Read %d GO terms." % (len(terms),)
             for term in terms:
                 print str(term)
         else:
-            insert_go_terms(terms)
+            insert_go_terms(iter_go_terms(args.go_terms), batch_size=args.batch_size)
     
     # import TIGRFams from flat file
     if args.tigrfams:
@@ -1285,6 +1547,10 @@ def main():
         else:
             insert_cogs(cog_categories + cogs)
 
+    # keep the closure of the function hierarchies up to date
+    if not args.test and (args.kegg_pathways or args.go_terms or args.tigrfams or args.tigr_roles or args.cogs):
+        update_function_closure()
+
     # map genes to kegg pathways
     if args.kegg_gene_pathways:
         gene_kegg_pathways = read_gene_kegg_pathways(args.kegg_gene_pathways)
@@ -1313,11 +1579,7 @@ def main():
                 print "Some genes not in DB, missing: %d out of %d." % (len(genes_in_db) - sum(genes_in_db),len(gene_kegg_pathways.keys()),)
                         
         else:
-            if species=='Desulfovibrio vulgaris Hildenborough':
-                translate_genes = Lookup({'DVU_tRNA-SeC_p_-1':'DVU_tRNA-SeC(p)-1'})
-            else:
-                translate_genes = Lookup()
-            insert_gene_kegg_function_associations(gene_kegg_pathways, species, translate_genes)
+            insert_gene_kegg_function_associations(gene_kegg_pathways, species, kegg_gene_name_translations(species), args.batch_size)
 
     # map genes to GO COG and TIGR functions
     if args.genome_info:
@@ -1326,7 +1588,11 @@ def main():
             for gene in genes:
                 print str(gene)
         else:
-            map_genes_to_go_cog_and_tigr_terms(genes, species)
+            map_genes_to_go_cog_and_tigr_terms(genes, species, args.batch_size)
+
+    if not args.test and (args.kegg_pathways or args.go_terms or args.tigrfams or args.tigr_roles or
+                          args.cogs or args.kegg_gene_pathways or args.genome_info):
+        invalidate_cache()
 
 
 if __name__ == "__main__":
@@ -5,7 +5,7 @@
 ## but it's written as a one-off
 ##
 import sys
-import psycopg2
+import bulk_load
 
 data_dir = '../data/dvu'
 genes_chromosome_file = 'proteins_chromosome.tsv'
@@ -157,48 +157,30 @@ def missing_genes(genes=None):
 # create user network_portal_user login password 'monkey2us';
 # create user dj_ango login password 'django';
 def insert_genes_into_postgres(genes, species):
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
-    cur = None
-    
-    try:
-        cur = con.cursor()
+    """
+    Load genes into the DB in bulk. Genes already loaded for the species are
+    updated, so running the import again is harmless.
+    """
+    con = bulk_load.connect()
 
-        # get id for species
-        cur.execute("select id from networks_species where name=%s;", (species,))
-        species_id = cur.fetchone()[0]
+    try:
+        species_id = bulk_load.get_species_id(con, species)
         print("id for species %s = %d.\n" % (species, species_id))
 
         # get lookup table for chromosomes
-        cur.execute("select name, id from networks_chromosome where species_id=%s", (species_id,))
-        chromosomes = {}
-        for row in cur:
-            chromosomes[row[0]] = row[1]
+        chromosomes = bulk_load.get_chromosome_ids(con, species_id)
 
         print("chromosome lookup table:")
         print(chromosomes)
         print("\n")
 
-        for gene in genes:
-            cur.execute("""
-                insert into networks_gene 
-                (species_id, chromosome_id, name, common_name, geneid, type, "start", "end", strand, description)
-                values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);""",
-                (species_id,
-                 chromosomes[gene.chromosome],
-                 gene.name,
-                 gene.common_name,
-                 gene.geneid,
-                 "CDS",
-                 gene.start,
-                 gene.end,
-                 gene.strand,
-                 gene.description,))
+        inserted, updated = bulk_load.load_genes(con, species_id, chromosomes, genes)
+        bulk_load.bump_cache_generation(con)
         con.commit()
+        print("inserted %d genes, updated %d.\n" % (inserted, updated))
 
-        
     finally:
-        if (cur): cur.close()
-        if (con): con.close()
+        con.close()
 
 
 def fix_gene_ids():
@@ -207,7 +189,7 @@ def fix_gene_ids():
     read_genes( data_dir + '/' + genes_chromosome_file, genes=genes, chromosome='chromosome' )
     read_genes( data_dir + '/' + genes_plasmid_file, genes=genes, chromosome='pDV' )
 
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
+    con = bulk_load.connect()
     cur = None
     
     try:
@@ -2,7 +2,7 @@
 ## load gene annotations from NCBI into postgres
 ##
 import sys
-import psycopg2
+import bulk_load
 import argparse
 import re
 from species import species_dict
@@ -25,47 +25,30 @@ from open_struct import OpenStruct
 
 
 def insert_genes_into_postgres(genes, species):
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
-    cur = None
+    """
+    Load genes into the DB in bulk. Genes already loaded for the species are
+    updated, so running the import again is harmless.
+    """
+    con = bulk_load.connect()
 
     try:
-        cur = con.cursor()
-
-        # get id for species
-        cur.execute("select id from networks_species where name=%s;", (species,))
-        species_id = cur.fetchone()[0]
+        species_id = bulk_load.get_species_id(con, species)
         print("id for species %s = %d.\n" % (species, species_id))
 
         # get lookup table for chromosomes
-        cur.execute("select name, id from networks_chromosome where species_id=%s", (species_id,))
-        chromosomes = {}
-        for row in cur:
-            chromosomes[row[0]] = row[1]
+        chromosomes = bulk_load.get_chromosome_ids(con, species_id)
 
         print("chromosome lookup table:")
         print(chromosomes)
         print("\n")
 
-        for gene in genes:
-            cur.execute("""
-                insert into networks_gene 
-                (species_id, chromosome_id, name, common_name, geneid, type, "start", "end", strand, description)
-                values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);""",
-                (species_id,
-                 chromosomes[gene.chromosome],
-                 gene.name,
-                 gene.common_name,
-                 gene.geneid,
-                 gene.type,
-                 gene.start,
-                 gene.end,
-                 gene.strand,
-                 gene.description,))
+        inserted, updated = bulk_load.load_genes(con, species_id, chromosomes, genes)
+        bulk_load.bump_cache_generation(con)
         con.commit()
+        print("inserted %d genes, updated %d.\n" % (inserted, updated))
 
     finally:
-        if (cur): cur.close()
-        if (con): con.close()
+        con.close()
 
 
 def guess_rna_gene_type(description):
@@ -148,27 +131,18 @@ def read_genes(filename, chromosome=None, chromosome_map=None, rna=False):
 
 
 def get_chromosome_names(species=None, species_id=None):
-    con = psycopg2.connect("dbname=network_portal user=dj_ango password=django")
-    cur = None
+    con = bulk_load.connect()
 
     try:
-        cur = con.cursor()
-
         # get id for species
         if species_id==None:
-            cur.execute("select id from networks_species where name=%s;", (species,))
-            species_id = cur.fetchone()[0]
+            species_id = bulk_load.get_species_id(con, species)
 
         # get lookup table for chromosomes
-        cur.execute("select name, id from networks_chromosome where species_id=%s", (species_id,))
-        chromosomes = {}
-        for row in cur:
-            chromosomes[row[0]] = row[1]
-        return chromosomes
+        return bulk_load.get_chromosome_ids(con, species_id)
 
     finally:
-        if (cur): cur.close()
-        if (con): con.close()
+        con.close()
 
 
 
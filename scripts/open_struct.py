@@ -6,9 +6,12 @@ class OpenStruct(object):
     def __getattr__(self, key):
         if key in self.__dict__:
             return self.__dict__[key]
+        elif key.startswith('__') and key.endswith('__'):
+            # don't claim to have special methods, so pickle (and
+            # multiprocessing) can handle these objects
+            raise AttributeError, key
         else:
             return None
-            # raise AttributeError, key
 
     def __setattr__(self, key, value):
         self.__dict__[key] = value
@@ -0,0 +1,120 @@
+##
+## A scratch SQLite database with the tables the import scripts write, for
+## testing and benchmarking the importers without a PostgreSQL server. The
+## tables follow web_app/networks/models.py and sql/*.sql, leaving out
+## columns and constraints the importers don't touch. Views are read from
+## the web app's SQL files, so they aren't defined twice.
+##
+import os
+import re
+
+import bulk_load
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_app', 'networks', 'sql')
+
+SCHEMA = """
+create table networks_species (
+  id integer primary key,
+  name varchar(255) not null,
+  short_name varchar(64) not null
+);
+create table networks_chromosome (
+  id integer primary key,
+  species_id int not null,
+  name varchar(255) not null,
+  length int not null,
+  topology varchar(64) not null
+);
+create table networks_gene (
+  id integer primary key,
+  species_id int not null,
+  chromosome_id int,
+  name varchar(64) not null,
+  common_name varchar(100),
+  geneid int,
+  type varchar(64),
+  start int,
+  "end" int,
+  strand varchar(1),
+  description varchar(255),
+  transcription_factor bool not null default false
+);
+create unique index networks_gene_species_name_idx on networks_gene (species_id, name);
+create table networks_function (
+  id integer primary key,
+  native_id varchar(64),
+  name varchar(255) not null,
+  namespace varchar(255),
+  type varchar(64),
+  obsolete bool not null default false,
+  description text
+);
+create table networks_function_relationships (
+  id integer primary key,
+  function_id int not null,
+  target_id int not null,
+  type varchar(255)
+);
+create table networks_gene_function (
+  id integer primary key,
+  function_id int not null,
+  gene_id int not null,
+  source varchar(255),
+  unique (gene_id, function_id, source)
+);
+create table networks_synonym (
+  id integer primary key,
+  target_id int not null,
+  target_type varchar(255) not null,
+  name varchar(255) not null,
+  type varchar(64)
+);
+create table function_closure (
+  ancestor_id int not null,
+  descendant_id int not null,
+  depth int not null,
+  type varchar(255) not null
+);
+create table cache_generation (
+  generation int not null
+);
+"""
+
+
+def view(filename, name):
+    """
+    The create view statement for a view in one of the web app's SQL files.
+    """
+    with open(os.path.join(SQL_DIR, filename)) as f:
+        sql = f.read()
+    match = re.search(r"^create view %s as$.*?;$" % (name,), sql, re.M | re.S)
+    if match is None:
+        raise ValueError("No view %s in %s" % (name, filename,))
+    return match.group(0)
+
+
+def create(path=':memory:'):
+    """
+    Create the tables in a new SQLite database, in memory by default, and
+    return a connection to it.
+    """
+    con = bulk_load.connect('sqlite:' + path)
+    con.executescript(SCHEMA)
+    con.executescript(view('function.sql', 'function_closure_paths'))
+    return con
+
+
+def add_species(con, name, short_name, chromosomes):
+    """
+    Add a species and its chromosomes, given as a list of (name, length).
+    Returns the species id.
+    """
+    cur = con.cursor()
+    try:
+        cur.execute("insert into networks_species (name, short_name) values (?, ?)", (name, short_name,))
+        species_id = cur.lastrowid
+        cur.executemany("insert into networks_chromosome (species_id, name, length, topology) values (?, ?, ?, 'circular')",
+                        [ (species_id, chromosome, length) for chromosome, length in chromosomes ])
+        return species_id
+    finally:
+        cur.close()
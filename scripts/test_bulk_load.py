@@ -0,0 +1,185 @@
+##
+## Tests of the bulk loading code shared by the import scripts, against a
+## scratch SQLite database. Run from this directory with:
+## python -m unittest test_bulk_load
+##
+import unittest
+
+import benchmark_importers
+import bulk_load
+import import_functions
+import scratch_db
+from open_struct import OpenStruct
+
+
+def gene(name, start, common_name=None, chromosome='chromosome'):
+    return OpenStruct(name=name, chromosome=chromosome, common_name=common_name, geneid=None, type=None,
+                      start=start, end=start + 899, strand='+', description="gene %s" % (name,))
+
+
+def go_term(id, name, is_a=None, relationship=None, alt_id=None):
+    term = OpenStruct(id=id, name=name, namespace='biological_process')
+    term['def'] = "definition of %s" % (name,)
+    for key, value in (('is_a', is_a), ('relationship', relationship), ('alt_id', alt_id)):
+        if value is not None:
+            term[key] = value
+    return term
+
+
+class LoadGenesTest(unittest.TestCase):
+    def setUp(self):
+        self.con = scratch_db.create()
+        self.species_id = scratch_db.add_species(self.con, 'Halobacterium salinarum NRC-1', 'hal',
+                                                 [('chromosome', 2000000), ('pNRC100', 190000)])
+        self.chromosomes = bulk_load.get_chromosome_ids(self.con, self.species_id)
+
+    def tearDown(self):
+        self.con.close()
+
+    def genes(self):
+        cur = self.con.cursor()
+        cur.execute("select name, chromosome_id, common_name, start, transcription_factor from networks_gene order by name")
+        return cur.fetchall()
+
+    def test_load(self):
+        genes = [ gene("VNG%04dG" % (i,), 1000 * i + 1) for i in range(5) ]
+        self.assertEqual(bulk_load.load_genes(self.con, self.species_id, self.chromosomes, genes), (5, 0))
+        self.assertEqual(len(self.genes()), 5)
+
+        # reloading the same genes changes nothing
+        before = self.genes()
+        self.assertEqual(bulk_load.load_genes(self.con, self.species_id, self.chromosomes, genes), (0, 0))
+        self.assertEqual(self.genes(), before)
+
+        # curated transcription factors survive an update
+        self.con.execute("update networks_gene set transcription_factor=1 where name='VNG0001G'")
+        genes[1] = gene('VNG0001G', 1001, common_name='trh3')
+        genes[2] = gene('VNG0002G', 5001, chromosome='pNRC100')
+        genes.append(gene('VNG0005G', 5001))
+        self.assertEqual(bulk_load.load_genes(self.con, self.species_id, self.chromosomes, genes), (1, 2))
+        rows = dict([ (row[0], row[1:]) for row in self.genes() ])
+        self.assertEqual(rows['VNG0001G'], (self.chromosomes['chromosome'], 'trh3', 1001, 1))
+        self.assertEqual(rows['VNG0002G'], (self.chromosomes['pNRC100'], None, 5001, 0))
+        self.assertEqual(len(rows), 6)
+
+    def test_duplicate_names(self):
+        # the last record wins
+        genes = [ gene('VNG0001G', 1), gene('VNG0001G', 2001) ]
+        self.assertEqual(bulk_load.load_genes(self.con, self.species_id, self.chromosomes, genes), (1, 0))
+        self.assertEqual(self.genes()[0][3], 2001)
+
+
+class AssociationWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.con = scratch_db.create()
+
+    def tearDown(self):
+        self.con.close()
+
+    def test_dedupe(self):
+        self.con.execute("insert into networks_gene_function (gene_id, function_id, source) values (1, 10, 'kegg')")
+        writer = bulk_load.AssociationWriter(self.con, batch_size=2)
+        for gene_id, function_id, source in [(1, 10, 'kegg'), (1, 11, 'kegg'), (1, 11, 'kegg'), (2, 10, 'kegg'),
+                                             (1, 10, 'microbes online'), (2, 10, 'kegg')]:
+            writer.add(gene_id, function_id, source)
+        self.assertEqual(writer.close(), 3)
+        self.assertEqual((writer.added, len(writer.seen)), (6, 4))
+        self.assertTrue(writer.report().startswith("Wrote 3 new gene-function associations of 6 added (2 duplicates)"))
+        cur = self.con.cursor()
+        cur.execute("select gene_id, function_id, source from networks_gene_function order by gene_id, function_id, source")
+        self.assertEqual(cur.fetchall(), [(1, 10, 'kegg'), (1, 10, 'microbes online'), (1, 11, 'kegg'), (2, 10, 'kegg')])
+
+        # writing the same associations again adds nothing
+        writer = bulk_load.AssociationWriter(self.con)
+        writer.add(2, 10, 'kegg')
+        self.assertEqual(writer.close(), 0)
+
+
+class InsertGoTermsTest(unittest.TestCase):
+    def setUp(self):
+        self.con = scratch_db.create()
+
+    def tearDown(self):
+        self.con.close()
+
+    def functions(self):
+        cur = self.con.cursor()
+        cur.execute("select native_id, name, obsolete from networks_function where type='go' order by native_id")
+        return cur.fetchall()
+
+    def relationships(self):
+        cur = self.con.cursor()
+        cur.execute("""
+            select f.native_id, t.native_id, r.type
+            from networks_function_relationships r
+                 join networks_function f on r.function_id=f.id
+                 join networks_function t on r.target_id=t.id
+            order by f.native_id, t.native_id""")
+        return cur.fetchall()
+
+    def alt_ids(self):
+        cur = self.con.cursor()
+        cur.execute("select name from networks_synonym where target_type='function' and type='go:alt_id' order by name")
+        return [ row[0] for row in cur.fetchall() ]
+
+    def test_incremental(self):
+        terms = [ go_term('GO:0000001', 'root'),
+                  go_term('GO:0000002', 'child', is_a='GO:0000001', alt_id=['GO:0000102', 'GO:0000202']),
+                  go_term('GO:0000003', 'part', relationship='part_of GO:0000002') ]
+        import_functions.insert_go_terms(terms, con=self.con, batch_size=2)
+        self.assertEqual(self.functions(), [('GO:0000001', 'root', 0), ('GO:0000002', 'child', 0), ('GO:0000003', 'part', 0)])
+        self.assertEqual(self.relationships(), [('GO:0000002', 'GO:0000001', 'is_a'), ('GO:0000003', 'GO:0000002', 'part_of')])
+        self.assertEqual(self.alt_ids(), ['GO:0000102', 'GO:0000202'])
+
+        # loading the same release again changes nothing
+        cur = self.con.cursor()
+        cur.execute("select id, native_id from networks_function order by id")
+        ids = cur.fetchall()
+        import_functions.insert_go_terms(terms, con=self.con)
+        cur.execute("select id, native_id from networks_function order by id")
+        self.assertEqual(cur.fetchall(), ids)
+        self.assertEqual(len(self.relationships()), 2)
+
+        # a new release renames a term, adds one, drops one and changes
+        # relationships and alt_ids
+        terms = [ go_term('GO:0000001', 'root'),
+                  go_term('GO:0000002', 'renamed child', is_a='GO:0000001', alt_id='GO:0000102'),
+                  go_term('GO:0000004', 'new', is_a='GO:0000002') ]
+        import_functions.insert_go_terms(terms, con=self.con)
+        self.assertEqual(self.functions(), [('GO:0000001', 'root', 0), ('GO:0000002', 'renamed child', 0),
+                                            ('GO:0000003', 'part', 1), ('GO:0000004', 'new', 0)])
+        self.assertEqual(self.relationships(), [('GO:0000002', 'GO:0000001', 'is_a'), ('GO:0000004', 'GO:0000002', 'is_a')])
+        self.assertEqual(self.alt_ids(), ['GO:0000102'])
+        cur.execute("select id, native_id from networks_function where native_id<>'GO:0000004' order by id")
+        self.assertEqual(cur.fetchall(), ids)
+
+    def test_function_closure(self):
+        import_functions.insert_go_terms([ go_term('GO:0000001', 'root'),
+                                           go_term('GO:0000002', 'child', is_a='GO:0000001'),
+                                           go_term('GO:0000003', 'part', relationship='part_of GO:0000002') ],
+                                         con=self.con)
+        self.assertEqual(bulk_load.rebuild_function_closure(self.con), 6)
+        cur = self.con.cursor()
+        cur.execute("""
+            select a.native_id, d.native_id, c.depth, c.type
+            from function_closure c
+                 join networks_function a on c.ancestor_id=a.id
+                 join networks_function d on c.descendant_id=d.id
+            where c.depth > 0
+            order by a.native_id, d.native_id""")
+        self.assertEqual(cur.fetchall(), [('GO:0000001', 'GO:0000002', 1, 'is_a'),
+                                          ('GO:0000001', 'GO:0000003', 2, 'part_of'),
+                                          ('GO:0000002', 'GO:0000003', 1, 'part_of')])
+
+class BenchmarkImportersTest(unittest.TestCase):
+    def test_run(self):
+        scale = {'genes':50, 'terms':100, 'associations_per_gene':2, 'seed':0}
+        report = benchmark_importers.run(scale, repeat=1)
+        self.assertEqual(sorted(report['results'].keys()), sorted([ name for name, f in benchmark_importers.BENCHMARKS ]))
+        for result in report['results'].values():
+            self.assertEqual(result['runs'], 1)
+            self.assertTrue(0 <= result['min_ms'] <= result['median_ms'] <= result['max_ms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+"""
+Benchmarks of the portal's heavy pages and data paths, run against a network
+in the database, typically one made by the generate_synthetic_data command.
+Each benchmark is timed over several runs after a warm-up run, and its query
+count is recorded. Run them with: python manage.py run_benchmarks
+
+A benchmark is a function taking a Target and returning the function to be
+timed, or None if it can't run against this target.
+
+The import scripts' loaders are benchmarked separately, against a scratch
+SQLite database, by scripts/benchmark_importers.py. Its reports have the same
+layout, so compare() works on them too.
+"""
+from django.db import connection
+from django.db.models import Count
+from django.test.client import Client
+import time
+
+from models import Network, Gene, Bicluster, expression_matrix, expression_matrix_from_db
+from profiling import profiled, install
+import caching
+import expression_store
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """
+    Decorator registering a benchmark under a name.
+    """
+    def register(f):
+        BENCHMARKS.append((name, f))
+        return f
+    return register
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class Target(object):
+    """
+    The network benchmarks run against, with a few representative objects:
+    the gene belonging to the most biclusters, a bicluster and a test client.
+    """
+    def __init__(self, network):
+        self.network = network
+        self.client = Client()
+        self.hub_gene = Gene.objects.filter(bicluster__network=network) \
+                            .annotate(n=Count('bicluster')).order_by('-n')[0]
+        self.biclusters = list(Bicluster.objects.filter(network=network).order_by('k')[:10])
+        self.bicluster = self.biclusters[0]
+
+    def describe(self):
+        return {'network_id':self.network.id, 'network':self.network.name,
+                'genes':Gene.objects.filter(species=self.network.species_id).count(),
+                'biclusters':self.network.bicluster_set.count(),
+                'conditions':self.network.condition_set.count(),
+                'hub_gene':self.hub_gene.name}
+
+    def get(self, path, params=None):
+        """
+        Request a page, reading all of its content. Pages are rendered, not
+        served from the cache.
+        """
+        with caching.bypassed():
+            response = self.client.get(path, params or {})
+        if response.status_code != 200:
+            raise BenchmarkError("%s returned status %d" % (path, response.status_code,))
+        if response.get('X-Cache') == 'HIT':
+            raise BenchmarkError("%s was served from the cache" % (path,))
+        if hasattr(response, 'streaming_content'):
+            return "".join(response.streaming_content)
+        return response.content
+
+
+@benchmark('gene')
+def gene_page(target):
+    return lambda: target.get('/network/%d/gene/%s' % (target.network.id, target.hub_gene.name,))
+
+@benchmark('bicluster')
+def bicluster_page(target):
+    return lambda: target.get('/bicluster/%d' % (target.bicluster.id,))
+
+@benchmark('circvis')
+def circvis(target):
+    return lambda: target.get('/json/circvis/', {'gene':target.hub_gene.name, 'network_id':target.network.id})
+
+@benchmark('network_as_graphml')
+def graphml_biclusters(target):
+    ids = ",".join([ str(b.id) for b in target.biclusters ])
+    return lambda: target.get('/network/graphml', {'biclusters':ids})
+
+@benchmark('network_as_graphml_whole_network')
+def graphml_network(target):
+    return lambda: target.get('/network/graphml', {'network_id':target.network.id})
+
+@benchmark('expression_matrix_db')
+def expression_matrix_db(target):
+    conditions = list(target.network.condition_set.order_by('id'))
+    return lambda: expression_matrix_from_db(conditions)
+
+@benchmark('expression_matrix')
+def expression_matrix_store(target):
+    if expression_store.get_store(target.network.id) is None:
+        return None
+    conditions = list(target.network.condition_set.order_by('id'))
+    return lambda: expression_matrix(conditions)
+
+@benchmark('search')
+def search(target):
+    # search goes through Solr, which may not be running
+    try:
+        target.get('/search', {'q':target.hub_gene.name})
+    except Exception:
+        return None
+    return lambda: target.get('/search', {'q':target.hub_gene.name})
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    return values[n // 2] if n % 2 == 1 else (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+
+def run(network, repeat=5, names=None, log=None):
+    """
+    Run benchmarks against a network. Returns a report, as a dictionary that
+    can be saved as JSON and compared with later runs.
+    """
+    log = log or (lambda message: None)
+    # so the query counts of pages include the requests' queries
+    install()
+    target = Target(network)
+    results = {}
+    for name, f in BENCHMARKS:
+        if names and name not in names:
+            continue
+        try:
+            run_once = f(target)
+            if run_once is None:
+                results[name] = {'skipped':True}
+                log("%s: skipped" % (name,))
+                continue
+            run_once()
+            times = []
+            for i in range(repeat):
+                with profiled(name) as profile:
+                    started = time.time()
+                    run_once()
+                    times.append((time.time() - started) * 1000)
+            results[name] = {'runs':repeat, 'min_ms':round(min(times), 2), 'median_ms':round(median(times), 2),
+                             'max_ms':round(max(times), 2), 'queries':profile.query_count}
+            log("%s: median %.1f ms, %d queries" % (name, results[name]['median_ms'], profile.query_count,))
+        except BenchmarkError, e:
+            results[name] = {'error':str(e)}
+            log("%s: %s" % (name, e,))
+    return {'time':time.time(), 'database':connection.vendor, 'target':target.describe(),
+            'repeat':repeat, 'results':results}
+
+
+def compare(report, baseline):
+    """
+    Compare the median times in a report against a baseline report. Returns a
+    list of (name, baseline median, median, ratio) for benchmarks in both.
+    """
+    rows = []
+    for name, result in sorted(report['results'].items()):
+        base = baseline['results'].get(name, {})
+        if 'median_ms' in result and 'median_ms' in base:
+            rows.append((name, base['median_ms'], result['median_ms'],
+                         result['median_ms'] / base['median_ms'] if base['median_ms'] > 0 else None))
+    return rows
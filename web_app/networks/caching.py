@@ -0,0 +1,283 @@
+"""
+Caching of pages and JSON data, which only change when data is imported.
+
+There are two levels of cache, both configured in settings.CACHES. 'local' is
+an LRUCache (below), private to each process. Behind it is 'default', shared
+by all processes: file based in development, memcached in production.
+
+Keys carry a version made of a generation number, kept in the
+cache_generation table, and the version_id of every network. Reloading a
+network under a new version_id, or bumping the generation, makes everything
+cached before unreachable. Old entries are then evicted in time. The import
+scripts bump the generation when they finish (see
+scripts/bulk_load.py:bump_cache_generation). To do it by hand, run:
+python manage.py invalidate_cache
+Each process reads the version from the DB at most every
+settings.CACHE_GENERATION_CHECK seconds.
+
+Views are cached with the cached_view decorator. Pages show who is logged
+in, so only anonymous requests are served from the cache.
+"""
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.cache.backends.base import BaseCache
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test.signals import setting_changed
+from collections import OrderedDict
+from functools import wraps
+import cPickle as pickle
+import hashlib
+import threading
+import time
+
+from models import Network
+
+# the entries, counters and lock of each LRUCache, by location, shared by
+# instances with the same location like Django's LocMemCache
+_lru_caches = {}
+
+
+class LRUCache(BaseCache):
+    """
+    A process-local cache backend that evicts the least recently used
+    entries once it holds MAX_ENTRIES, and counts hits, misses and
+    evictions. Values are stored pickled, so callers can't change them in
+    place.
+    """
+    def __init__(self, name, params):
+        BaseCache.__init__(self, params)
+        if name not in _lru_caches:
+            _lru_caches[name] = (OrderedDict(), {'hits':0, 'misses':0, 'evictions':0}, threading.Lock())
+        self._entries, self.counters, self._lock = _lru_caches[name]
+
+    def _live(self, key):
+        # the entry for a key if it hasn't expired, most recently used last
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] <= time.time():
+            return None
+        self._entries[key] = entry
+        return entry
+
+    def _set(self, key, value, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        self._entries.pop(key, None)
+        self._entries[key] = (time.time() + timeout, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def add(self, key, value, timeout=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._set(key, value, timeout)
+            return True
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return default
+            self.counters['hits'] += 1
+        return pickle.loads(entry[1])
+
+    def set(self, key, value, timeout=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._set(key, value, timeout)
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            return self._live(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries), max_entries=self._max_entries)
+
+
+_caches = {}
+
+def _cache(alias):
+    if alias not in _caches:
+        _caches[alias] = get_cache(alias)
+    return _caches[alias]
+
+
+# counters for the shared cache, for lookups missing the local cache
+_shared_counters = {'hits':0, 'misses':0}
+_shared_lock = threading.Lock()
+
+# the current data version and when it was read from the DB
+_version = {'key':None, 'checked':0.0}
+
+
+def _reset_caches(sender, setting, **kwargs):
+    # when tests override settings.CACHES, use the caches they configure
+    if setting == 'CACHES':
+        _caches.clear()
+        _version['key'] = None
+
+setting_changed.connect(_reset_caches)
+
+
+def data_version():
+    """
+    The version of the data, as a string made of the cache generation and a
+    hash of the version_ids of all networks. The generation is seeded with
+    the current time the first time it's read.
+    """
+    now = time.time()
+    if _version['key'] is None or now - _version['checked'] > settings.CACHE_GENERATION_CHECK:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("select max(generation) from cache_generation;")
+            generation = cursor.fetchone()[0]
+            if generation is None:
+                generation = int(now)
+                cursor.execute("insert into cache_generation (generation) values (%s);", (generation,))
+                transaction.commit_unless_managed()
+        finally:
+            cursor.close()
+        versions = list(Network.objects.order_by('id').values_list('id', 'version_id'))
+        _version['key'] = "%d.%s" % (generation, hashlib.md5(repr(versions)).hexdigest()[:12],)
+        _version['checked'] = now
+    return _version['key']
+
+
+def make_key(name, *parts):
+    """
+    A cache key for a kind of entry and the parts that identify it, valid
+    for the current version of the data.
+    """
+    return "networks:%s:%s:%s" % (data_version(), name, hashlib.md5(repr(parts)).hexdigest(),)
+
+
+def fetch(key):
+    """
+    Look up a key in the local cache, then in the shared one. Returns None
+    on a miss.
+    """
+    value = _cache('local').get(key)
+    if value is not None:
+        return value
+    value = _cache('default').get(key)
+    with _shared_lock:
+        _shared_counters['hits' if value is not None else 'misses'] += 1
+    if value is not None:
+        _cache('local').set(key, value)
+    return value
+
+
+def store(key, value, timeout=None):
+    """
+    Store a value in both caches. timeout applies to the shared cache and
+    defaults to its TIMEOUT.
+    """
+    _cache('local').set(key, value)
+    _cache('default').set(key, value, timeout)
+
+
+# cached_view is bypassed in threads within a bypassed() block
+_bypass = threading.local()
+
+class bypassed(object):
+    """
+    Context manager under which cached_view neither serves nor stores
+    responses in this thread, as for timing the views themselves. Responses
+    get an X-Cache header of BYPASS.
+    """
+    def __enter__(self):
+        _bypass.depth = getattr(_bypass, 'depth', 0) + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _bypass.depth -= 1
+        return False
+
+
+def cached_view(*params):
+    """
+    Decorator serving a view from the cache, keyed by the view, the path of
+    the request and the values of the named query parameters, the only ones
+    the view reads. Other parameters, their order and repeats don't make new
+    entries. Only successful, non-streaming responses to anonymous GET
+    requests are cached. Responses say whether they came from the cache in an
+    X-Cache header.
+
+        @cached_view('gene', 'network_id')
+        def circvis(request):
+            ...
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            user = getattr(request, 'user', None)
+            if request.method not in ('GET', 'HEAD') or (user is not None and user.is_authenticated()):
+                return view(request, *args, **kwargs)
+            if getattr(_bypass, 'depth', 0) > 0:
+                response = view(request, *args, **kwargs)
+                response['X-Cache'] = 'BYPASS'
+                return response
+
+            key = make_key('view', view.__name__, request.path, [ request.GET.get(param) for param in params ])
+            cached = fetch(key)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not getattr(response, '_base_content_is_iter', False):
+                store(key, (response.content, response['Content-Type']))
+                response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def stats():
+    """
+    Hit and miss counts of this process's caches.
+    """
+    with _shared_lock:
+        shared = dict(_shared_counters)
+    return {'version':data_version(), 'local':_cache('local').stats(), 'shared':shared}
+
+
+def invalidate(clear_shared=False):
+    """
+    Bump the cache generation, so nothing cached before is served again, by
+    any process. The shared cache can be emptied, too, rather than waiting
+    for old entries to be evicted.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("update cache_generation set generation=generation+1;")
+        transaction.commit_unless_managed()
+    finally:
+        cursor.close()
+    _version['key'] = None
+    _cache('local').clear()
+    if clear_shared:
+        _cache('default').clear()
@@ -0,0 +1,195 @@
+"""
+Co-expression: correlations of the expression profile of a gene against those
+of all genes in a network, by Pearson or Spearman correlation.
+
+Expression data is sparse, so correlations are pairwise-complete: each pair of
+genes is compared over the conditions where both have values. With a 0/1 mask
+of present values and the data with missing values zeroed, all the sums
+needed for the correlations of a block of genes against every gene are matrix
+products, so a block is scored at once. For Spearman correlation, each gene's
+values are first replaced by their ranks among its own present values (ties
+are ranked in order), then compared as for Pearson.
+
+The expression matrix comes from the network's expression store if one has
+been built, otherwise from the database. Correlations of one gene are computed
+on request. For fast responses, the top neighbors of every gene can be
+precomputed into the coexpression table with:
+python manage.py build_coexpression
+"""
+from django.db import connection, transaction
+import multiprocessing
+import numpy as np
+
+import expression_store
+from db_util import insert_many
+
+METHODS = ('pearson', 'spearman')
+
+# minimum number of conditions a pair of genes must share to be compared
+MIN_OVERLAP = 5
+
+# number of neighbors stored per gene by build_coexpression
+DEFAULT_K = 50
+
+# number of genes correlated against all genes at once
+BLOCK_SIZE = 256
+
+
+def ranks(data):
+    """
+    Replace each row's present values by their ranks, from 1, among the
+    present values of that row. Missing values stay NaN.
+    """
+    data = np.asarray(data, dtype=float)
+    present = ~np.isnan(data)
+    # missing values sort last, so ranks of present values are unaffected
+    order = np.argsort(np.where(present, data, np.inf), axis=1, kind='mergesort')
+    result = np.empty(data.shape)
+    rows = np.arange(data.shape[0])[:, np.newaxis]
+    result[rows, order] = np.arange(1, data.shape[1] + 1, dtype=float)[np.newaxis, :]
+    result[~present] = np.nan
+    return result
+
+
+def prepare(data, method='pearson'):
+    """
+    Turn an expression matrix into the (values, mask) pair used by
+    correlate_block: values with missing entries zeroed and a float mask of
+    present values.
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown correlation method: %s" % (method,))
+    if method == 'spearman':
+        data = ranks(data)
+    mask = ~np.isnan(data)
+    return np.where(mask, data, 0.0), mask.astype(float)
+
+
+def correlate_block(values, mask, rows, min_overlap=MIN_OVERLAP):
+    """
+    Pairwise-complete correlations of the given rows against all rows.
+    Returns (r, n), both len(rows) x all rows, where n is the number of
+    conditions each pair shares. Correlations of pairs sharing fewer than
+    min_overlap conditions, or with no variance over those, are NaN.
+    """
+    x, xm = values[rows], mask[rows]
+    n = np.dot(xm, mask.T)
+    sx = np.dot(x, mask.T)
+    sy = np.dot(xm, values.T)
+    sxx = np.dot(x * x, mask.T)
+    syy = np.dot(xm, (values * values).T)
+    sxy = np.dot(x, values.T)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sxy - sx * sy / n
+        var_x = sxx - sx * sx / n
+        var_y = syy - sy * sy / n
+        r = cov / np.sqrt(var_x * var_y)
+    r[(n < min_overlap) | ~(var_x > 1e-12) | ~(var_y > 1e-12)] = np.nan
+    return np.clip(r, -1.0, 1.0), n.astype(int)
+
+
+def _top(r, k, exclude):
+    # indexes of the k highest correlations, best first, skipping NaNs and exclude
+    r = np.where(np.isnan(r), -np.inf, r)
+    r[exclude] = -np.inf
+    order = np.argsort(-r, kind='mergesort')[:k]
+    return order[np.isfinite(r[order])]
+
+
+def neighbors(network_id, gene_id, method='pearson', k=20):
+    """
+    The k genes whose expression correlates best with a gene's in a network,
+    as a list of (gene_id, r, conditions shared), best first. Uses the
+    precomputed coexpression table if it holds k neighbors of the gene,
+    otherwise computes correlations against all genes, so asking for more
+    neighbors than build stored still gets k. Returns None if the gene has no
+    expression data in the network.
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown correlation method: %s" % (method,))
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            select neighbor_id, r, n from coexpression
+            where network_id=%s and gene_id=%s and method=%s
+            order by rank limit %s;""", (network_id, gene_id, method, k,))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    if len(rows) == k:
+        return [ (neighbor_id, r, n) for neighbor_id, r, n in rows ]
+
+    gene_ids, condition_ids, data = expression_store.network_matrix(network_id)
+    row = np.searchsorted(gene_ids, gene_id)
+    if row >= len(gene_ids) or gene_ids[row] != gene_id:
+        return None
+    values, mask = prepare(data, method)
+    r, n = correlate_block(values, mask, [row])
+    top = _top(r[0], k, row)
+    return [ (int(gene_ids[i]), float(r[0, i]), int(n[0, i])) for i in top ]
+
+
+# the prepared matrix in worker processes of build
+_worker_matrix = None
+
+def _init_worker(values, mask):
+    global _worker_matrix
+    _worker_matrix = (values, mask)
+
+
+def _top_neighbors_task(task):
+    """
+    Top neighbors of a block of rows. Runs in a worker process.
+    """
+    start, stop, k = task
+    values, mask = _worker_matrix
+    r, n = correlate_block(values, mask, np.arange(start, stop))
+    results = []
+    for i in range(stop - start):
+        top = _top(r[i], k, start + i)
+        results.append((start + i, top, r[i, top], n[i, top]))
+    return results
+
+
+def build(network_id, method='pearson', k=DEFAULT_K, processes=None, block_size=BLOCK_SIZE):
+    """
+    Precompute the top k neighbors of every gene in a network into the
+    coexpression table, replacing earlier results for the network and method.
+    Blocks of genes are correlated against all genes in a pool of worker
+    processes. Use processes=1 to work in the calling process. Returns the
+    number of rows written.
+    """
+    gene_ids, condition_ids, data = expression_store.network_matrix(network_id)
+    values, mask = prepare(data, method)
+    tasks = [ (start, min(start + block_size, len(gene_ids)), k) for start in range(0, len(gene_ids), block_size) ]
+
+    def rows(results):
+        for block in results:
+            for i, top, r, n in block:
+                for rank in range(len(top)):
+                    yield (network_id, int(gene_ids[i]), int(gene_ids[top[rank]]), method,
+                           float(r[rank]), int(n[rank]), rank + 1)
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute("delete from coexpression where network_id=%s and method=%s;", (network_id, method,))
+        columns = ['network_id', 'gene_id', 'neighbor_id', 'method', 'r', 'n', 'rank']
+        if processes == 1:
+            _init_worker(values, mask)
+            insert_many(cursor, 'coexpression', columns, rows(_top_neighbors_task(task) for task in tasks))
+        else:
+            pool = multiprocessing.Pool(processes, _init_worker, (values, mask))
+            try:
+                insert_many(cursor, 'coexpression', columns, rows(pool.imap(_top_neighbors_task, tasks)))
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        cursor.execute("select count(*) from coexpression where network_id=%s and method=%s;", (network_id, method,))
+        count = cursor.fetchone()[0]
+        transaction.commit_unless_managed()
+        return count
+    finally:
+        cursor.close()
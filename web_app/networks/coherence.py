@@ -0,0 +1,301 @@
+"""
+Coherence of biclusters: how well the expression of a set of genes agrees
+over a set of conditions, recomputed from expression data rather than taken
+from cMonkey's output.
+
+For a genes x conditions submatrix a, with row means a_iJ, column means a_Ij
+and overall mean a_IJ, the residue of each entry is
+
+    r_ij = a_ij - a_iJ - a_Ij + a_IJ
+
+and the mean squared residue is the mean of r_ij^2 (Cheng and Church). The
+mean absolute residue is what cMonkey reports as a bicluster's residual, so
+it can be compared to Bicluster.residual. Missing values are left out of all
+the means. The mean squared residue of each gene and each condition is turned
+into a z-score against the others in the bicluster, flagging genes and conditions
+that don't fit.
+
+Submatrices are sliced out of the network's expression store when it's built,
+otherwise only the bicluster's genes are read from the database.
+Summaries for all biclusters of a network can be stored in the
+bicluster_quality table with: python manage.py refresh_bicluster_quality
+"""
+from django.db import connection, transaction
+import multiprocessing
+import numpy as np
+
+from models import Network, Bicluster, DataMatrix
+import expression_store
+from db_util import insert_many
+
+# the scalar statistics stored in the bicluster_quality table
+SUMMARY = ('residue', 'abs_residue', 'mean', 'variance', 'genes', 'conditions')
+
+
+def _zscores(values):
+    # z-scores of the non-NaN values, zero if they don't vary
+    present = ~np.isnan(values)
+    if not present.any():
+        return values
+    sd = values[present].std()
+    if sd <= 0:
+        return np.where(present, 0.0, np.nan)
+    return (values - values[present].mean()) / sd
+
+
+def quality(data):
+    """
+    Coherence statistics of a genes x conditions matrix with NaN for missing
+    values, as a dictionary:
+    - residue: mean squared residue
+    - abs_residue: mean absolute residue, as cMonkey's residual
+    - mean, variance: of all values
+    - genes, conditions: numbers of rows and columns with any values
+    - profile, profile_sd: mean and standard deviation of each condition
+    - gene_z, condition_z: z-scores of the mean squared residue of each
+      gene and condition
+    Statistics of an empty matrix are NaN.
+    """
+    data = np.asarray(data, dtype=float)
+    mask = ~np.isnan(data)
+    x = np.where(mask, data, 0.0)
+    row_n = mask.sum(axis=1)
+    col_n = mask.sum(axis=0)
+    total = mask.sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        row_mean = x.sum(axis=1) / row_n
+        col_mean = x.sum(axis=0) / col_n
+        mean = x.sum() / float(total) if total else np.nan
+        residues = np.where(mask, data - row_mean[:, np.newaxis] - col_mean[np.newaxis, :] + mean, 0.0)
+        squares = residues * residues
+        deviations = np.where(mask, data - col_mean[np.newaxis, :], 0.0)
+        profile_sd = np.sqrt((deviations * deviations).sum(axis=0) / col_n)
+        return {'residue': squares.sum() / total if total else np.nan,
+                'abs_residue': np.abs(residues).sum() / total if total else np.nan,
+                'mean': mean,
+                'variance': (np.where(mask, data - mean, 0.0) ** 2).sum() / total if total else np.nan,
+                'genes': int((row_n > 0).sum()),
+                'conditions': int((col_n > 0).sum()),
+                'profile': col_mean,
+                'profile_sd': profile_sd,
+                'gene_z': _zscores(squares.sum(axis=1) / row_n),
+                'condition_z': _zscores(squares.sum(axis=0) / col_n)}
+
+
+def submatrix(genes, conditions):
+    """
+    Expression of a set of genes over a set of conditions as a DataMatrix,
+    with genes ordered by id. Genes without expression data under the
+    conditions are left out. Only the given genes are read, from the network's
+    expression store if it's up to date, otherwise from the database.
+    """
+    genes_by_id = dict([ (gene.id, gene) for gene in genes ])
+    gene_ids = np.array(sorted(genes_by_id.keys()), dtype=int)
+    conditions = list(conditions)
+    condition_ids = [ condition.id for condition in conditions ]
+
+    store = None
+    network_ids = set([ condition.network_id for condition in conditions ])
+    if len(network_ids) == 1:
+        store = expression_store.get_store(network_ids.pop())
+    columns = store.column_indexes(condition_ids) if store is not None else None
+    if columns is not None:
+        rows = _indexes(store.gene_ids, gene_ids)
+        gene_ids = store.gene_ids[rows]
+        data = np.asarray(store.data[rows][:, columns], dtype=float)
+    else:
+        gene_ids, data = _submatrix_from_db(gene_ids, condition_ids)
+
+    present = ~np.all(np.isnan(data), axis=1)
+    return DataMatrix([ genes_by_id[id] for id in gene_ids[present].tolist() ], conditions, data[present])
+
+
+def _submatrix_from_db(gene_ids, condition_ids):
+    # (gene_ids, data) for the given genes, sorted, over the given conditions
+    data = np.empty((len(gene_ids), len(condition_ids)))
+    data.fill(np.nan)
+    if len(gene_ids) == 0 or len(condition_ids) == 0:
+        return gene_ids, data
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            select gene_id, condition_id, value from expression
+            where gene_id in (%s) and condition_id in (%s);""" %
+                       (",".join([ str(id) for id in gene_ids ]), ",".join([ str(id) for id in condition_ids ]),))
+        triples = np.array(cursor.fetchall(), dtype=float).reshape(-1, 3)
+    finally:
+        cursor.close()
+    columns = dict([ (id, j) for j, id in enumerate(condition_ids) ])
+    rows = np.searchsorted(gene_ids, triples[:,0].astype(int))
+    data[rows, [ columns[int(id)] for id in triples[:,1] ]] = triples[:,2]
+    return gene_ids, data
+
+
+def gene_set_quality(genes, conditions):
+    """
+    Coherence statistics, as by quality, of any set of genes over any set of
+    conditions. Also returns the genes and conditions labeling the rows and
+    columns of the statistics, as (genes, conditions, quality).
+    """
+    matrix = submatrix(genes, conditions)
+    return matrix.genes, matrix.conditions, quality(matrix.data)
+
+
+def bicluster_quality(bicluster):
+    """
+    Coherence statistics of a bicluster, as returned by gene_set_quality.
+    """
+    return gene_set_quality(bicluster.genes.all(), bicluster.conditions.order_by('id'))
+
+
+# genes with residue z-scores above this are listed as outliers on the bicluster page
+OUTLIER_Z = 2.0
+
+def quality_panel(bicluster):
+    """
+    Coherence statistics of a bicluster laid out for the bicluster page: the
+    summary statistics, the mean profile as a list of dictionaries with keys
+    condition, mean, sd and z, and the outlier genes as a list of dictionaries
+    with keys gene and z. NaNs become None. The summary comes from the
+    bicluster_quality table if it's up to date with the network.
+    """
+    genes, conditions, result = bicluster_quality(bicluster)
+    stored = stored_quality(bicluster.id)
+    if stored is not None and stored['version_id'] == bicluster.network.version_id:
+        panel = dict([ (key, stored[key]) for key in SUMMARY ])
+    else:
+        panel = dict([ (key, _value(result[key])) for key in SUMMARY ])
+    panel['profile'] = [ {'condition':condition, 'mean':_value(mean), 'sd':_value(sd), 'z':_value(z)}
+                         for condition, mean, sd, z in zip(conditions, result['profile'],
+                                                           result['profile_sd'], result['condition_z']) ]
+    panel['outliers'] = sorted([ {'gene':gene, 'z':float(z)} for gene, z in zip(genes, result['gene_z'])
+                                 if z > OUTLIER_Z ], key=lambda outlier: -outlier['z'])
+    panel['outlier_z'] = OUTLIER_Z
+    return panel
+
+
+def _memberships(cursor, table, column, network_id):
+    cursor.execute("""
+        select m.bicluster_id, m.%s
+        from %s m join networks_bicluster b on m.bicluster_id=b.id
+        where b.network_id=%%s
+        order by m.bicluster_id, m.%s;""" % (column, table, column,), (network_id,))
+    members = {}
+    for bicluster_id, id in cursor.fetchall():
+        members.setdefault(bicluster_id, []).append(id)
+    return members
+
+
+def _indexes(ids, wanted):
+    # positions in sorted ids of those wanted ids that are present
+    wanted = np.asarray(wanted, dtype=int)
+    if len(ids) == 0:
+        return np.array([], dtype=int)
+    positions = np.minimum(np.searchsorted(ids, wanted), len(ids) - 1)
+    return positions[ids[positions] == wanted]
+
+
+def network_biclusters(network_id):
+    """
+    The whole expression matrix of a network, with NaN for missing values,
+    and a list of (bicluster_id, rows, columns) giving the rows and columns of
+    each bicluster of the network in the matrix, as (data, biclusters).
+    """
+    gene_ids, condition_ids, data = expression_store.network_matrix(network_id)
+    cursor = connection.cursor()
+    try:
+        genes = _memberships(cursor, 'networks_bicluster_genes', 'gene_id', network_id)
+        conditions = _memberships(cursor, 'networks_bicluster_conditions', 'condition_id', network_id)
+    finally:
+        cursor.close()
+    biclusters = [ (bicluster_id, _indexes(gene_ids, genes.get(bicluster_id, [])),
+                    _indexes(condition_ids, conditions.get(bicluster_id, [])))
+                   for bicluster_id in Bicluster.objects.filter(network=network_id).values_list('id', flat=True) ]
+    return data, biclusters
+
+
+# the network's expression matrix in worker processes of network_quality
+_worker_data = None
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def _summary_task(task):
+    """
+    Summary statistics of one bicluster. Runs in a worker process.
+    """
+    bicluster_id, rows, columns = task
+    result = quality(_worker_data[rows][:, columns])
+    return bicluster_id, dict([ (key, result[key]) for key in SUMMARY ])
+
+
+def network_quality(network_id, processes=None):
+    """
+    Compute summary statistics (see SUMMARY) of all biclusters of a network
+    in a pool of worker processes, from one read of the network's expression
+    matrix. processes defaults to the number of CPUs. Use 1 to work in the
+    calling process. Generates (bicluster_id, statistics) in no particular
+    order.
+    """
+    data, tasks = network_biclusters(network_id)
+    if processes == 1:
+        _init_worker(data)
+        for task in tasks:
+            yield _summary_task(task)
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker, (data,))
+        try:
+            for result in pool.imap_unordered(_summary_task, tasks, chunksize=16):
+                yield result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+
+def _value(x):
+    # NaN doesn't go into the DB as such
+    return None if x != x else float(x)
+
+
+def refresh(network_id, processes=None):
+    """
+    Recompute the bicluster_quality rows of a network's biclusters. Returns
+    the number of biclusters.
+    """
+    version_id = Network.objects.values_list('version_id', flat=True).get(id=network_id)
+    rows = [ (bicluster_id, network_id, version_id,
+              _value(stats['residue']), _value(stats['abs_residue']), _value(stats['mean']),
+              _value(stats['variance']), stats['genes'], stats['conditions'])
+             for bicluster_id, stats in network_quality(network_id, processes) ]
+    cursor = connection.cursor()
+    try:
+        cursor.execute("delete from bicluster_quality where network_id=%s;", (network_id,))
+        insert_many(cursor, 'bicluster_quality',
+                    ['bicluster_id', 'network_id', 'version_id'] + list(SUMMARY), rows)
+        transaction.commit_unless_managed()
+    finally:
+        cursor.close()
+    return len(rows)
+
+
+def stored_quality(bicluster_id):
+    """
+    The summary statistics of a bicluster from the bicluster_quality table,
+    as a dictionary with the keys in SUMMARY plus version_id, or None if they
+    haven't been computed.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("select version_id, %s from bicluster_quality where bicluster_id=%%s;" %
+                       (", ".join(SUMMARY),), (bicluster_id,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    if row is None:
+        return None
+    return dict(zip(('version_id',) + SUMMARY, row))
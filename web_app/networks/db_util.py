@@ -0,0 +1,22 @@
+"""
+Helpers for writing to the database through raw cursors, shared by the code
+that fills precomputed tables and by the synthetic data generator.
+"""
+
+# number of rows sent to the database in one executemany
+INSERT_BATCH_SIZE = 10000
+
+
+def insert_many(cursor, table, columns, rows):
+    """
+    Insert rows into a table with executemany, a batch at a time.
+    """
+    sql = "insert into %s (%s) values (%s)" % (table, ", ".join(columns), ", ".join(["%s"] * len(columns)),)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            cursor.executemany(sql, batch)
+            batch = []
+    if batch:
+        cursor.executemany(sql, batch)
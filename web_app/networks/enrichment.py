@@ -0,0 +1,228 @@
+"""
+Functional enrichment of biclusters by the hypergeometric test, replacing
+r-scripts/functional.enrichment.R.
+
+For each network and system of functions (KEGG, GO, TIGR or COG), the
+background is the set of genes in some bicluster of the network. The gene x
+function incidence matrix of the species is read with annotations propagated
+to every ancestor of the annotated functions, through the function_closure
+table, and kept in sparse form as arrays of (gene, function) pairs. Joining
+it with bicluster membership gives, for every bicluster and function sharing
+at least one gene:
+
+    q = number of genes in the bicluster with the function
+    m = number of background genes with the function
+    n = number of background genes without it
+    k = number of genes in the bicluster
+
+and the p-value P(X >= q) for X hypergeometric with those parameters, computed
+for all pairs at once from a table of log factorials. Note that the R script
+computed phyper(q, m, n, k, lower.tail=F), which is P(X > q) and leaves out
+the observed count. Here p-values are those of phyper(q - 1, m, n, k,
+lower.tail=F), larger than the R script's, so enrichment computed by it must
+be recomputed to be compared with this module's. P-values are corrected
+for multiple testing per network and system by the Benjamini-Hochberg and
+Bonferroni methods, and written to networks_bicluster_function.
+
+Compute enrichment with: python manage.py compute_enrichment
+"""
+from django.db import connection, transaction
+import multiprocessing
+import numpy as np
+
+from db_util import insert_many
+
+SYSTEMS = ('kegg', 'go', 'tigr', 'cog')
+METHOD = 'hypergeometric'
+
+
+def log_factorials(n):
+    """
+    Array of log(i!) for i from 0 to n.
+    """
+    return np.concatenate([[0.0], np.cumsum(np.log(np.arange(1, n + 1, dtype=np.float64)))])
+
+
+def hypergeometric_sf(q, m, n, k):
+    """
+    P(X >= q) where X is the number of white balls in k draws without
+    replacement from an urn of m white and n black balls, for arrays of
+    parameters. That's R's phyper(q - 1, m, n, k, lower.tail=FALSE): the
+    observed count q is included in the tail. The tail is summed term by
+    term, so small p-values keep their precision.
+    """
+    q, m, n, k = [ np.asarray(a, dtype=np.int64) for a in (q, m, n, k) ]
+    p = np.zeros(q.shape)
+    if q.size == 0:
+        return p
+    lf = log_factorials(int((m + n).max()))
+    log_choose = lambda a, b: lf[a] - lf[b] - lf[a - b]
+    log_total = log_choose(m + n, k)
+    lower = np.maximum(0, k - n)
+    upper = np.minimum(m, k)
+    start = np.maximum(q, lower)
+    for j in range(max(int((upper - start).max()) + 1, 0)):
+        x = start + j
+        valid = x <= upper
+        x = np.minimum(x, upper)
+        p += np.where(valid, np.exp(log_choose(m, x) + log_choose(n, k - x) - log_total), 0.0)
+    return np.minimum(p, 1.0)
+
+
+def benjamini_hochberg(p):
+    """
+    Benjamini-Hochberg adjusted p-values, as by R's p.adjust(p, method='BH').
+    """
+    p = np.asarray(p, dtype=np.float64)
+    n = len(p)
+    if n == 0:
+        return p
+    order = np.argsort(p)[::-1]
+    adjusted = np.minimum.accumulate(p[order] * n / np.arange(n, 0, -1, dtype=np.float64))
+    result = np.empty(n)
+    result[order] = np.minimum(adjusted, 1.0)
+    return result
+
+
+def bonferroni(p):
+    p = np.asarray(p, dtype=np.float64)
+    return np.minimum(p * len(p), 1.0)
+
+
+def _index(values, keys):
+    # positions of keys in a sorted array of unique values
+    return np.searchsorted(values, keys)
+
+
+def enrichment(network_id, type):
+    """
+    Compute enrichment of the biclusters of a network for functions of one
+    type. Returns a dictionary of equal length arrays: bicluster_id,
+    function_id, gene_count (q), m, n, k, p, p_bh and p_b.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            select bg.bicluster_id, bg.gene_id
+            from networks_bicluster_genes bg join networks_bicluster b on bg.bicluster_id=b.id
+            where b.network_id=%s;""", (network_id,))
+        memberships = np.array(cursor.fetchall(), dtype=np.int64).reshape((-1, 2))
+
+        # the species' incidence matrix, propagated to ancestors
+        cursor.execute("""
+            select distinct gf.gene_id, c.ancestor_id
+            from networks_gene_function gf
+                 join networks_gene g on g.id=gf.gene_id
+                 join function_closure c on c.descendant_id=gf.function_id
+                 join networks_function f on f.id=c.ancestor_id
+            where g.species_id=(select species_id from networks_network where id=%s)
+            and f.type=%s;""", (network_id, type,))
+        annotations = np.array(cursor.fetchall(), dtype=np.int64).reshape((-1, 2))
+    finally:
+        cursor.close()
+
+    empty = dict([ (column, np.array([])) for column in
+                   ('bicluster_id', 'function_id', 'gene_count', 'm', 'n', 'k', 'p', 'p_bh', 'p_b') ])
+    if len(memberships) == 0 or len(annotations) == 0:
+        return empty
+
+    # index genes in the background, biclusters and functions
+    gene_ids = np.unique(memberships[:, 1])
+    bicluster_ids = np.unique(memberships[:, 0])
+    annotations = annotations[np.in1d(annotations[:, 0], gene_ids)]
+    function_ids = np.unique(annotations[:, 1])
+    member_b = _index(bicluster_ids, memberships[:, 0])
+    member_g = _index(gene_ids, memberships[:, 1])
+    ann_g = _index(gene_ids, annotations[:, 0])
+    ann_f = _index(function_ids, annotations[:, 1])
+    G, F = len(gene_ids), len(function_ids)
+
+    # functions of each gene, as runs of the annotations sorted by gene
+    order = np.argsort(ann_g, kind='mergesort')
+    ann_f = ann_f[order]
+    per_gene = np.bincount(ann_g, minlength=G)
+    gene_starts = np.cumsum(per_gene) - per_gene
+
+    # expand each bicluster member into its functions, then count genes per
+    # (bicluster, function) pair
+    repeats = per_gene[member_g]
+    offsets = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    pair_f = ann_f[np.repeat(gene_starts[member_g], repeats) + offsets]
+    keys = np.sort(np.repeat(member_b, repeats) * F + pair_f)
+    if len(keys) == 0:
+        return empty
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    q = np.diff(np.append(starts, len(keys)))
+    keys = keys[starts]
+    b, f = keys // F, keys % F
+
+    m = np.bincount(ann_f, minlength=F)[f]
+    n = G - m
+    k = np.bincount(member_b, minlength=len(bicluster_ids))[b]
+    p = hypergeometric_sf(q, m, n, k)
+    return {'bicluster_id':bicluster_ids[b], 'function_id':function_ids[f], 'gene_count':q,
+            'm':m, 'n':n, 'k':k, 'p':p, 'p_bh':benjamini_hochberg(p), 'p_b':bonferroni(p)}
+
+
+def enrich_network(network_id, types=SYSTEMS):
+    """
+    Compute enrichment of a network's biclusters for each type of function,
+    replacing any earlier results for those types. Returns a dictionary from
+    type to the number of bicluster/function pairs written.
+    """
+    counts = {}
+    for type in types:
+        result = enrichment(network_id, type)
+        cursor = connection.cursor()
+        try:
+            cursor.execute("""
+                delete from networks_bicluster_function
+                where bicluster_id in (select id from networks_bicluster where network_id=%s)
+                and function_id in (select id from networks_function where type=%s);""", (network_id, type,))
+            insert_many(cursor, 'networks_bicluster_function',
+                        ['bicluster_id', 'function_id', 'gene_count', 'm', 'n', 'k', 'p', 'p_bh', 'p_b', 'method'],
+                        ( (int(row[0]), int(row[1]), int(row[2]), int(row[3]), int(row[4]), int(row[5]),
+                           float(row[6]), float(row[7]), float(row[8]), METHOD)
+                          for row in zip(result['bicluster_id'], result['function_id'], result['gene_count'],
+                                         result['m'], result['n'], result['k'],
+                                         result['p'], result['p_bh'], result['p_b']) ))
+            transaction.commit_unless_managed()
+        finally:
+            cursor.close()
+        counts[type] = len(result['p'])
+    return counts
+
+
+def _enrich_task(task):
+    """
+    Compute enrichment for one network. Runs in a worker process, which opens
+    its own DB connection.
+    """
+    network_id, types = task
+    return network_id, enrich_network(network_id, types)
+
+
+def enrich_networks(network_ids, types=SYSTEMS, processes=None):
+    """
+    Compute enrichment for many networks in a pool of worker processes.
+    processes defaults to the number of CPUs. Use 1 to work in the calling
+    process. Generates (network_id, counts) as each network is finished.
+    """
+    tasks = [ (network_id, types) for network_id in network_ids ]
+    if processes == 1:
+        for task in tasks:
+            yield _enrich_task(task)
+    else:
+        # workers mustn't share the parent's connection, so close it before
+        # forking and let each process open its own
+        connection.close()
+        pool = multiprocessing.Pool(processes)
+        try:
+            for result in pool.imap_unordered(_enrich_task, tasks):
+                yield result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
@@ -0,0 +1,203 @@
+"""
+A precomputed on-disk store for expression data. Each network gets its own
+directory holding a float32 genes x conditions matrix saved as a .npy file,
+plus the gene and condition ids labeling its rows and columns, and the cells
+whose rows in the expression table hold null values. Matrices are
+memory-mapped on first use, so pulling out a set of conditions is a column
+slice rather than a trip through the expression table.
+
+A store is stamped with the version_id of its network when it's built. If the
+network's version_id changes, the store is considered stale and ignored until
+it is rebuilt with: python manage.py build_expression_store
+"""
+from django.conf import settings
+from django.db import connection
+import numpy as np
+import os
+import shutil
+
+from models import Network, Gene, DataMatrix
+
+DATA_FILE = 'data.npy'
+GENE_IDS_FILE = 'gene_ids.npy'
+CONDITION_IDS_FILE = 'condition_ids.npy'
+NULL_CELLS_FILE = 'null_cells.npy'
+VERSION_FILE = 'version'
+
+# stores that have been opened by this process, keyed by network id
+_stores = {}
+
+
+class ExpressionStore(object):
+    """
+    Memory-mapped expression matrix for a single network. Gene ids and
+    condition ids are sorted, so rows and columns can be found by binary search.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.data = np.load(os.path.join(path, DATA_FILE), mmap_mode='r')
+        self.gene_ids = np.load(os.path.join(path, GENE_IDS_FILE))
+        self.condition_ids = np.load(os.path.join(path, CONDITION_IDS_FILE))
+        # (row, column) of values stored as null, rather than missing
+        null_cells_path = os.path.join(path, NULL_CELLS_FILE)
+        if os.path.exists(null_cells_path):
+            self.null_cells = np.load(null_cells_path)
+        else:
+            self.null_cells = np.empty((0, 2), dtype=np.int32)
+        with open(os.path.join(path, VERSION_FILE), 'r') as f:
+            self.version_id = f.read().decode('utf-8')
+
+    def column_indexes(self, condition_ids):
+        """
+        Translate condition ids into column indexes. Returns None if any of the
+        conditions isn't in the store.
+        """
+        condition_ids = np.asarray(condition_ids, dtype=self.condition_ids.dtype)
+        if len(self.condition_ids) == 0:
+            return None if len(condition_ids) > 0 else np.array([], dtype=int)
+        columns = np.searchsorted(self.condition_ids, condition_ids)
+        columns[columns >= len(self.condition_ids)] = 0
+        if not np.all(self.condition_ids[columns] == condition_ids):
+            return None
+        return columns
+
+    def has_conditions(self, condition_ids):
+        return self.column_indexes(condition_ids) is not None
+
+    def column(self, condition_id):
+        """
+        Return the expression vector for a single condition as a tuple of
+        (gene_ids, values), leaving out genes with no data.
+        """
+        columns = self.column_indexes([condition_id])
+        if columns is None:
+            return None
+        values = np.asarray(self.data[:, columns[0]])
+        present = ~np.isnan(values)
+        return self.gene_ids[present], values[present]
+
+    def matrix(self, conditions):
+        """
+        Slice the columns for the given conditions out of the store and return
+        a DataMatrix, with the same shape as models.expression_matrix: rows are
+        genes having rows in the expression table, even with null values, for
+        at least one of the conditions, ordered by id.
+        """
+        columns = self.column_indexes([c.id for c in conditions])
+        if columns is None:
+            raise KeyError("Conditions not found in expression store at %s" % (self.path,))
+        m = np.asarray(self.data[:, columns], dtype=float)
+        present = ~np.all(np.isnan(m), axis=1)
+        present[self.null_cells[np.in1d(self.null_cells[:,1], columns), 0]] = True
+        gene_ids = self.gene_ids[present].tolist()
+        genes_by_id = Gene.objects.in_bulk(gene_ids)
+        return DataMatrix([ genes_by_id[id] for id in gene_ids ], conditions, m[present])
+
+
+def store_path(network_id):
+    return os.path.join(settings.EXPRESSION_STORE_DIR, "network_%d" % (network_id,))
+
+
+def get_store(network_id):
+    """
+    Return the ExpressionStore for a network, or None if no store has been built
+    or the store is out of date with respect to the network's version_id.
+    """
+    try:
+        version_id = Network.objects.values_list('version_id', flat=True).get(id=network_id)
+    except Network.DoesNotExist:
+        return None
+    store = _stores.get(network_id)
+    if store is None or store.version_id != version_id:
+        _stores.pop(network_id, None)
+        path = store_path(network_id)
+        if not os.path.exists(os.path.join(path, VERSION_FILE)):
+            return None
+        store = ExpressionStore(path)
+        if store.version_id != version_id:
+            return None
+        _stores[network_id] = store
+    return store
+
+
+def network_matrix(network_id):
+    """
+    The whole expression matrix of a network as (gene_ids, condition_ids,
+    data), where data is a genes x conditions float array with NaN for missing
+    values and the ids are sorted. Comes from the store if it's up to date,
+    otherwise from the database.
+    """
+    from models import expression_matrix_from_db
+
+    store = get_store(network_id)
+    if store is not None:
+        return store.gene_ids, store.condition_ids, np.asarray(store.data, dtype=float)
+    conditions = list(Network.objects.get(id=network_id).condition_set.order_by('id'))
+    matrix = expression_matrix_from_db(conditions)
+    return (np.array([ gene.id for gene in matrix.genes ], dtype=int),
+            np.array([ condition.id for condition in conditions ], dtype=int),
+            np.asarray(matrix.data, dtype=float))
+
+
+def invalidate(network_id):
+    """
+    Remove the store for a network from disk, for example before reloading
+    the network's expression data.
+    """
+    _stores.pop(network_id, None)
+    path = store_path(network_id)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+
+def _null_cells(network, matrix):
+    # (row, column) in the matrix of the network's expression rows with null values
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            select e.gene_id, e.condition_id
+            from expression e join networks_condition c on e.condition_id=c.id
+            where c.network_id=%s and e.value is null;""", (network.id,))
+        cells = np.array(cursor.fetchall(), dtype=int).reshape(-1, 2)
+    finally:
+        cursor.close()
+    gene_ids = np.array([ g.id for g in matrix.genes ], dtype=int)
+    condition_ids = np.array([ c.id for c in matrix.conditions ], dtype=int)
+    return np.column_stack([np.searchsorted(gene_ids, cells[:,0]),
+                            np.searchsorted(condition_ids, cells[:,1])]).astype(np.int32)
+
+
+def build_store(network):
+    """
+    Build the expression store for a network from the expression table. The
+    new store is written to a temporary directory and moved into place, so
+    readers never see a partially written store.
+    """
+    from models import expression_matrix_from_db
+
+    conditions = list(network.condition_set.order_by('id'))
+    matrix = expression_matrix_from_db(conditions)
+
+    path = store_path(network.id)
+    tmp_path = path + '.tmp'
+    old_path = path + '.old'
+    for p in (tmp_path, old_path):
+        if os.path.exists(p):
+            shutil.rmtree(p)
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path, DATA_FILE), matrix.data.astype(np.float32))
+    np.save(os.path.join(tmp_path, GENE_IDS_FILE), np.array([g.id for g in matrix.genes], dtype=np.int32))
+    np.save(os.path.join(tmp_path, CONDITION_IDS_FILE), np.array([c.id for c in conditions], dtype=np.int32))
+    np.save(os.path.join(tmp_path, NULL_CELLS_FILE), _null_cells(network, matrix))
+    with open(os.path.join(tmp_path, VERSION_FILE), 'w') as f:
+        f.write(network.version_id.encode('utf-8'))
+
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    _stores.pop(network.id, None)
+
+    return matrix.data.shape
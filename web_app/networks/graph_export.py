@@ -0,0 +1,293 @@
+"""
+Stream networks of biclusters, genes, regulatory influences and motifs out as
+GraphML or GML. Unlike building a networkx graph and serializing it, nodes
+and edges are written as they're read from database cursors, so memory use
+doesn't grow with the size of the network and a whole network can be
+exported.
+
+The graph has the same shape as the one built by
+helpers.get_nx_graph_for_biclusters: gene nodes are identified by gene name,
+other nodes by ids like "bicluster:123", and biclusters are linked to their
+genes, influences and motifs. With expand=True, combiners are also linked to
+the influences they combine.
+"""
+from xml.sax.saxutils import escape, quoteattr
+import zlib
+
+from models import PSSM, streaming_cursor
+
+# rows fetched from a cursor at a time, and graph elements per chunk of output
+FETCH_SIZE = 10000
+ELEMENTS_PER_CHUNK = 1000
+
+# GML needs integer node ids. They're derived from database ids so that edges
+# can be written without remembering which nodes have been seen.
+NODE_KINDS = ('gene', 'inf', 'bicluster', 'motif')
+
+# GraphML attribute declarations: key id, domain, attribute name, type
+GRAPHML_KEYS = (
+    ('type', 'node', 'type', 'string'),
+    ('name', 'node', 'name', 'string'),
+    ('consensus', 'node', 'consensus', 'string'),
+    ('e_value', 'node', 'e_value', 'double'),
+    ('expanded', 'node', 'expanded', 'boolean'),
+    ('edge_expanded', 'edge', 'expanded', 'boolean'),
+)
+
+
+class Scope(object):
+    """
+    A SQL subquery selecting the ids of the biclusters to export, plus its
+    parameters.
+    """
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = list(params)
+
+    @staticmethod
+    def network(network_id):
+        return Scope("select id from networks_bicluster where network_id=%s", [int(network_id)])
+
+    @staticmethod
+    def biclusters(bicluster_ids):
+        bicluster_ids = [ int(id) for id in bicluster_ids ]
+        if len(bicluster_ids) == 0:
+            return Scope("select id from networks_bicluster where 1=0", [])
+        return Scope("select id from networks_bicluster where id in (%s)" % (",".join(["%s"] * len(bicluster_ids)),),
+                     bicluster_ids)
+
+    @staticmethod
+    def gene(gene_name):
+        return Scope("""select bg.bicluster_id
+                        from networks_bicluster_genes bg join networks_gene g on bg.gene_id=g.id
+                        where g.name=%s""", [gene_name])
+
+
+def _rows(name, sql, params):
+    """
+    Generate the rows of a query, fetching them in batches from a server side
+    cursor where the database supports it.
+    """
+    cursor = streaming_cursor(name)
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        cursor.close()
+
+
+def _ref(kind, id, graphml_id=None):
+    """
+    Identify a node by its GML id and its GraphML id, which defaults to
+    something like "bicluster:123".
+    """
+    return (NODE_KINDS.index(kind) + len(NODE_KINDS) * id, graphml_id or "%s:%d" % (kind, id,))
+
+
+def _node(kind, id, graphml_id, attrs):
+    return ('node', _ref(kind, id, graphml_id), attrs)
+
+
+def _edge(source, target, attrs=None):
+    return ('edge', source, target, attrs or {})
+
+
+def _motif_nodes(scope):
+    """
+    Generate motif nodes, computing consensus sequences from PSSM rows as they
+    stream by in motif order.
+    """
+    rows = _rows('graph_export_motifs', """
+        select m.id, m.e_value, p.a, p.c, p.g, p.t
+        from networks_motif m left join pssms p on p.motif_id=m.id
+        where m.bicluster_id in (%s)
+        order by m.id, p.position""" % (scope.sql,), scope.params)
+
+    def node(motif_id, e_value, positions):
+        pssm = PSSM.from_array(positions) if positions else PSSM()
+        name = "motif:%d" % (motif_id,)
+        return _node('motif', motif_id, name, {'type':'motif', 'consensus':pssm.consensus(), 'e_value':e_value, 'name':name})
+
+    motif_id = None
+    for row in rows:
+        if row[0] != motif_id:
+            if motif_id is not None:
+                yield node(motif_id, e_value, positions)
+            motif_id, e_value, positions = row[0], row[1], []
+        if row[2] is not None:
+            positions.append(row[2:6])
+    if motif_id is not None:
+        yield node(motif_id, e_value, positions)
+
+
+def graph_elements(scope, expand=False):
+    """
+    Generate the nodes and then the edges of the network of biclusters selected
+    by scope. Nodes are tuples of ('node', (gml_id, graphml_id), attributes)
+    and edges are tuples of ('edge', source, target, attributes), where source
+    and target are (gml_id, graphml_id) pairs.
+    """
+    influences_sql = "select influence_id from networks_bicluster_influences where bicluster_id in (%s)" % (scope.sql,)
+    parts_sql = """
+        select ip.from_influence_id, ip.to_influence_id
+        from networks_influence_parts ip join networks_influence c on ip.from_influence_id=c.id
+        where c.type='combiner' and c.id in (%s)""" % (influences_sql,)
+
+    for id, name, common_name in _rows('graph_export_genes', """
+            select id, name, common_name from networks_gene
+            where id in (select gene_id from networks_bicluster_genes where bicluster_id in (%s))""" % (scope.sql,),
+            scope.params):
+        display_name = name if common_name is None or common_name == '' else name + " " + common_name
+        yield _node('gene', id, name, {'type':'gene', 'name':display_name})
+
+    for id, name in _rows('graph_export_influences', """
+            select id, name from networks_influence where id in (%s)""" % (influences_sql,),
+            scope.params):
+        yield _node('inf', id, None, {'type':'regulator', 'name':name})
+
+    if expand:
+        # parts of combiners that aren't themselves linked to a bicluster
+        for id, name in _rows('graph_export_parts', """
+                select id, name from networks_influence
+                where id in (select to_influence_id from (%s) parts)
+                and id not in (%s)""" % (parts_sql, influences_sql,),
+                scope.params + scope.params):
+            yield _node('inf', id, None, {'type':'regulator', 'name':name, 'expanded':True})
+
+    for id, k in _rows('graph_export_biclusters', """
+            select id, k from networks_bicluster where id in (%s)""" % (scope.sql,),
+            scope.params):
+        yield _node('bicluster', id, None, {'type':'bicluster', 'name':"Bicluster " + str(k)})
+
+    for node in _motif_nodes(scope):
+        yield node
+
+    for bicluster_id, gene_id, gene_name in _rows('graph_export_gene_edges', """
+            select bg.bicluster_id, g.id, g.name
+            from networks_bicluster_genes bg join networks_gene g on bg.gene_id=g.id
+            where bg.bicluster_id in (%s)""" % (scope.sql,),
+            scope.params):
+        yield _edge(_ref('bicluster', bicluster_id), _ref('gene', gene_id, gene_name))
+
+    for bicluster_id, influence_id in _rows('graph_export_influence_edges', """
+            select bicluster_id, influence_id from networks_bicluster_influences
+            where bicluster_id in (%s)""" % (scope.sql,),
+            scope.params):
+        yield _edge(_ref('bicluster', bicluster_id), _ref('inf', influence_id))
+
+    for bicluster_id, motif_id in _rows('graph_export_motif_edges', """
+            select bicluster_id, id from networks_motif
+            where bicluster_id in (%s)""" % (scope.sql,),
+            scope.params):
+        yield _edge(_ref('bicluster', bicluster_id), _ref('motif', motif_id))
+
+    if expand:
+        for combiner_id, part_id in _rows('graph_export_part_edges', parts_sql, scope.params):
+            yield _edge(_ref('inf', combiner_id), _ref('inf', part_id), {'expanded':True})
+
+
+def _chunks(lines):
+    """
+    Join lines of output into chunks, so responses aren't written a line at a time.
+    """
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= ELEMENTS_PER_CHUNK:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def _graphml_value(value):
+    if value is True or value is False:
+        return 'true' if value else 'false'
+    if isinstance(value, float):
+        return repr(value)
+    return escape(unicode(value)).encode('utf-8')
+
+
+def _graphml_lines(elements):
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    yield ('<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
+           'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+           'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns '
+           'http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
+    for key_id, domain, name, type in GRAPHML_KEYS:
+        yield '  <key id="%s" for="%s" attr.name="%s" attr.type="%s" />\n' % (key_id, domain, name, type,)
+    yield '  <graph edgedefault="undirected">\n'
+    for element in elements:
+        if element[0] == 'node':
+            attrs = element[2]
+            data = "".join([ '<data key="%s">%s</data>' % (key_id, _graphml_value(attrs[name]),)
+                             for key_id, domain, name, type in GRAPHML_KEYS
+                             if domain == 'node' and attrs.get(name) is not None ])
+            yield '    <node id=%s>%s</node>\n' % (quoteattr(element[1][1]).encode('utf-8'), data,)
+        else:
+            source, target, attrs = element[1:]
+            if attrs.get('expanded'):
+                data = '<data key="edge_expanded">true</data>'
+            else:
+                data = ''
+            yield '    <edge source=%s target=%s>%s</edge>\n' % (
+                quoteattr(source[1]).encode('utf-8'), quoteattr(target[1]).encode('utf-8'), data,)
+    yield '  </graph>\n'
+    yield '</graphml>\n'
+
+
+def graphml_chunks(scope, expand=False):
+    """
+    Generate the GraphML for the network of biclusters selected by scope, as
+    utf-8 encoded strings.
+    """
+    return _chunks(_graphml_lines(graph_elements(scope, expand)))
+
+
+def _gml_value(value):
+    if value is True or value is False:
+        return '1' if value else '0'
+    if isinstance(value, (int, long, float)):
+        return repr(value)
+    return '"%s"' % (escape(unicode(value), {'"':'&quot;'}).encode('utf-8'),)
+
+
+def _gml_lines(elements):
+    yield 'graph [\n'
+    for element in elements:
+        if element[0] == 'node':
+            (gml_id, label), attrs = element[1:]
+            yield '  node [\n    id %d\n    label %s\n%s  ]\n' % (gml_id, _gml_value(label),
+                "".join([ '    %s %s\n' % (name, _gml_value(attrs[name]),)
+                          for name in ('type', 'name', 'consensus', 'e_value', 'expanded')
+                          if attrs.get(name) is not None ]),)
+        else:
+            source, target, attrs = element[1:]
+            yield '  edge [\n    source %d\n    target %d\n%s  ]\n' % (source[0], target[0],
+                '    expanded 1\n' if attrs.get('expanded') else '',)
+    yield ']\n'
+
+
+def gml_chunks(scope, expand=False):
+    """
+    Generate the GML for the network of biclusters selected by scope, as utf-8
+    encoded strings.
+    """
+    return _chunks(_gml_lines(graph_elements(scope, expand)))
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compress a stream of strings in gzip format, chunk by chunk.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -41,40 +41,54 @@ def get_influence_biclusters(gene):
     return member_biclusters, sorted(influence_biclusters, key=lambda bi: (bi[0], bi[1].name))
 
 def get_nx_graph_for_biclusters(biclusters, expand=False):
+    """
+    Build a networkx graph of biclusters, their member genes, regulatory
+    influences and motifs. Everything is loaded with a handful of bulk queries,
+    so the number of queries doesn't depend on how many biclusters there are.
+    """
+    from models import Bicluster, Gene, Influence, Motif
     graph = nx.Graph()
 
-    # compile sets of genes and influences from all requested biclusters
-    genes = set()
-    influences = set()
-    for b in biclusters:
-        genes.update(b.genes.all())
-        influences.update(b.influences.all())
+    biclusters = list(biclusters)
+    bicluster_ids = [b.id for b in biclusters]
+    if len(bicluster_ids) == 0:
+        return graph
+
+    # fetch membership straight from the many-to-many tables
+    bicluster_genes = list(Bicluster.genes.through.objects.filter(bicluster__in=bicluster_ids).values_list('bicluster', 'gene'))
+    bicluster_influences = list(Bicluster.influences.through.objects.filter(bicluster__in=bicluster_ids).values_list('bicluster', 'influence'))
+    genes = Gene.objects.in_bulk(list(set(gene_id for b_id, gene_id in bicluster_genes)))
+    influences = Influence.objects.in_bulk(list(set(influence_id for b_id, influence_id in bicluster_influences)))
 
     # build networkx graph
-    for gene in genes:
+    for gene in genes.values():
         graph.add_node(gene, {'type':'gene', 'name':gene.display_name()})
-    for influence in influences:
+    for influence in influences.values():
         graph.add_node("inf:%d" % (influence.id,), {'type':'regulator', 'name':influence.name})
-        
-        # on request, we can add links for combiners (AND gates) to
-        # the influences they're combining. This makes a mess of larger
-        # networks, but works OK in very small networks (1-3 biclusters)
-        if expand and influence.is_combiner():
-            parts = influence.get_parts()
-            for part in parts:
-                if part not in influences:
-                    graph.add_node("inf:%d" % (part.id,), {'type':'regulator', 'name':part.name, 'expanded':True})
-                graph.add_edge("inf:%d" % (influence.id,), "inf:%d" % (part.id,), {'expanded':True})
-        
+
+    # on request, we can add links for combiners (AND gates) to
+    # the influences they're combining. This makes a mess of larger
+    # networks, but works OK in very small networks (1-3 biclusters)
+    if expand:
+        combiner_ids = [ influence.id for influence in influences.values() if influence.is_combiner() ]
+        if combiner_ids:
+            combiner_parts = list(Influence.parts.through.objects.filter(from_influence__in=combiner_ids).values_list('from_influence', 'to_influence'))
+            parts = Influence.objects.in_bulk(list(set(part_id for c_id, part_id in combiner_parts)))
+            for combiner_id, part_id in combiner_parts:
+                if part_id not in influences:
+                    graph.add_node("inf:%d" % (part_id,), {'type':'regulator', 'name':parts[part_id].name, 'expanded':True})
+                graph.add_edge("inf:%d" % (combiner_id,), "inf:%d" % (part_id,), {'expanded':True})
+
     for bicluster in biclusters:
         graph.add_node("bicluster:%d" %(bicluster.id,), {'type':'bicluster', 'name':str(bicluster)})
-        for gene in bicluster.genes.all():
-            graph.add_edge("bicluster:%d" %(bicluster.id,), gene)
-        for inf in bicluster.influences.all():
-            graph.add_edge("bicluster:%d" %(bicluster.id,), "inf:%d" % (inf.id,))
-            print ">>> " + str(inf)
-        for motif in bicluster.motif_set.all():
-            graph.add_node("motif:%d" % (motif.id,), {'type':'motif', 'consensus':motif.consensus(), 'e_value':motif.e_value, 'name':"motif:%d" % (motif.id,)})
-            graph.add_edge("bicluster:%d" %(bicluster.id,), "motif:%d" % (motif.id,))
-    
+    for bicluster_id, gene_id in bicluster_genes:
+        graph.add_edge("bicluster:%d" %(bicluster_id,), genes[gene_id])
+    for bicluster_id, influence_id in bicluster_influences:
+        graph.add_edge("bicluster:%d" %(bicluster_id,), "inf:%d" % (influence_id,))
+
+    # load motifs and their PSSMs for all biclusters up front
+    for motif in Motif.prefetch_pssms(Motif.objects.filter(bicluster__in=bicluster_ids)):
+        graph.add_node("motif:%d" % (motif.id,), {'type':'motif', 'consensus':motif.consensus(), 'e_value':motif.e_value, 'name':"motif:%d" % (motif.id,)})
+        graph.add_edge("bicluster:%d" %(motif.bicluster_id,), "motif:%d" % (motif.id,))
+
     return graph
@@ -0,0 +1,38 @@
+from optparse import make_option
+import time
+from django.core.management.base import BaseCommand, CommandError
+from web_app.networks.models import Network
+from web_app.networks import coexpression
+
+
+class Command(BaseCommand):
+    args = '<network_id network_id ...>'
+    help = ('Precompute the top co-expressed neighbors of every gene in the given networks '
+            '(or all networks) into the coexpression table, replacing earlier results. '
+            'Run build_expression_store first for speed.')
+    option_list = BaseCommand.option_list + (
+        make_option('--method', dest='method', choices=coexpression.METHODS, default='pearson',
+                    help='correlation method, one of: ' + ", ".join(coexpression.METHODS)),
+        make_option('--k', type='int', dest='k', default=coexpression.DEFAULT_K,
+                    help='number of neighbors to keep per gene, default %d' % (coexpression.DEFAULT_K,)),
+        make_option('--processes', type='int', dest='processes',
+                    help='number of worker processes, defaults to the number of CPUs'),
+        make_option('--block-size', type='int', dest='block_size', default=coexpression.BLOCK_SIZE,
+                    help='number of genes correlated at once by a worker, default %d' % (coexpression.BLOCK_SIZE,)),
+    )
+
+    def handle(self, *args, **options):
+        if args:
+            try:
+                networks = [ Network.objects.get(id=int(network_id)) for network_id in args ]
+            except (ValueError, Network.DoesNotExist):
+                raise CommandError("Unknown network in: %s" % (", ".join(args),))
+        else:
+            networks = Network.objects.all()
+
+        for network in networks:
+            start = time.time()
+            count = coexpression.build(network.id, options['method'], options['k'],
+                                       options['processes'], options['block_size'])
+            self.stdout.write("Network %d (%s): %d %s neighbors in %.1f seconds\n" %
+                              (network.id, network.name, count, options['method'], time.time() - start,))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from web_app.networks.models import Network
+from web_app.networks import expression_store
+
+
+class Command(BaseCommand):
+    args = '<network_id network_id ...>'
+    help = ('Build memory-mapped expression matrices for the given networks '
+            '(or all networks). Rerun after loading expression data or changing '
+            'a network\'s version_id.')
+
+    def handle(self, *args, **options):
+        if args:
+            try:
+                networks = [ Network.objects.get(id=int(network_id)) for network_id in args ]
+            except (ValueError, Network.DoesNotExist):
+                raise CommandError("Unknown network in: %s" % (", ".join(args),))
+        else:
+            networks = Network.objects.all()
+
+        for network in networks:
+            shape = expression_store.build_store(network)
+            self.stdout.write("Built expression store for network %d (%s): %d genes x %d conditions\n" %
+                              (network.id, network.name, shape[0], shape[1],))
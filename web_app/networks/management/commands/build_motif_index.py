@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from web_app.networks.motif_similarity import MotifIndex
+
+
+class Command(BaseCommand):
+    help = ('Build the index used to find similar motifs across all networks from '
+            'the pssms table. Rerun after loading motifs.')
+
+    def handle(self, *args, **options):
+        index = MotifIndex.from_db()
+        index.save(settings.MOTIF_INDEX_PATH)
+        self.stdout.write("Built motif index of %d motifs (%d k-mer entries) at %s\n" %
+                          (len(index), len(index.kmer_keys), settings.MOTIF_INDEX_PATH,))
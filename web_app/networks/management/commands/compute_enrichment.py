@@ -0,0 +1,38 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from web_app.networks.models import Network
+from web_app.networks import enrichment
+from web_app.networks import caching
+
+
+class Command(BaseCommand):
+    args = '<network_id network_id ...>'
+    help = ('Compute functional enrichment of biclusters by the hypergeometric test '
+            'for the given networks (or all networks), replacing earlier results. '
+            'Run rebuild_function_closure first if functions have changed.')
+    option_list = BaseCommand.option_list + (
+        make_option('--type', action='append', dest='types', choices=enrichment.SYSTEMS,
+                    help='compute enrichment for this type of function, may be given more than once. '
+                         'Defaults to all of: ' + ", ".join(enrichment.SYSTEMS)),
+        make_option('--processes', type='int', dest='processes',
+                    help='number of worker processes, defaults to the number of CPUs'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            network_ids = [ int(network_id) for network_id in args ]
+        except ValueError:
+            raise CommandError("Network ids should be integers: %s" % (", ".join(args),))
+        if network_ids:
+            found = set(Network.objects.filter(id__in=network_ids).values_list('id', flat=True))
+            if len(found) < len(set(network_ids)):
+                raise CommandError("Unknown network in: %s" % (", ".join(args),))
+        else:
+            network_ids = list(Network.objects.values_list('id', flat=True))
+
+        types = options['types'] or enrichment.SYSTEMS
+        for network_id, counts in enrichment.enrich_networks(network_ids, types, options['processes']):
+            self.stdout.write("Network %d: %s\n" % (network_id,
+                              ", ".join([ "%d %s" % (counts[t], t,) for t in types ]),))
+
+        caching.invalidate()
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from web_app.networks import synthetic
+import time
+
+
+class Command(BaseCommand):
+    help = ('Generate a synthetic species and network, with genes, biclusters, '
+            'influences, motifs, expression data and functions, for benchmarking. '
+            'Sizes default to: ' +
+            ", ".join([ "%s=%d" % (key, value) for key, value in sorted(synthetic.DEFAULTS.items()) ]))
+    option_list = BaseCommand.option_list + (
+        make_option('--name', dest='name', default='Synthetic species',
+                    help='Name of the species.'),
+        make_option('--short-name', dest='short_name', default=None,
+                    help='Short name of the species, also used as a prefix for gene names. Must be unique.'),
+        make_option('--seed', type='int', dest='seed', default=0,
+                    help='Seed for the random number generator.'),
+    ) + tuple([ make_option('--' + key.replace('_', '-'), type='int', dest=key, default=None)
+                for key in sorted(synthetic.DEFAULTS.keys()) ])
+
+    def handle(self, *args, **options):
+        scale = dict([ (key, options[key]) for key in synthetic.DEFAULTS.keys() ])
+        started = time.time()
+
+        def log(message):
+            self.stdout.write("%7.1fs  %s\n" % (time.time() - started, message,))
+
+        network = synthetic.generate(options['name'], options['short_name'], options['seed'], log, **scale)
+        self.stdout.write("Created network %d (%s) in %.1fs\n" % (network.id, network.name, time.time() - started,))
@@ -0,0 +1,16 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from web_app.networks import caching
+
+
+class Command(BaseCommand):
+    help = ('Invalidate everything cached for pages and JSON data, in every process. '
+            'The import scripts do this when they finish.')
+    option_list = BaseCommand.option_list + (
+        make_option('--clear', action='store_true', dest='clear', default=False,
+                    help='also empty the shared cache, rather than letting old entries expire'),
+    )
+
+    def handle(self, *args, **options):
+        caching.invalidate(options['clear'])
+        self.stdout.write("Cache invalidated, data version is now %s\n" % (caching.data_version(),))
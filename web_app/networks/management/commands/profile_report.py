@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+import json
+
+from web_app.networks.profiling import percentile
+
+
+def summarize(records):
+    """
+    Group profile records by name and compute percentiles of total time, plus
+    query counts and DB time, for each name.
+    """
+    by_name = {}
+    for record in records:
+        by_name.setdefault(record['name'], []).append(record)
+    summary = {}
+    for name, group in by_name.items():
+        total = [ r['total_ms'] for r in group ]
+        # only a sample of requests have their queries recorded
+        sampled = [ r for r in group if r['queries'] is not None ]
+        summary[name] = {
+            'requests': len(group),
+            'p50_ms': percentile(total, 50),
+            'p95_ms': percentile(total, 95),
+            'p99_ms': percentile(total, 99),
+            'p95_queries': percentile([ r['queries'] for r in sampled ], 95),
+            'max_queries': max([ r['queries'] for r in sampled ]) if sampled else None,
+            'p95_db_ms': percentile([ r['db_ms'] for r in sampled ], 95),
+            'p95_template_ms': percentile([ r['template_ms'] for r in group ], 95),
+        }
+    return summary
+
+
+class Command(BaseCommand):
+    args = '<profile log ...>'
+    help = ('Summarize request profiles logged by QueryProfilerMiddleware, with '
+            'p50/p95/p99 response times per URL name. Reads settings.PROFILE_LOG '
+            'if no log files are given.')
+    option_list = BaseCommand.option_list + (
+        make_option('--json', action='store_true', dest='json', default=False,
+                    help='Output the summary as JSON.'),
+        make_option('--since', type='float', dest='since', default=None,
+                    help='Only include requests logged after this unix time.'),
+    )
+
+    def handle(self, *args, **options):
+        records = []
+        for filename in (args or [settings.PROFILE_LOG]):
+            try:
+                with open(filename, 'r') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        if options['since'] is None or record.get('time', 0) >= options['since']:
+                            records.append(record)
+            except IOError, e:
+                raise CommandError("Can't read profile log %s: %s" % (filename, e,))
+
+        summary = summarize(records)
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2, sort_keys=True) + "\n")
+            return
+
+        self.stdout.write("%-40s %8s %9s %9s %9s %8s %8s %9s\n" %
+                          ('url name', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'p95 qry', 'max qry', 'p95 db ms'))
+        # query statistics are missing for names with no sampled requests
+        missing = lambda format, value: format % (value,) if value is not None else '-'
+        for name, s in sorted(summary.items(), key=lambda item: -item[1]['p95_ms']):
+            self.stdout.write("%-40s %8d %9.1f %9.1f %9.1f %8s %8s %9s\n" %
+                              (name[:40], s['requests'], s['p50_ms'], s['p95_ms'], s['p99_ms'],
+                               missing('%d', s['p95_queries']), missing('%d', s['max_queries']),
+                               missing('%.1f', s['p95_db_ms']),))
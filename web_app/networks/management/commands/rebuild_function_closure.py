@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from web_app.networks.models import Function
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the function_closure table, the transitive closure of the '
+            'function hierarchies. Run this after importing functions.')
+
+    def handle(self, *args, **options):
+        count = Function.rebuild_closure()
+        self.stdout.write("%d function ancestor/descendant pairs\n" % (count,))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from web_app.networks import caching
+from web_app.networks.models import Network, Function
+
+
+class Command(BaseCommand):
+    args = '<network_id network_id ...>'
+    help = ('Rebuild the precomputed lookup tables for the given networks (or all '
+            'networks), and the function closure table. Run this after importing '
+            'a network.')
+
+    def handle(self, *args, **options):
+        if args:
+            try:
+                networks = [ Network.objects.get(id=int(network_id)) for network_id in args ]
+            except (ValueError, Network.DoesNotExist):
+                raise CommandError("Unknown network in: %s" % (", ".join(args),))
+        else:
+            networks = Network.objects.all()
+
+        count = Function.rebuild_closure()
+        self.stdout.write("Function closure: %d ancestor/descendant pairs\n" % (count,))
+
+        for network in networks:
+            count = network.rebuild_tf_regulates_bicluster()
+            self.stdout.write("Network %d (%s): %d tf -> bicluster regulation links\n" %
+                              (network.id, network.name, count,))
+            count = network.rebuild_gene_comembership()
+            self.stdout.write("Network %d (%s): %d gene co-membership pairs\n" %
+                              (network.id, network.name, count,))
+
+        caching.invalidate()
@@ -0,0 +1,31 @@
+from optparse import make_option
+import time
+from django.core.management.base import BaseCommand, CommandError
+from web_app.networks.models import Network
+from web_app.networks import coherence
+
+
+class Command(BaseCommand):
+    args = '<network_id network_id ...>'
+    help = ('Recompute the residue, mean and variance of every bicluster of the given networks '
+            '(or all networks) from expression data into the bicluster_quality table. '
+            'Run build_expression_store first for speed.')
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes',
+                    help='number of worker processes, defaults to the number of CPUs'),
+    )
+
+    def handle(self, *args, **options):
+        if args:
+            try:
+                networks = [ Network.objects.get(id=int(network_id)) for network_id in args ]
+            except (ValueError, Network.DoesNotExist):
+                raise CommandError("Unknown network in: %s" % (", ".join(args),))
+        else:
+            networks = Network.objects.all()
+
+        for network in networks:
+            start = time.time()
+            count = coherence.refresh(network.id, options['processes'])
+            self.stdout.write("Network %d (%s): %d biclusters in %.1f seconds\n" %
+                              (network.id, network.name, count, time.time() - start,))
@@ -0,0 +1,33 @@
+from optparse import make_option
+import time
+from django.core.management.base import BaseCommand, CommandError
+from web_app.networks.models import Network
+from web_app.networks import plots
+
+
+class Command(BaseCommand):
+    args = '<network_id network_id ...>'
+    help = ('Render the expression plots of every bicluster of the given networks '
+            '(or all networks) into the plot cache, skipping plots already rendered '
+            'for the current version of the network. Run build_expression_store first for speed.')
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes',
+                    help='number of worker processes, defaults to the number of CPUs'),
+        make_option('--force', action='store_true', dest='force', default=False,
+                    help='render all plots, even those already in the cache'),
+    )
+
+    def handle(self, *args, **options):
+        if args:
+            try:
+                networks = [ Network.objects.get(id=int(network_id)) for network_id in args ]
+            except (ValueError, Network.DoesNotExist):
+                raise CommandError("Unknown network in: %s" % (", ".join(args),))
+        else:
+            networks = Network.objects.all()
+
+        for network in networks:
+            start = time.time()
+            count = plots.render_network(network.id, options['processes'], options['force'])
+            self.stdout.write("Network %d (%s): rendered %d plots in %.1f seconds\n" %
+                              (network.id, network.name, count, time.time() - start,))
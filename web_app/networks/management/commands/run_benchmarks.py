@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from web_app.networks.models import Network
+from web_app.networks import benchmarks
+import json
+
+
+class Command(BaseCommand):
+    args = '[network_id]'
+    help = ('Time the heavy pages and data paths (gene, bicluster, graphml export, '
+            'expression matrices, search) against a network, by default the most '
+            'recently created one, and write a JSON report. Names of benchmarks: ' +
+            ", ".join([ name for name, f in benchmarks.BENCHMARKS ]))
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat', type='int', dest='repeat', default=5,
+                    help='Number of timed runs of each benchmark.'),
+        make_option('--only', action='append', dest='only', default=None,
+                    help='Run only the named benchmark. May be repeated.'),
+        make_option('--output', dest='output', default=None,
+                    help='Write the JSON report to this file.'),
+        make_option('--compare', dest='compare', default=None,
+                    help='Compare median times with an earlier JSON report.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            if args:
+                network = Network.objects.get(id=int(args[0]))
+            else:
+                network = Network.objects.order_by('-id')[0]
+        except (ValueError, IndexError, Network.DoesNotExist):
+            raise CommandError("No such network. Make one with generate_synthetic_data.")
+
+        report = benchmarks.run(network, options['repeat'], options['only'],
+                                lambda message: self.stdout.write(message + "\n"))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        else:
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+        if options['compare']:
+            with open(options['compare'], 'r') as f:
+                baseline = json.load(f)
+            self.stdout.write("%-36s %12s %12s %8s\n" % ('benchmark', 'baseline ms', 'median ms', 'ratio'))
+            for name, base, median, ratio in benchmarks.compare(report, baseline):
+                self.stdout.write("%-36s %12.1f %12.1f %8s\n" % (name, base, median,
+                                  "%.2f" % (ratio,) if ratio is not None else '-'))
@@ -0,0 +1,65 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from web_app.networks.models import Motif, Chromosome
+from web_app.networks import motif_scan
+
+
+class Command(BaseCommand):
+    help = ('Scan chromosome sequences for instances of motifs and store the hits '
+            'in the motif_hits table, replacing earlier hits for the same motifs.')
+    option_list = BaseCommand.option_list + (
+        make_option('--network', type='int', dest='network',
+                    help='scan the motifs of biclusters in this network'),
+        make_option('--motif', type='int', action='append', dest='motifs',
+                    help='scan this motif, may be given more than once'),
+        make_option('--p-value', type='float', dest='p_value', default=motif_scan.DEFAULT_P_VALUE,
+                    help='keep hits with p-values at or below this threshold'),
+        make_option('--processes', type='int', dest='processes',
+                    help='number of worker processes, defaults to the number of CPUs'),
+    )
+
+    def handle(self, *args, **options):
+        motifs = Motif.objects.select_related('bicluster__network')
+        if options['motifs']:
+            motifs = motifs.filter(id__in=options['motifs'])
+        elif options['network']:
+            motifs = motifs.filter(bicluster__network=options['network'])
+        else:
+            raise CommandError("Specify motifs with --motif or --network.")
+
+        # motifs are scanned against the genome of their network's species
+        motifs_by_species = {}
+        for motif in motifs:
+            motifs_by_species.setdefault(motif.bicluster.network.species_id, []).append(motif.id)
+
+        for species_id, motif_ids in motifs_by_species.items():
+            chromosomes = []
+            for chromosome in Chromosome.objects.filter(species=species_id):
+                path = chromosome.sequence_path()
+                if path:
+                    chromosomes.append((chromosome.id, path, chromosome.topology == 'circular'))
+                else:
+                    self.stderr.write("Warning: no sequence for chromosome %s, skipping.\n" % (chromosome.name,))
+
+            pssms = Motif.pssms_for(motif_ids)
+            scan_list = [ (motif_id, pssms[motif_id].values) for motif_id in motif_ids if motif_id in pssms ]
+
+            cursor = connection.cursor()
+            try:
+                cursor.execute("delete from motif_hits where motif_id in (%s);" %
+                               (",".join(["%s"] * len(motif_ids)),), motif_ids)
+                count = 0
+                for hits in motif_scan.scan_genome(chromosomes, scan_list, p_value=options['p_value'],
+                                                   processes=options['processes']):
+                    cursor.executemany("""
+                        insert into motif_hits
+                        (motif_id, chromosome_id, start, "end", strand, score, p_value)
+                        values (%s, %s, %s, %s, %s, %s, %s);""", hits)
+                    count += len(hits)
+                transaction.commit_unless_managed()
+            finally:
+                cursor.close()
+
+            self.stdout.write("Species %d: scanned %d chromosomes for %d motifs, found %d hits.\n" %
+                              (species_id, len(chromosomes), len(scan_list), count,))
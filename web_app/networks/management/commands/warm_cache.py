@@ -0,0 +1,62 @@
+from optparse import make_option
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from web_app.networks.models import Network
+from web_app.networks import warmup
+
+
+class Command(BaseCommand):
+    args = '<network_id network_id ...>'
+    help = ('Warm the cache by requesting the pages and JSON data of every gene, bicluster, '
+            'regulator and motif of the given networks (or all networks), most connected first, '
+            'and report response time percentiles by kind of page.')
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', type='int', dest='threads', default=4,
+                    help='number of concurrent requests, default 4'),
+        make_option('--kind', action='append', dest='kinds', choices=warmup.KINDS,
+                    help='only request this kind of page, may be given more than once. '
+                         'Defaults to all of: ' + ", ".join(warmup.KINDS)),
+        make_option('--limit', type='int', dest='limit',
+                    help='request at most this many pages per network'),
+        make_option('--json', action='store_true', dest='json', default=False,
+                    help='Output the summary as JSON.'),
+    )
+
+    def handle(self, *args, **options):
+        if args:
+            try:
+                networks = [ Network.objects.get(id=int(network_id)) for network_id in args ]
+            except (ValueError, Network.DoesNotExist):
+                raise CommandError("Unknown network in: %s" % (", ".join(args),))
+        else:
+            networks = Network.objects.all()
+
+        summaries = {}
+        for network in networks:
+            paths = warmup.warmup_paths(network, options['kinds'] or warmup.KINDS)
+            if options['limit']:
+                paths = paths[:options['limit']]
+            start = time.time()
+            results = list(warmup.crawl(paths, options['threads']))
+            summary = warmup.summarize(results)
+            summaries[network.id] = summary
+            if options['json']:
+                continue
+
+            self.stdout.write("Network %d (%s): %d requests in %.1f seconds\n" %
+                              (network.id, network.name, len(results), time.time() - start,))
+            self.stdout.write("%-10s %8s %7s %7s %9s %9s %9s %9s\n" %
+                              ('kind', 'requests', 'errors', 'hits', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'))
+            for kind in warmup.KINDS:
+                if kind in summary:
+                    s = summary[kind]
+                    self.stdout.write("%-10s %8d %7d %7d %9.1f %9.1f %9.1f %9.1f\n" %
+                                      (kind, s['requests'], s['errors'], s['hits'],
+                                       s['p50_ms'], s['p95_ms'], s['p99_ms'], s['max_ms'],))
+            for kind, path, status, ms, cache in results:
+                if status != 200:
+                    self.stdout.write("  %d %s\n" % (status, path,))
+
+        if options['json']:
+            self.stdout.write(json.dumps(summaries, indent=2) + "\n")
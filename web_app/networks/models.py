@@ -1,11 +1,17 @@
 from django.db import models
 from django.db import connection
+from django.db import transaction
 from django.contrib.auth.models import User
+from django.conf import settings
 from helpers import synonym
+import logging
+import os
 import re
 import numpy as np
 import StringIO
 
+logger = logging.getLogger('networks.models')
+
 
 class Species(models.Model):
     name = models.CharField(max_length=255)
@@ -37,6 +43,23 @@ class Chromosome(models.Model):
         print "ucsc_name = %s" % (str(ucsc_name),)
         return ucsc_name if ucsc_name else self.name
     
+    def sequence_path(self):
+        """
+        Path to a FASTA file holding the sequence of this chromosome, or None.
+        Sequences live in settings.SEQUENCE_DIR under a directory named for the
+        species' short name, in a file named for the chromosome's RefSeq
+        accession or its name, for example sequences/dvu/NC_002937.fa
+        """
+        directory = os.path.join(settings.SEQUENCE_DIR, self.species.short_name)
+        for name in (self.refseq, self.name):
+            if not name:
+                continue
+            for extension in ('.fa', '.fasta', '.fna'):
+                path = os.path.join(directory, name + extension)
+                if os.path.exists(path):
+                    return path
+        return None
+    
     def __unicode__(self):
         return self.name
 
@@ -51,6 +74,67 @@ class Network(models.Model):
     def get_biclusters_regulated_by(regulator):
         biclusters = Bicluster.objects.filter(influences__name__contains=regulator)
     
+    def rebuild_tf_regulates_bicluster(self):
+        """
+        Recompute the tf_regulates_bicluster table for this network, which
+        records biclusters regulated by each transcription factor, either
+        directly or through (one level of) and-gates. Run this after importing
+        or changing the network's influences. Returns the number of rows.
+        """
+        try:
+            cursor = connection.cursor()
+            cursor.execute("delete from tf_regulates_bicluster where network_id=%s;", (self.id,))
+            cursor.execute("""
+                insert into tf_regulates_bicluster (network_id, gene_id, bicluster_id, via_combiner)
+                select distinct nb.network_id, ni.gene_id, nb.id, false
+                from networks_bicluster nb
+                     join networks_bicluster_influences bi on nb.id=bi.bicluster_id
+                     join networks_influence ni on bi.influence_id=ni.id
+                where nb.network_id=%s
+                and ni.type='tf' and ni.gene_id is not null
+                union
+                select distinct nb.network_id, part.gene_id, nb.id, true
+                from networks_bicluster nb
+                     join networks_bicluster_influences bi on nb.id=bi.bicluster_id
+                     join networks_influence ni on bi.influence_id=ni.id
+                     join networks_influence_parts nip on nip.from_influence_id=ni.id
+                     join networks_influence part on nip.to_influence_id=part.id
+                where nb.network_id=%s
+                and ni.type='combiner' and part.gene_id is not null;
+                """, (self.id, self.id,))
+            count = cursor.rowcount
+            transaction.commit_unless_managed()
+            return count
+        finally:
+            cursor.close()
+
+    def rebuild_gene_comembership(self):
+        """
+        Recompute the gene_comembership table for this network, which records,
+        for each pair of genes that are members of a common bicluster, the
+        number of biclusters they share. Pairs are stored in both orders, and
+        each gene is paired with itself, so all of a gene's neighbors are found
+        by one indexed read. Run this after importing or changing the network's
+        biclusters. Returns the number of rows.
+        """
+        try:
+            cursor = connection.cursor()
+            cursor.execute("delete from gene_comembership where network_id=%s;", (self.id,))
+            cursor.execute("""
+                insert into gene_comembership (network_id, gene_id, neighbor_id, shared_biclusters)
+                select nb.network_id, bg1.gene_id, bg2.gene_id, count(*)
+                from networks_bicluster nb
+                     join networks_bicluster_genes bg1 on nb.id=bg1.bicluster_id
+                     join networks_bicluster_genes bg2 on bg1.bicluster_id=bg2.bicluster_id
+                where nb.network_id=%s
+                group by nb.network_id, bg1.gene_id, bg2.gene_id;
+                """, (self.id,))
+            count = cursor.rowcount
+            transaction.commit_unless_managed()
+            return count
+        finally:
+            cursor.close()
+    
     def __unicode__(self):
         return self.name
     
@@ -61,8 +145,16 @@ class Condition(models.Model):
     
     def expression(self):
         """
-        Retrieve the expression vector for this condition.
+        Retrieve the expression vector for this condition, as a list of
+        (gene_id, value) pairs ordered by gene_id.
         """
+        from expression_store import get_store
+        store = get_store(self.network_id)
+        if store is not None:
+            column = store.column(self.id)
+            if column is not None:
+                gene_ids, values = column
+                return zip(gene_ids.tolist(), values.tolist())
         try:
             cursor = connection.cursor()
             cursor.execute("""
@@ -79,66 +171,138 @@ class Condition(models.Model):
     def __unicode__(self):
         return self.name
 
+# number of rows pulled from the expression table per round trip when
+# assembling a matrix
+EXPRESSION_FETCH_SIZE = 50000
+
+class DataMatrix(object):
+    """
+    A matrix of expression data. Rows correspond to genes and columns to
+    conditions, so data[i,j] is the expression of genes[i] under conditions[j].
+    """
+    def __init__(self, genes, conditions, data):
+        self.genes = genes
+        self.conditions = conditions
+        self.data = data
+
+def streaming_cursor(name):
+    """
+    Get a cursor that streams results from the server rather than pulling the
+    whole result set into client memory on execute. On PostgreSQL that's a
+    named (server-side) cursor, which must be used inside a transaction.
+    It's wrapped like Django's own cursors, so its queries are logged in
+    connection.queries when DEBUG or use_debug_cursor is on. Other backends
+    get an ordinary cursor.
+    """
+    if connection.vendor == 'postgresql':
+        # make sure the underlying connection is open
+        connection.cursor()
+        cursor = connection.connection.cursor(name=name)
+        if connection.use_debug_cursor or (connection.use_debug_cursor is None and settings.DEBUG):
+            cursor = connection.make_debug_cursor(cursor)
+        return cursor
+    return connection.cursor()
+
 def expression_matrix(conditions):
+    """
+    Retrieve an expression matrix for a given list of conditions. Input is a
+    list of condition objects. Returns a DataMatrix as described in
+    expression_matrix_from_db. If the conditions all belong to one network
+    and an up-to-date expression store has been built for that network, the
+    matrix is sliced out of the store. Otherwise, it comes from the database.
+    """
+    from expression_store import get_store
+    conditions = list(conditions)
+    network_ids = set([c.network_id for c in conditions])
+    if len(network_ids) == 1:
+        store = get_store(network_ids.pop())
+        if store is not None and store.has_conditions([c.id for c in conditions]):
+            return store.matrix(conditions)
+    return expression_matrix_from_db(conditions)
+
+def expression_matrix_from_db(conditions):
     """
     Retrieve an expression matrix from the database, for a given list of
     conditions. Input is a list of condition objects. Returns a DataMatrix
     object with three members:
     - conditions: a list of condition objects
-    - genes: a list of gene objects
+    - genes: a list of gene objects, ordered by gene id
     - data: a numpy array of 2 dimensions containing gene expression
             data under the given conditions.
+    Expression data may be sparse - different genes have data for different
+    conditions. Missing values are NaN.
     """
+    conditions = list(conditions)
+    condition_ids = np.array([c.id for c in conditions], dtype=int)
+    if len(condition_ids) == 0:
+        return DataMatrix([], conditions, np.empty([0, 0]))
+
+    # pull all (gene_id, condition_id, value) triples in one query, a block
+    # of rows at a time. Null values come out of numpy as NaN.
+    blocks = []
+    cursor = streaming_cursor('expression_matrix')
     try:
-        cursor = connection.cursor()
-        
-        # create and populate temp table
-        cursor.execute("create temporary table temp_genes ( gene_id integer );")
         cursor.execute("""
-            insert into temp_genes
-            select distinct(gene_id)
-            from expression
-            where condition_id in (%s)
-            order by gene_id;""" % (",".join([str(c.id) for c in conditions]),) )
-        cursor.execute("""select gene_id from temp_genes;""")
-        gene_ids = [ row[0] for row in cursor ]
-
-        # create a numpy 2D array
-        # print "%d, %d" % (len(gene_ids), len(conditions),)
-        m = np.empty([len(gene_ids), len(conditions)])
-
-        # left join with temp_genes so that we get all the genes, even if
-        # expression data is sparse - different genes have data for different
-        # conditions. Result may contain nulls.
-        column_num = 0
-        for condition in conditions:
-            cursor.execute("""
-                select e.value
-                from temp_genes tg left join expression e on tg.gene_id=e.gene_id
-                where e.condition_id = %s
-                order by tg.gene_id;
-                """ % (condition.id,))
-            row_num = 0
-            for row in cursor:
-                m[row_num,column_num] = row[0]
-                row_num += 1
-            column_num += 1
-            row_num = 0
-        
-        class DataMatrix:
-            pass
-        
-        result = DataMatrix()
-        result.genes = list(Gene.objects.filter(id__in=gene_ids))
-        result.conditions = conditions
-        result.data = m
-
-        return result
+            select e.gene_id, e.condition_id, e.value
+            from expression e
+            where e.condition_id in (%s);""" % (",".join([str(id) for id in condition_ids]),))
+        while True:
+            rows = cursor.fetchmany(EXPRESSION_FETCH_SIZE)
+            if not rows:
+                break
+            blocks.append(np.array(rows, dtype=float))
     finally:
-        if cursor:
-            cursor.execute("drop table temp_genes;")
-            cursor.execute("commit;")
         cursor.close()
+    triples = np.vstack(blocks) if blocks else np.empty([0, 3])
+
+    # translate ids into row and column indexes and scatter the values into
+    # a NaN-filled matrix. Genes are sorted by id, conditions keep the order
+    # in which they were passed in.
+    gene_ids = np.unique(triples[:,0].astype(int))
+    rows = np.searchsorted(gene_ids, triples[:,0])
+    order = np.argsort(condition_ids)
+    columns = order[np.searchsorted(condition_ids[order], triples[:,1])]
+
+    m = np.empty([len(gene_ids), len(conditions)])
+    m.fill(np.nan)
+    m[rows, columns] = triples[:,2]
+
+    genes_by_id = Gene.objects.in_bulk(gene_ids.tolist())
+    genes = [ genes_by_id[id] for id in gene_ids.tolist() ]
+
+    return DataMatrix(genes, conditions, m)
+
+# number of matrix rows formatted at a time when writing TSV
+TSV_BLOCK_SIZE = 1000
+
+def expression_matrix_to_tsv_chunks(matrix, coords=False, block_size=TSV_BLOCK_SIZE):
+    """
+    Generate an expression matrix in tab-separated-values format with
+    conditions as columns and genes as rows, yielding one string per block of
+    rows. The matrix is a DataMatrix object as returned by the function
+    expression_matrix. If coords is True, genes are labeled by their genomic
+    coordinates rather than by name. The result can be handed directly to an
+    HttpResponse.
+    """
+    yield "\t".join(["GENE"] + [ condition.name for condition in matrix.conditions ]) + "\n"
+
+    if coords:
+        # load chromosomes in one query, rather than one per gene
+        chromosomes = Chromosome.objects.in_bulk(set([ gene.chromosome_id for gene in matrix.genes ]))
+        labels = [ "%s%s:%d-%d" % (chromosomes[gene.chromosome_id].name, gene.strand, gene.start, gene.end,)
+                   if gene.chromosome_id in chromosomes else gene.name
+                   for gene in matrix.genes ]
+    else:
+        labels = [ gene.name for gene in matrix.genes ]
+
+    # format a whole row with one string operation, like numpy's savetxt. 12
+    # significant digits, as str() gives and earlier exports had.
+    w = np.size(matrix.data, axis=1)
+    row_format = "%s" + ("\t%.12g" * w) + "\n"
+    for start in range(0, len(labels), block_size):
+        block = matrix.data[start:start+block_size].tolist()
+        yield "".join([ row_format % tuple([label] + row)
+                        for label, row in zip(labels[start:start+block_size], block) ])
 
 def expression_matrix_to_tsv_stream(matrix, ostr, coords=False):
     """
@@ -146,34 +310,54 @@ def expression_matrix_to_tsv_stream(matrix, ostr, coords=False):
     with conditions as columns and genes as rows. The matrix is a DataMatrix
     object as returned by the function expression_matrix.
     """
-    ostr.write("GENE")
-    for condition in matrix.conditions:
-        ostr.write("\t")
-        ostr.write(condition.name)
-    ostr.write("\n")
-    l = np.size(matrix.data, axis=0)
-    w = np.size(matrix.data, axis=1)
-    gene_names = [ gene.name for gene in matrix.genes]
-    for i in range(l):
-        if coords:
-            gene = matrix.genes[i]
-            ostr.write("%s%s:%d-%d" % (gene.chromosome.name, gene.strand, gene.start, gene.end,))
-        else:
-            ostr.write(gene_names[i])
-        for j in range(w):
-            ostr.write("\t")
-            ostr.write(str(matrix.data[i,j]))
-        ostr.write("\n")
+    for chunk in expression_matrix_to_tsv_chunks(matrix, coords):
+        ostr.write(chunk)
 
 def expression_matrix_to_tsv(matrix):
     """
     Output an expression matrix to a string in tab-separated format. The matrix
-    is a DataMatrix object as returned by the function expression_matrix.
+    is a DataMatrix object as returned by the function expression_matrix. For
+    large matrices, prefer expression_matrix_to_tsv_chunks.
+    """
+    return "".join(expression_matrix_to_tsv_chunks(matrix))
+
+
+def comembership_rows(gene_id, network_id=None):
+    """
+    A table expression, aliased gc, for the gene_comembership rows of a gene
+    in one network or all networks, and its parameters, as (sql, params).
+    Networks whose rows haven't been built with
+    Network.rebuild_gene_comembership, as right after an import, are counted
+    from their bicluster memberships instead, with a warning.
     """
-    import StringIO
-    ostr = StringIO.StringIO()
-    expression_matrix_to_tsv_stream(matrix, ostr)
-    return ostr.getvalue()
+    cursor = connection.cursor()
+    try:
+        sql = """
+            select n.id from networks_network n
+            where not exists (select 1 from gene_comembership gc where gc.network_id=n.id)"""
+        params = []
+        if network_id is not None:
+            sql += " and n.id=%s"
+            params.append(network_id)
+        cursor.execute(sql, params)
+        unbuilt = [ row[0] for row in cursor.fetchall() ]
+    finally:
+        cursor.close()
+    if not unbuilt:
+        return "gene_comembership gc", []
+    logger.warning("gene_comembership hasn't been built for networks %s, run: python manage.py rebuild_network_tables" %
+                   (", ".join([ str(id) for id in unbuilt ]),))
+    return """(
+            select network_id, gene_id, neighbor_id, shared_biclusters
+            from gene_comembership where gene_id=%%s
+            union all
+            select nb.network_id, bg1.gene_id, bg2.gene_id, count(*)
+            from networks_bicluster nb
+                 join networks_bicluster_genes bg1 on nb.id=bg1.bicluster_id
+                 join networks_bicluster_genes bg2 on bg1.bicluster_id=bg2.bicluster_id
+            where bg1.gene_id=%%s and nb.network_id in (%s)
+            group by nb.network_id, bg1.gene_id, bg2.gene_id) gc""" % (",".join([ str(int(id)) for id in unbuilt ]),), \
+        [gene_id, gene_id]
 
 
 class Gene(models.Model):
@@ -217,6 +401,7 @@ class Gene(models.Model):
     def regulated_biclusters(self, network):
         """
         Return biclusters regulated by this gene, either directly or through (one level of) and-gates.
+        Looked up in the precomputed tf_regulates_bicluster table, see Network.rebuild_tf_regulates_bicluster.
         """
         if not self.transcription_factor or network==None:
             return []
@@ -226,20 +411,20 @@ class Gene(models.Model):
             else:
                 network_id = network.id
             return Bicluster.objects.raw("""
-            select distinct(nb.*)
+            select nb.*
             from networks_bicluster nb
-                 join networks_bicluster_influences bi on nb.id=bi.bicluster_id
-                 join networks_influence ni on bi.influence_id=ni.id
-            where nb.network_id=%s
-            and ((ni.type='tf' and ni.gene_id=%s)
-            or (ni.type='combiner' and ni.id in (
-              select from_influence_id
-              from networks_influence_parts nip join networks_influence ni on nip.to_influence_id=ni.id
-              where ni.gene_id=%s)))
+            where nb.id in (
+              select bicluster_id
+              from tf_regulates_bicluster
+              where network_id=%s and gene_id=%s)
             order by nb.id;
-            """, (network_id, self.id, self.id,))
+            """, (network_id, self.id,))
 
     def count_regulated_biclusters(self, network):
+        """
+        Count biclusters regulated by this gene. If you need the biclusters too,
+        it's cheaper to take the length of regulated_biclusters.
+        """
         if not self.transcription_factor or network==None:
             return 0
         if type(network)==int:
@@ -249,35 +434,57 @@ class Gene(models.Model):
         try:
             cursor = connection.cursor()
             cursor.execute("""
-                select count(distinct(nb.id))
-                from networks_bicluster nb
-                     join networks_bicluster_influences bi on nb.id=bi.bicluster_id
-                     join networks_influence ni on bi.influence_id=ni.id
-                where nb.network_id=%s
-                and ((ni.type='tf' and ni.gene_id=%s)
-                or (ni.type='combiner' and ni.id in (
-                  select from_influence_id
-                  from networks_influence_parts nip join networks_influence ni on nip.to_influence_id=ni.id
-                  where ni.gene_id=%s)));
-            """, (network_id, self.id, self.id,))
+                select count(distinct(bicluster_id))
+                from tf_regulates_bicluster
+                where network_id=%s and gene_id=%s;
+            """, (network_id, self.id,))
             return cursor.fetchone()[0]
         finally:
             cursor.close()
     
     def neighbor_genes(self, network):
         """
-        Return this genes neighbors, the set of genes with comembership in some bicluster with this gene.
+        Return this genes neighbors, the set of genes with comembership in some bicluster with this gene,
+        including the gene itself, sorted by name. Each gene has a shared_biclusters attribute holding the
+        number of biclusters it shares with this gene. Looked up in the precomputed gene_comembership table,
+        see Network.rebuild_gene_comembership, or counted if it hasn't been built for the network.
+        """
+        if network==None:
+            return []
+        elif type(network)==int:
+            network_id = network
+        else:
+            network_id = network.id
+        source, params = comembership_rows(self.id, network_id)
+        return list(Gene.objects.raw("""
+            select g.*, gc.shared_biclusters
+            from networks_gene g join %s on g.id=gc.neighbor_id
+            where gc.network_id=%%s and gc.gene_id=%%s
+            order by g.name;
+            """ % (source,), params + [network_id, self.id]))
+
+    def ranked_neighbor_genes(self, network, limit=None):
+        """
+        Return this gene's neighbors, not including the gene itself, ordered by the number of biclusters
+        they share with this gene, most first. Each gene has a shared_biclusters attribute.
         """
         if network==None:
-            return set()
+            return []
         elif type(network)==int:
             network_id = network
         else:
             network_id = network.id
-        result = set()
-        for bicluster in self.bicluster_set.filter(network=network_id):
-            result.update(bicluster.genes.all())
-        return sorted(result)
+        source, params = comembership_rows(self.id, network_id)
+        sql = """
+            select g.*, gc.shared_biclusters
+            from networks_gene g join %s on g.id=gc.neighbor_id
+            where gc.network_id=%%s and gc.gene_id=%%s and gc.neighbor_id<>gc.gene_id
+            order by gc.shared_biclusters desc, g.name""" % (source,)
+        params += [network_id, self.id]
+        if limit is not None:
+            sql += " limit %s"
+            params.append(int(limit))
+        return list(Gene.objects.raw(sql, params))
     
     def __cmp__(self, other):
         return cmp(self.name, other.name)
@@ -357,62 +564,104 @@ def find_biclusters_with_function(function, network=None, p_b_cutoff=None, p_bh_
         args['bicluster_function__p_bh__lte'] = p_bh_cutoff
     return Bicluster.objects.filter(**args)
 
-class PSSM():
+class PSSM(object):
     """
     Position specific scoring matrix. Not a Django model 'cause one PSSM is
     not a single row in the DB but several (one row per position).
-    At each position, 
+    Backed by a float32 numpy array of shape (L, 4). Row i holds the
+    frequencies of the bases a, c, g and t, in that order, at position i.
+    Iterating over a PSSM yields one dictionary per position, keyed by
+    base, which is what templates expect.
     """
-    def __init__(self):
-        self.positions=[]
+    __slots__ = ('values',)
+
+    BASES = ('a', 'c', 'g', 't')
+
+    # order of bases expected by wei-ju's logo viewer
+    LOGO_ALPHABET = ('A', 'C', 'T', 'G')
+
+    def __init__(self, values=None):
+        if values is None:
+            values = np.empty([0, 4])
+        self.values = np.ascontiguousarray(values, dtype=np.float32).reshape(-1, 4)
+
+    @classmethod
+    def from_array(cls, values):
+        """
+        Make a PSSM from a sequence of positions, each holding the values
+        for a, c, g and t in that order, for example an (L, 4) numpy array.
+        """
+        return cls(values)
 
     def add_position(self, dict):
-        self.positions.append(dict)
+        self.values = np.vstack([self.values, np.array([[dict[base] for base in PSSM.BASES]], dtype=np.float32)])
 
     def get_position(self, p):
-        return self.positions[p]
-    
+        return dict(zip(PSSM.BASES, self._python_values(self.values[p].reshape(1, 4))[0]))
+
     def __iter__(self):
-        i = 0
-        while i < len(self.positions):
-            yield self.positions[i]
-            i += 1
-    
+        for row in self._python_values(self.values):
+            yield dict(zip(PSSM.BASES, row))
+
     def __len__(self):
-        return len(self.positions)
-    
+        return len(self.values)
+
+    @staticmethod
+    def _python_values(values):
+        # Convert float32 values to python floats for templates and JSON, rounded
+        # so that values like 0.8 don't come out as 0.800000011920929.
+        return np.round(values.astype(float), 7).tolist()
+
     def as_string(self):
         """
         Serialize the PSSM out to a string to stick in a URL and send to RegPredict
         """
-        ostr = StringIO.StringIO()
-        ostr.write("POSITION A C G T ")
-        i = 1
-        for p in self.positions:
-            ostr.write(str(i))
-            ostr.write(" ")
-            ostr.write(" ".join([ str(p[base]) for base in ('a', 'c', 'g', 't')]))
-            ostr.write(" ")
-            i += 1
-        return ostr.getvalue()
-    
+        return "POSITION A C G T " + "".join([ "%d %.7g %.7g %.7g %.7g " % ((i + 1,) + tuple(row))
+                                               for i, row in enumerate(self.values.tolist()) ])
+
     def consensus(self):
-        letters = []
-        for p in self.positions:
-            max_letter = 'a'
-            for letter in p.keys():
-                if p[letter] > p[max_letter]:
-                    max_letter = letter
-            if p[max_letter] > 0.8:
-                letters.append(max_letter.upper())
-            elif p[max_letter] > 0.4:
-                letters.append(max_letter)
-            else:
-                letters.append('.')
-        return "".join(letters)
+        """
+        Consensus sequence, with the most frequent base at each position in upper
+        case if its frequency is greater than 0.8, lower case if greater than 0.4,
+        and a '.' otherwise.
+        """
+        if len(self.values) == 0:
+            return ""
+        # ties go to the base that comes first in the order a, c, t, g
+        order = np.array([0, 1, 3, 2])
+        best = order[np.argmax(self.values[:, order], axis=1)]
+        frequency = self.values[np.arange(len(self.values)), best]
+        letters = np.where(frequency > np.float32(0.8), np.array(list('ACGT'))[best],
+                           np.where(frequency > np.float32(0.4), np.array(list('acgt'))[best], '.'))
+        return "".join(letters.tolist())
+
+    def information_content(self):
+        """
+        Information content, in bits, at each position, relative to a uniform
+        background. Returns a numpy array of length L. The information content
+        of the whole motif is the sum.
+        """
+        p = self.values.astype(float)
+        plogp = np.zeros_like(p)
+        nonzero = p > 0
+        plogp[nonzero] = p[nonzero] * np.log2(p[nonzero])
+        return 2.0 + plogp.sum(axis=1)
 
-    def __len__(self):
-        return len(self.positions)
+    def reverse_complement(self):
+        """
+        Return the PSSM for the opposite strand. Because columns are in the order
+        a, c, g, t, complementing the bases is reversing the columns.
+        """
+        return PSSM(self.values[::-1, ::-1])
+
+    def to_logo(self):
+        """
+        Representation of the PSSM for the sequence logo viewer, suitable for
+        serializing to JSON.
+        """
+        columns = [ PSSM.BASES.index(base.lower()) for base in PSSM.LOGO_ALPHABET ]
+        return {'alphabet': list(PSSM.LOGO_ALPHABET),
+                'values': self._python_values(self.values[:, columns]) }
 
 class Motif(models.Model):
     bicluster = models.ForeignKey(Bicluster)
@@ -424,21 +673,55 @@ class Motif(models.Model):
         return self.pssm().consensus()
     
     def pssm(self):
+        if not hasattr(self, '_pssm'):
+            self._pssm = Motif.pssms_for([self.id]).get(self.id, PSSM())
+        return self._pssm
+
+    @staticmethod
+    def pssms_for(motif_ids):
+        """
+        Load the PSSMs for many motifs in a single query. Returns a dictionary
+        from motif id to PSSM. Motifs with no PSSM are left out.
+        """
+        motif_ids = [ int(motif_id) for motif_id in motif_ids ]
+        if len(motif_ids) == 0:
+            return {}
         try:
             cursor = connection.cursor()
-
-            # Data retrieval operation - no commit required
-            cursor.execute("select position, a, c, g, t from pssms where motif_id=%s order by position;", [self.id])
+            cursor.execute("""
+                select motif_id, a, c, g, t
+                from pssms
+                where motif_id in (%s)
+                order by motif_id, position;""" % (",".join(["%s"] * len(motif_ids)),),
+                motif_ids)
             rows = cursor.fetchall()
-        
-            pssm = PSSM()
-            for row in rows:
-                pssm.add_position({'a':row[1], 'c':row[2], 'g':row[3], 't':row[4]})
-
-            self._pssm = pssm
-            return pssm
         finally:
             cursor.close()
+        if len(rows) == 0:
+            return {}
+
+        # rows come grouped by motif, so each motif's PSSM is the (L, 4) block
+        # of rows from the first occurrence of its id to the start of the next
+        values = np.array(rows, dtype=float)
+        ids, starts = np.unique(values[:,0].astype(int), return_index=True)
+        ends = np.append(starts[1:], len(values))
+        return { motif_id: PSSM.from_array(values[start:end, 1:])
+                 for motif_id, start, end in zip(ids.tolist(), starts.tolist(), ends.tolist()) }
+
+    @staticmethod
+    def prefetch_pssms(motifs):
+        """
+        Load the PSSMs for a list of motifs in one query and cache them on the
+        motif objects, so calls to pssm() and consensus() don't hit the DB.
+        Motifs whose PSSMs are already loaded are skipped. Returns the motifs
+        as a list.
+        """
+        motifs = list(motifs)
+        to_load = [ motif for motif in motifs if not hasattr(motif, '_pssm') ]
+        pssms = Motif.pssms_for([ motif.id for motif in to_load ])
+        for motif in to_load:
+            motif._pssm = pssms.get(motif.id, PSSM())
+        return motifs
 
 # A generalized annotation field. Put annotation on any type of object.
 class Annotation(models.Model):
@@ -513,6 +796,103 @@ class Function(models.Model):
         finally:
             cursor.close()
     
+    def _closure_relations(self, relations):
+        # SQL restricting function_closure rows to the given relation types
+        if not relations:
+            return "", ()
+        return " and c.type in (%s)" % (",".join(["%s"] * len(relations)),), tuple(relations)
+
+    def ancestors(self, relations=None):
+        """
+        Get all ancestors of this function, through any of the given relation
+        types, or all types. Each function has a depth attribute, the length
+        of the shortest path to it. Returns a Django RawQuerySet ordered by
+        depth.
+        """
+        sql, params = self._closure_relations(relations)
+        return Function.objects.raw("""
+        select f.*, c.depth
+        from networks_function f
+             join (select c.ancestor_id, min(c.depth) as depth
+                   from function_closure c
+                   where c.descendant_id=%s and c.depth > 0""" + sql + """
+                   group by c.ancestor_id) c on f.id=c.ancestor_id
+        order by c.depth, f.native_id;""", (self.id,) + params)
+
+    def descendants(self, relations=None):
+        """
+        Get all descendants of this function, through any of the given
+        relation types, or all types. Each function has a depth attribute, the
+        length of the shortest path to it. Returns a Django RawQuerySet ordered
+        by depth.
+        """
+        sql, params = self._closure_relations(relations)
+        return Function.objects.raw("""
+        select f.*, c.depth
+        from networks_function f
+             join (select c.descendant_id, min(c.depth) as depth
+                   from function_closure c
+                   where c.ancestor_id=%s and c.depth > 0""" + sql + """
+                   group by c.descendant_id) c on f.id=c.descendant_id
+        order by c.depth, f.native_id;""", (self.id,) + params)
+
+    def count_descendant_genes(self, species=None, relations=None):
+        """
+        Count the genes annotated with this function or any of its descendants,
+        optionally only those of a species.
+        """
+        sql, params = self._closure_relations(relations)
+        if species:
+            sql += " and g.species_id=%s"
+            params += (species.id if isinstance(species, Species) else species,)
+        try:
+            cursor = connection.cursor()
+            cursor.execute("""
+                select count(distinct gf.gene_id)
+                from function_closure c
+                     join networks_gene_function gf on gf.function_id=c.descendant_id
+                     join networks_gene g on g.id=gf.gene_id
+                where c.ancestor_id=%s""" + sql + ";", (self.id,) + params)
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
+    def has_descendant(self, function, relations=None):
+        """
+        Whether a function is in the subtree rooted at this function, that is,
+        whether it's this function or one of its descendants.
+        """
+        sql, params = self._closure_relations(relations)
+        function_id = function.id if isinstance(function, Function) else function
+        try:
+            cursor = connection.cursor()
+            cursor.execute("""
+                select 1 from function_closure c
+                where c.ancestor_id=%s and c.descendant_id=%s""" + sql + " limit 1;",
+                (self.id, function_id,) + params)
+            return cursor.fetchone() is not None
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def rebuild_closure():
+        """
+        Recompute the function_closure table from the function relationships,
+        through the function_closure_paths view (see sql/function.sql). Run
+        this after importing functions. Returns the number of rows.
+        """
+        try:
+            cursor = connection.cursor()
+            cursor.execute("delete from function_closure;")
+            cursor.execute("""
+                insert into function_closure (ancestor_id, descendant_id, depth, type)
+                select ancestor_id, descendant_id, depth, type from function_closure_paths;""")
+            count = cursor.rowcount
+            transaction.commit_unless_managed()
+            return count
+        finally:
+            cursor.close()
+
     def display_id(self):
         """
         Returns the native ID, if one exists, otherwise the database primary key ID.
@@ -564,6 +944,9 @@ class Gene_Function(models.Model):
     gene = models.ForeignKey(Gene)
     source = models.CharField(max_length=255, blank=True, null=True)
 
+    class Meta:
+        unique_together = ('gene', 'function', 'source',)
+
 class Bicluster_Function(models.Model):
     bicluster = models.ForeignKey(Bicluster)
     function = models.ForeignKey(Function)
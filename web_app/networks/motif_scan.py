@@ -0,0 +1,226 @@
+"""
+Scan chromosome sequences for instances of motifs. A motif's PSSM is turned
+into a log-odds matrix against the base composition of the chromosome, and
+every window of the sequence, on both strands, is scored by summing matrix
+entries looked up by base. Hits are windows whose score has a p-value below
+a threshold, where p-values come from the exact distribution of scores of
+random sequence, computed by dynamic programming over discretized scores.
+
+Circular chromosomes are scanned across the origin. A hit spanning the origin
+starts near the end of the chromosome and ends past its length, at end -
+length on the far side of the origin, so start <= end holds for all hits.
+
+This module is plain numpy, so it can run in worker processes. Scans across
+many chromosomes and motifs are farmed out to a process pool by scan_genome.
+Reading motifs from and writing hits to the database is left to the caller,
+see the scan_motifs management command.
+"""
+import multiprocessing
+import numpy as np
+
+# translate ascii codes of bases into indexes 0-3 for a, c, g, t. Anything
+# else (N's and other ambiguity codes) gets 4.
+BASE_INDEX = np.empty(256, dtype=np.uint8)
+BASE_INDEX.fill(4)
+for i, base in enumerate('ACGT'):
+    BASE_INDEX[ord(base)] = i
+    BASE_INDEX[ord(base.lower())] = i
+
+DEFAULT_P_VALUE = 1e-4
+DEFAULT_PSEUDOCOUNT = 0.01
+
+# bins per unit of log-odds score when computing score distributions
+SCORE_RESOLUTION = 100
+
+# encoded sequences already read by this process, keyed by filename
+_sequences = {}
+
+
+def read_fasta(filename):
+    """
+    Read the first record of a FASTA file and return its sequence as a string.
+    """
+    lines = []
+    with open(filename, 'r') as f:
+        header = f.readline()
+        if not header.startswith('>'):
+            raise ValueError("Not a FASTA file: %s" % (filename,))
+        for line in f:
+            if line.startswith('>'):
+                break
+            lines.append(line.strip())
+    return "".join(lines)
+
+
+def encode(sequence):
+    """
+    Encode a sequence as a numpy array of base indexes, a=0, c=1, g=2, t=3 and
+    anything else = 4.
+    """
+    return BASE_INDEX[np.frombuffer(sequence, dtype=np.uint8)]
+
+
+def encoded_sequence(filename):
+    if filename not in _sequences:
+        _sequences[filename] = encode(read_fasta(filename))
+    return _sequences[filename]
+
+
+def background_frequencies(encoded):
+    """
+    Frequencies of a, c, g and t in an encoded sequence.
+    """
+    counts = np.bincount(encoded, minlength=5)[:4].astype(float)
+    if counts.sum() == 0:
+        return np.array([0.25, 0.25, 0.25, 0.25])
+    return counts / counts.sum()
+
+
+def log_odds(values, background, pseudocount=DEFAULT_PSEUDOCOUNT):
+    """
+    Convert an (L, 4) matrix of base frequencies into a log-odds (base 2) scoring
+    matrix against the given background frequencies.
+    """
+    values = np.asarray(values, dtype=float)
+    p = (values + pseudocount) / (values.sum(axis=1)[:, np.newaxis] + 4 * pseudocount)
+    return np.log2(p / background)
+
+
+def reverse_complement(matrix):
+    """
+    Reverse complement an (L, 4) matrix with columns in the order a, c, g, t.
+    """
+    return matrix[::-1, ::-1]
+
+
+def score_windows(encoded, matrix):
+    """
+    Score every window of an encoded sequence with an (L, 4) scoring matrix.
+    Returns an array holding the score of the window starting at each position.
+    Windows containing N's score -inf.
+    """
+    L = len(matrix)
+    n = len(encoded) - L + 1
+    if L == 0 or n <= 0:
+        return np.empty(0)
+    # add a column for N's
+    matrix = np.hstack([matrix, np.empty([L, 1])])
+    matrix[:, 4] = -np.inf
+    scores = np.zeros(n)
+    for j in range(L):
+        scores += matrix[j][encoded[j:j+n]]
+    return scores
+
+
+class ScoreDistribution(object):
+    """
+    The distribution of scores of a scoring matrix over random sequence drawn
+    from the background distribution. Scores are discretized into bins of
+    width 1/resolution.
+    """
+    def __init__(self, matrix, background, resolution=SCORE_RESOLUTION):
+        self.resolution = resolution
+        discrete = np.round(np.asarray(matrix) * resolution).astype(int)
+        mins = discrete.min(axis=1)
+        self.offset = mins.sum()
+        shifted = discrete - mins[:, np.newaxis]
+
+        # convolve the per-position distributions one position at a time
+        dist = np.zeros(shifted.max(axis=1).sum() + 1)
+        dist[0] = 1.0
+        for row in shifted:
+            new_dist = np.zeros_like(dist)
+            for base in range(4):
+                s = row[base]
+                new_dist[s:] += background[base] * dist[:len(dist)-s]
+            dist = new_dist
+
+        # tail[i] is the probability of a score >= (i + offset) / resolution
+        self.tail = np.cumsum(dist[::-1])[::-1]
+
+    def _bins(self, scores):
+        bins = np.round(np.asarray(scores) * self.resolution).astype(int) - self.offset
+        return np.clip(bins, 0, len(self.tail) - 1)
+
+    def threshold(self, p_value):
+        """
+        The lowest score whose p-value is no greater than the given p-value.
+        """
+        above = np.flatnonzero(self.tail <= p_value)
+        if len(above) == 0:
+            return np.inf
+        return float(above[0] + self.offset) / self.resolution
+
+    def p_values(self, scores):
+        return self.tail[self._bins(scores)]
+
+
+def scan(encoded, values, background, p_value=DEFAULT_P_VALUE, pseudocount=DEFAULT_PSEUDOCOUNT,
+         circular=False):
+    """
+    Scan both strands of an encoded sequence for instances of a motif, given its
+    (L, 4) frequency matrix. Returns a list of hits as tuples of (start, end,
+    strand, score, p_value), with 1-based inclusive coordinates on the forward
+    strand. If the sequence is circular, windows wrapping around its end are
+    scanned, too, and their ends are past the length of the sequence.
+    """
+    matrix = log_odds(values, background, pseudocount)
+    L = len(matrix)
+    if circular and 1 < L <= len(encoded):
+        encoded = np.concatenate([encoded, encoded[:L-1]])
+    hits = []
+    for strand, m in (('+', matrix), ('-', reverse_complement(matrix))):
+        dist = ScoreDistribution(m, background)
+        scores = score_windows(encoded, m)
+        starts = np.flatnonzero(scores >= dist.threshold(p_value))
+        hit_scores = scores[starts]
+        hits.extend(zip((starts + 1).tolist(),
+                        (starts + L).tolist(),
+                        [strand] * len(starts),
+                        hit_scores.tolist(),
+                        dist.p_values(hit_scores).tolist()))
+    return hits
+
+
+def _scan_task(task):
+    """
+    Scan one chromosome for a batch of motifs. Runs in a worker process.
+    """
+    chromosome_id, filename, circular, motifs, p_value, pseudocount = task
+    encoded = encoded_sequence(filename)
+    background = background_frequencies(encoded)
+    hits = []
+    for motif_id, values in motifs:
+        for start, end, strand, score, p in scan(encoded, values, background, p_value, pseudocount, circular):
+            hits.append((motif_id, chromosome_id, start, end, strand, score, p))
+    return hits
+
+
+def scan_genome(chromosomes, motifs, p_value=DEFAULT_P_VALUE, pseudocount=DEFAULT_PSEUDOCOUNT,
+                processes=None, motifs_per_task=50):
+    """
+    Scan chromosomes for many motifs using a pool of worker processes.
+    chromosomes: a list of (chromosome_id, FASTA filename, circular) tuples
+    motifs: a list of (motif_id, (L, 4) frequency matrix) pairs
+    processes: number of worker processes, defaults to the number of CPUs. Use
+    1 to scan in the calling process.
+    Generates lists of hits as tuples of (motif_id, chromosome_id, start, end,
+    strand, score, p_value), one list per chromosome and batch of motifs.
+    """
+    tasks = [ (chromosome_id, filename, circular, motifs[i:i+motifs_per_task], p_value, pseudocount)
+              for chromosome_id, filename, circular in chromosomes
+              for i in range(0, len(motifs), motifs_per_task) ]
+    if processes == 1:
+        for task in tasks:
+            yield _scan_task(task)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            for hits in pool.imap_unordered(_scan_task, tasks):
+                yield hits
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
@@ -0,0 +1,280 @@
+"""
+Find motifs similar to a given motif across all networks. Motifs are compared
+column by column, using either the Pearson correlation of base frequencies or
+the average log likelihood ratio (ALLR), at every offset with a minimum
+overlap and on both strands. The best alignment's average column score is the
+similarity of the pair.
+
+Comparisons are batched: all candidate PSSMs are kept in a padded
+(N, max length, 4) array, and column scores against the query are computed
+for a whole block of candidates at once. To avoid comparing against every
+motif, a MotifIndex maps k-mers of each motif's consensus (on both strands) to
+the motifs containing them, and only motifs sharing a k-mer with the query
+are scored.
+
+The index is built from the pssms table with: python manage.py build_motif_index
+and saved to settings.MOTIF_INDEX_PATH, from which web processes load it.
+Without that file, each process builds the index from the database, which is
+slow, and rebuilds it whenever the data version changes.
+"""
+from django.conf import settings
+from django.db import connection
+import numpy as np
+import os
+
+import caching
+
+KMER_LENGTH = 4
+
+# minimum number of aligned columns for an alignment to count
+MIN_OVERLAP = 6
+
+# a consensus base needs at least this frequency to be part of a k-mer
+KMER_BASE_FREQUENCY = 0.4
+
+# number of sites assumed for motifs with no site count, for ALLR
+DEFAULT_SITES = 10
+
+PSEUDOCOUNT = 0.01
+BACKGROUND = np.array([0.25, 0.25, 0.25, 0.25])
+
+# number of candidates scored in one batch
+BLOCK_SIZE = 4096
+
+# index loaded by this process, and what it was loaded from: the modification
+# time of the index file, or the data version if it was built from the database
+_index = None
+_index_source = None
+
+
+def reverse_complement(values):
+    """
+    Reverse complement an (L, 4) matrix with columns in the order a, c, g, t.
+    """
+    return values[::-1, ::-1]
+
+
+def _pearson_columns(values):
+    """
+    Center and scale each column (the last axis) so that dot products of
+    columns are Pearson correlations. Uniform columns become all zeros.
+    """
+    centered = values - values.mean(axis=-1)[..., np.newaxis]
+    norms = np.sqrt((centered ** 2).sum(axis=-1))[..., np.newaxis]
+    return centered / np.where(norms > 0, norms, 1.0)
+
+
+def _log_ratios(values):
+    return np.log((values + PSEUDOCOUNT) / (1.0 + 4 * PSEUDOCOUNT) / BACKGROUND)
+
+
+def column_scores(query, query_sites, candidates, candidate_sites, metric='pearson'):
+    """
+    Score every column of the query (Lq, 4) against every column of each of the
+    candidates (N, L, 4). Returns an (N, Lq, L) array.
+    """
+    if metric == 'pearson':
+        return np.einsum('ib,njb->nij', _pearson_columns(query), _pearson_columns(candidates))
+    elif metric == 'allr':
+        # ALLR = sum over bases of (n2 log(p1/bg) + n1 log(p2/bg)) / (N1 + N2),
+        # where n are base counts and N site counts
+        candidate_sites = candidate_sites[:, np.newaxis, np.newaxis]
+        return (np.einsum('ib,njb->nij', _log_ratios(query), candidates) * candidate_sites +
+                np.einsum('ib,njb->nij', query, _log_ratios(candidates)) * query_sites) / (query_sites + candidate_sites)
+    else:
+        raise ValueError("Unknown metric: %s" % (metric,))
+
+
+def best_alignments(scores, lengths, query_length, min_overlap=MIN_OVERLAP):
+    """
+    Given column scores (N, Lq, L) of a query against N candidates of the given
+    lengths, find the offset at which the average column score over the
+    overlapping columns is highest. Query column i is aligned with candidate
+    column i - offset. Returns arrays of best scores and offsets.
+    """
+    n, _, max_length = scores.shape
+    required = np.minimum(min_overlap, np.minimum(lengths, query_length))
+    best = np.empty(n)
+    best.fill(-np.inf)
+    best_offsets = np.zeros(n, dtype=int)
+    for offset in range(-(max_length - 1), query_length):
+        i = np.arange(max(0, offset), min(query_length, max_length + offset))
+        j = i - offset
+        valid = j[np.newaxis, :] < lengths[:, np.newaxis]
+        overlap = valid.sum(axis=1)
+        total = (scores[:, i, j] * valid).sum(axis=1)
+        score = np.where(overlap >= required, total / np.maximum(overlap, 1), -np.inf)
+        better = score > best
+        best[better] = score[better]
+        best_offsets[better] = offset
+    return best, best_offsets
+
+
+def kmer_codes(values, k=KMER_LENGTH):
+    """
+    Encode the k-mers of a motif's consensus as integers, reading each base as
+    a digit in base 4. Only positions with a clear consensus base take part.
+    """
+    values = np.asarray(values)
+    if len(values) < k:
+        return np.array([], dtype=np.int64)
+    bases = np.argmax(values, axis=1).astype(np.int64)
+    bases[values.max(axis=1) <= KMER_BASE_FREQUENCY] = -1
+    n = len(bases) - k + 1
+    codes = np.zeros(n, dtype=np.int64)
+    ok = np.ones(n, dtype=bool)
+    for r in range(k):
+        window = bases[r:r+n]
+        ok &= window >= 0
+        codes = codes * 4 + np.maximum(window, 0)
+    return np.unique(codes[ok])
+
+
+class MotifIndex(object):
+    """
+    All motif PSSMs in a padded (N, max length, 4) float32 array, plus an
+    inverted index from consensus k-mers on both strands to motifs.
+    """
+    def __init__(self, motif_ids, lengths, values, sites, kmer_keys=None, kmer_motifs=None):
+        self.motif_ids = np.asarray(motif_ids, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.sites = np.asarray(sites, dtype=float)
+        self.positions = dict([ (motif_id, i) for i, motif_id in enumerate(self.motif_ids.tolist()) ])
+        if kmer_keys is None:
+            kmer_keys, kmer_motifs = self._build_kmer_index()
+        self.kmer_keys = kmer_keys
+        self.kmer_motifs = kmer_motifs
+
+    def _build_kmer_index(self):
+        keys = []
+        motifs = []
+        for i in range(len(self.motif_ids)):
+            values = self.values[i, :self.lengths[i]]
+            codes = np.union1d(kmer_codes(values), kmer_codes(reverse_complement(values)))
+            keys.append(codes)
+            motifs.append(np.repeat(i, len(codes)))
+        if len(keys) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        keys = np.concatenate(keys)
+        motifs = np.concatenate(motifs)
+        order = np.argsort(keys, kind='mergesort')
+        return keys[order], motifs[order]
+
+    @classmethod
+    def from_db(cls):
+        """
+        Build an index of all motifs from the pssms table.
+        """
+        cursor = connection.cursor()
+        try:
+            cursor.execute("select id, sites from networks_motif;")
+            sites_by_id = dict(cursor.fetchall())
+            cursor.execute("select motif_id, a, c, g, t from pssms order by motif_id, position;")
+            rows = np.array(cursor.fetchall(), dtype=float).reshape(-1, 5)
+        finally:
+            cursor.close()
+
+        ids, starts, lengths = _runs(rows[:,0].astype(np.int64))
+        values = np.zeros([len(ids), lengths.max() if len(ids) > 0 else 0, 4], dtype=np.float32)
+        for i, (start, length) in enumerate(zip(starts.tolist(), lengths.tolist())):
+            values[i, :length] = rows[start:start+length, 1:]
+        sites = [ sites_by_id.get(motif_id) or DEFAULT_SITES for motif_id in ids.tolist() ]
+        return cls(ids, lengths, values, sites)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['motif_ids'], data['lengths'], data['values'], data['sites'],
+                   data['kmer_keys'], data['kmer_motifs'])
+
+    def save(self, path):
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, motif_ids=self.motif_ids, lengths=self.lengths, values=self.values,
+                 sites=self.sites, kmer_keys=self.kmer_keys, kmer_motifs=self.kmer_motifs)
+        os.rename(tmp_path, path)
+
+    def __len__(self):
+        return len(self.motif_ids)
+
+    def candidates(self, values):
+        """
+        Indexes of motifs that share a consensus k-mer with the given motif.
+        """
+        codes = kmer_codes(values)
+        if len(codes) == 0:
+            return np.array([], dtype=np.int64)
+        left = np.searchsorted(self.kmer_keys, codes, side='left')
+        right = np.searchsorted(self.kmer_keys, codes, side='right')
+        return np.unique(np.concatenate([ self.kmer_motifs[l:r] for l, r in zip(left, right) ]))
+
+    def similar(self, values, sites=None, k=10, metric='pearson', exclude=None, min_overlap=MIN_OVERLAP):
+        """
+        Find the k motifs most similar to a motif given as an (L, 4) frequency
+        matrix. Returns a list of (motif_id, score, offset, strand) tuples, best
+        first. A strand of '-' means the match is to the reverse complement of
+        the query. Candidates come from the k-mer index; if it turns up fewer
+        than k, all motifs are compared.
+        """
+        values = np.asarray(values, dtype=float)
+        sites = float(sites or DEFAULT_SITES)
+        candidates = self.candidates(values)
+        if exclude is not None and exclude in self.positions:
+            candidates = candidates[candidates != self.positions[exclude]]
+        if len(candidates) < k:
+            candidates = np.arange(len(self.motif_ids))
+            if exclude is not None and exclude in self.positions:
+                candidates = candidates[candidates != self.positions[exclude]]
+
+        results = []
+        for start in range(0, len(candidates), BLOCK_SIZE):
+            block = candidates[start:start+BLOCK_SIZE]
+            lengths = self.lengths[block]
+            block_values = self.values[block, :max(lengths.max(), 1)].astype(float)
+            block_sites = self.sites[block]
+            for strand, query in (('+', values), ('-', reverse_complement(values))):
+                scores = column_scores(query, sites, block_values, block_sites, metric)
+                best, offsets = best_alignments(scores, lengths, len(query), min_overlap)
+                results.extend(zip(self.motif_ids[block].tolist(), best.tolist(),
+                                   offsets.tolist(), [strand] * len(block)))
+
+        # keep the better strand for each motif, then the top k motifs
+        best_by_motif = {}
+        for result in results:
+            if result[0] not in best_by_motif or result[1] > best_by_motif[result[0]][1]:
+                best_by_motif[result[0]] = result
+        return sorted(best_by_motif.values(), key=lambda result: -result[1])[:k]
+
+
+def _runs(ids):
+    """
+    For a sorted array, return the unique values with the start and length of
+    each run.
+    """
+    if len(ids) == 0:
+        return ids, np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]]))
+    lengths = np.diff(np.append(starts, len(ids)))
+    return ids[starts], starts, lengths
+
+
+def get_index():
+    """
+    Return the motif index, loading it from settings.MOTIF_INDEX_PATH if it has
+    been built or changed since it was last loaded. If no index file exists, an
+    index is built from the database and kept in memory until the data version
+    changes, that is until an import or a network's version_id changes.
+    """
+    global _index, _index_source
+    path = settings.MOTIF_INDEX_PATH
+    if os.path.exists(path):
+        source = ('file', os.path.getmtime(path))
+        if _index is None or source != _index_source:
+            _index = MotifIndex.load(path)
+            _index_source = source
+    else:
+        source = ('db', caching.data_version())
+        if _index is None or source != _index_source:
+            _index = MotifIndex.from_db()
+            _index_source = source
+    return _index
@@ -0,0 +1,202 @@
+"""
+Expression profile plots of biclusters, rendered on the server as SVG from
+the network's expression data, rather than linked from cMonkey's output on a
+remote host.
+
+Plots are cached on disk under settings.PLOT_DIR, in a directory for each
+network and version of its data, so reloading a network leaves the old plots
+behind instead of serving them. They're served as static files from
+settings.PLOT_URL. A missing plot is rendered when a page first asks for it.
+Render all plots of a network ahead of time with:
+python manage.py render_bicluster_plots
+"""
+from django.conf import settings
+import hashlib
+import multiprocessing
+import os
+import shutil
+import numpy as np
+
+import coherence
+from models import Network
+
+WIDTH = 600
+HEIGHT = 300
+MARGIN_LEFT = 50
+MARGIN_RIGHT = 15
+MARGIN_TOP = 25
+MARGIN_BOTTOM = 30
+
+GENE_COLOR = '#bbbbbb'
+MEAN_COLOR = '#cc0000'
+BAND_COLOR = '#f4cccc'
+
+
+def version_key(version_id):
+    # version ids are free text, so name directories by a hash of them
+    return hashlib.md5(version_id.encode('utf-8')).hexdigest()[:12]
+
+
+def network_plot_dir(network_id):
+    return os.path.join(settings.PLOT_DIR, "network_%d" % (network_id,))
+
+
+def plot_path(network_id, version_id, bicluster_id):
+    return os.path.join(network_plot_dir(network_id), version_key(version_id), "bicluster_%d.svg" % (bicluster_id,))
+
+
+def plot_url(network_id, version_id, bicluster_id):
+    return "%snetwork_%d/%s/bicluster_%d.svg" % (settings.PLOT_URL, network_id, version_key(version_id), bicluster_id,)
+
+
+def _path(xs, ys):
+    # SVG path data for a line, broken where values are missing
+    commands = []
+    move = True
+    for x, y in zip(xs, ys):
+        if np.isnan(y):
+            move = True
+            continue
+        commands.append("%s%.1f,%.1f" % ('M' if move else 'L', x, y,))
+        move = False
+    return " ".join(commands)
+
+
+def render_svg(data, title=''):
+    """
+    Plot the expression of a genes x conditions matrix, with NaN for missing
+    values, as an SVG document: each gene's profile as a grey line, and the
+    mean profile in red over a band of one standard deviation. Conditions are
+    plotted in the order of the columns.
+    """
+    data = np.asarray(data, dtype=float)
+    svg = ['<?xml version="1.0" encoding="UTF-8"?>',
+           '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d" '
+           'font-family="sans-serif" font-size="11">' % (WIDTH, HEIGHT, WIDTH, HEIGHT,),
+           '<text x="%d" y="%d" font-size="13">%s</text>' % (MARGIN_LEFT, MARGIN_TOP - 8, title,)]
+    left, right, top, bottom = MARGIN_LEFT, WIDTH - MARGIN_RIGHT, MARGIN_TOP, HEIGHT - MARGIN_BOTTOM
+
+    present = data[~np.isnan(data)]
+    if len(present) == 0:
+        svg.append('<text x="%d" y="%d" text-anchor="middle">No expression data</text>' %
+                   ((left + right) / 2, (top + bottom) / 2,))
+        svg.append('</svg>')
+        return "\n".join(svg) + "\n"
+
+    low, high = present.min(), present.max()
+    if high - low < 1e-9:
+        low, high = low - 1.0, high + 1.0
+    columns = np.size(data, 1)
+    xs = left + np.arange(columns) * (right - left) / float(max(columns - 1, 1))
+    y = lambda values: bottom - (np.asarray(values) - low) * (bottom - top) / (high - low)
+
+    # axes, with ticks on the expression axis
+    svg.append('<g stroke="#000000" fill="none">')
+    svg.append('<path d="M%d,%d L%d,%d L%d,%d"/>' % (left, top, left, bottom, right, bottom,))
+    for tick in np.linspace(low, high, 5):
+        svg.append('<path d="M%d,%.1f L%d,%.1f"/>' % (left - 4, y(tick), left, y(tick),))
+    svg.append('</g>')
+    for tick in np.linspace(low, high, 5):
+        svg.append('<text x="%d" y="%.1f" text-anchor="end">%.2g</text>' % (left - 6, y(tick) + 4, tick,))
+    svg.append('<text x="%d" y="%d" text-anchor="middle">%d conditions</text>' %
+               ((left + right) / 2, HEIGHT - 8, columns,))
+
+    result = coherence.quality(data)
+    mean, sd = result['profile'], result['profile_sd']
+    if not np.any(np.isnan(mean)):
+        band = np.concatenate([y(mean + sd), y(mean - sd)[::-1]])
+        svg.append('<path d="%s Z" fill="%s" stroke="none"/>' %
+                   (_path(np.concatenate([xs, xs[::-1]]), band), BAND_COLOR,))
+    svg.append('<g stroke="%s" stroke-width="1" fill="none">' % (GENE_COLOR,))
+    for row in data:
+        svg.append('<path d="%s"/>' % (_path(xs, y(row)),))
+    svg.append('</g>')
+    svg.append('<path d="%s" stroke="%s" stroke-width="2" fill="none"/>' % (_path(xs, y(mean)), MEAN_COLOR,))
+    svg.append('</svg>')
+    return "\n".join(svg) + "\n"
+
+
+def write_plot(path, data, title=''):
+    """
+    Render a plot and write it to path. The plot is written to a temporary
+    file and moved into place, so readers never see a partial plot.
+    """
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # made by another process in the meantime
+            if not os.path.isdir(directory):
+                raise
+    tmp_path = "%s.%d.tmp" % (path, os.getpid(),)
+    with open(tmp_path, 'w') as f:
+        f.write(render_svg(data, title))
+    os.rename(tmp_path, path)
+
+
+def bicluster_plot_url(bicluster):
+    """
+    URL of the expression plot of a bicluster, rendering it first if it isn't
+    in the cache.
+    """
+    network = bicluster.network
+    path = plot_path(network.id, network.version_id, bicluster.id)
+    if not os.path.exists(path):
+        matrix = coherence.submatrix(bicluster.genes.all(), bicluster.conditions.order_by('id'))
+        write_plot(path, matrix.data, "Bicluster %d" % (bicluster.id,))
+    return plot_url(network.id, network.version_id, bicluster.id)
+
+
+# the network's expression matrix in worker processes of render_network
+_worker_data = None
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def _render_task(task):
+    """
+    Render the plot of one bicluster. Runs in a worker process.
+    """
+    bicluster_id, rows, columns, path = task
+    write_plot(path, _worker_data[rows][:, columns], "Bicluster %d" % (bicluster_id,))
+    return bicluster_id
+
+
+def render_network(network_id, processes=None, force=False):
+    """
+    Render the plots of all biclusters of a network that aren't in the cache,
+    or all of them if force is True, in a pool of worker processes. Plots of
+    earlier versions of the network are removed. processes defaults to the
+    number of CPUs. Use 1 to work in the calling process. Returns the number
+    of plots rendered.
+    """
+    version_id = Network.objects.values_list('version_id', flat=True).get(id=network_id)
+    network_dir = network_plot_dir(network_id)
+    if os.path.isdir(network_dir):
+        for name in os.listdir(network_dir):
+            if name != version_key(version_id):
+                shutil.rmtree(os.path.join(network_dir, name))
+
+    data, biclusters = coherence.network_biclusters(network_id)
+    tasks = [ (bicluster_id, rows, columns, plot_path(network_id, version_id, bicluster_id))
+              for bicluster_id, rows, columns in biclusters ]
+    tasks = [ task for task in tasks if force or not os.path.exists(task[3]) ]
+    if processes == 1:
+        _init_worker(data)
+        for task in tasks:
+            _render_task(task)
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker, (data,))
+        try:
+            for bicluster_id in pool.imap_unordered(_render_task, tasks, chunksize=16):
+                pass
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    return len(tasks)
@@ -0,0 +1,246 @@
+"""
+Per-request profiling. QueryProfilerMiddleware records, for each request, the
+number of queries, the total time spent in the database, the slowest SQL
+statements, template render time and total time. Each request is logged as
+one line of JSON to the 'networks.profiling' logger, which settings.py sends
+to settings.PROFILE_LOG. If settings.PROFILE_HEADER is true, a summary is
+also added to the response as an X-Profile header.
+
+Recording queries means switching on Django's debug cursor, which times and
+logs every query. So in production, only a sample of requests, the fraction
+settings.PROFILE_QUERY_SAMPLE, have their queries recorded. The rest are
+only timed, and log null query counts and DB time.
+
+Summarize a profile log by URL name with: python manage.py profile_report
+
+Code outside of requests can be profiled the same way:
+
+    with profiled('build_store') as profile:
+        ...
+    print profile.as_dict()
+
+Queries are captured through Django's debug cursor, which is switched on for
+the duration of a profile. Work done while a streaming response is being
+iterated happens after the middleware has seen the response, so it isn't
+counted.
+
+Two hooks into Django are installed by the middleware when it's loaded, or
+by calling install(), if settings.PROFILE_HOOKS is true: Template.render is
+wrapped to time templates, and Django's receiver emptying the query log when
+a request starts is replaced by one that leaves connections with the debug
+cursor switched on alone, so requests made while a thread is being profiled
+don't lose its queries. Without them, template time isn't recorded.
+"""
+from django.conf import settings
+from django.core.urlresolvers import resolve, Resolver404
+from django.core.signals import request_started
+from django.db import connection, connections, reset_queries
+from django.template import Template
+import json
+import logging
+import math
+import random
+import threading
+import time
+
+logger = logging.getLogger('networks.profiling')
+
+# number of slowest queries to report, and how much of their SQL to keep
+SLOW_QUERIES = 3
+MAX_SQL_LENGTH = 1000
+
+_local = threading.local()
+
+
+class Profile(object):
+    """
+    Query and timing statistics for a request or a block of code. If queries
+    is False, only times are recorded.
+    """
+    def __init__(self, name, queries=True):
+        self.name = name
+        self.queries = queries
+        self.template_ms = 0.0
+        self.template_depth = 0
+        self.query_count = None
+        self.db_ms = None
+        self.slowest = None
+        self.total_ms = None
+        if queries:
+            self._use_debug_cursor = connection.use_debug_cursor
+            connection.use_debug_cursor = True
+            self._first_query = len(connection.queries)
+        self._started = time.time()
+
+    def finish(self):
+        self.total_ms = (time.time() - self._started) * 1000
+        if not self.queries:
+            return
+        queries = connection.queries[self._first_query:]
+        self.query_count = len(queries)
+        self.db_ms = sum([ float(q['time']) for q in queries ]) * 1000
+        self.slowest = [ {'ms':float(q['time']) * 1000, 'sql':q['sql'][:MAX_SQL_LENGTH]}
+                         for q in sorted(queries, key=lambda q: -float(q['time']))[:SLOW_QUERIES] ]
+
+        # put the debug cursor back the way it was. If it was only on for the
+        # profile, don't let the query log grow.
+        connection.use_debug_cursor = self._use_debug_cursor
+        if not (self._use_debug_cursor or (self._use_debug_cursor is None and settings.DEBUG)):
+            del connection.queries[self._first_query:]
+
+    def as_dict(self):
+        return {'name':self.name, 'queries':self.query_count,
+                'db_ms':round(self.db_ms, 2) if self.db_ms is not None else None,
+                'template_ms':round(self.template_ms, 2), 'total_ms':round(self.total_ms, 2),
+                'slowest':self.slowest}
+
+    def header(self):
+        if not self.queries:
+            return "template_ms=%.1f; total_ms=%.1f" % (self.template_ms, self.total_ms,)
+        return "queries=%d; db_ms=%.1f; template_ms=%.1f; total_ms=%.1f" % (
+            self.query_count, self.db_ms, self.template_ms, self.total_ms,)
+
+
+def percentile(values, p):
+    """
+    The p-th percentile of a list of numbers, by the nearest-rank method.
+    """
+    values = sorted(values)
+    if len(values) == 0:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def current():
+    """
+    The profile being recorded by this thread, or None.
+    """
+    return getattr(_local, 'profile', None)
+
+
+def _reset_queries(**kwargs):
+    # stands in for Django's receiver. Connections are local to each thread,
+    # so leaving those whose debug cursor has been switched on alone, as by
+    # a profile or assertNumQueries, only affects the thread doing that.
+    for conn in connections.all():
+        if not conn.use_debug_cursor:
+            conn.queries = []
+
+
+
+class profiled(object):
+    """
+    Context manager that profiles a block of code. Requests made within the
+    block, for example through the test client, are included: the query log
+    isn't reset when they start, and they're also profiled on their own by the
+    middleware.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.outer = current()
+        _local.profile = Profile(self.name)
+        return _local.profile
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.profile.finish()
+        _local.profile = self.outer
+        return False
+
+
+def _instrument_templates():
+    """
+    Wrap Template.render to add render time to the current profile. Only the
+    outermost render is timed, so included templates aren't counted twice.
+    """
+    render = Template.render
+
+    def timed_render(self, context):
+        profile = current()
+        if profile is None or profile.template_depth > 0:
+            return render(self, context)
+        profile.template_depth += 1
+        started = time.time()
+        try:
+            return render(self, context)
+        finally:
+            profile.template_ms += (time.time() - started) * 1000
+            profile.template_depth -= 1
+
+    timed_render.profiled = True
+    Template.render = timed_render
+
+
+_install_lock = threading.Lock()
+
+def install():
+    """
+    Install the hooks into Django described above, once per process, unless
+    settings.PROFILE_HOOKS is false. Returns whether they're installed.
+    """
+    if not getattr(settings, 'PROFILE_HOOKS', False):
+        return False
+    with _install_lock:
+        if not getattr(Template.render, 'profiled', False):
+            _instrument_templates()
+            request_started.disconnect(reset_queries)
+            request_started.connect(_reset_queries)
+    return True
+
+
+def url_name(request):
+    """
+    Name a request by its URL pattern's name, or by its view function if the
+    pattern isn't named.
+    """
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return 'unresolved'
+    if match.url_name:
+        return match.url_name
+    func = match.func
+    return "%s.%s" % (getattr(func, '__module__', ''), getattr(func, '__name__', func.__class__.__name__),)
+
+
+class QueryProfilerMiddleware(object):
+    """
+    Profile every request, logging the results and optionally reporting them
+    in an X-Profile response header. Should be first in MIDDLEWARE_CLASSES, so
+    it sees the work done by all other middleware.
+    """
+    def __init__(self):
+        install()
+
+    def process_request(self, request):
+        request.outer_profile = current()
+        queries = random.random() < getattr(settings, 'PROFILE_QUERY_SAMPLE', 1.0)
+        _local.profile = Profile(url_name(request), queries)
+
+    def _finish(self, request, status):
+        # finish and log the request's profile, unless it's already done
+        profile = current()
+        if profile is None or not hasattr(request, 'outer_profile'):
+            return None
+        _local.profile = request.outer_profile
+        del request.outer_profile
+        profile.finish()
+
+        record = profile.as_dict()
+        record.update({'path':request.path, 'method':request.method,
+                       'status':status, 'time':time.time()})
+        logger.info(json.dumps(record))
+        return profile
+
+    def process_exception(self, request, exception):
+        # the response middleware doesn't run if the exception propagates
+        self._finish(request, 500)
+        return None
+
+    def process_response(self, request, response):
+        profile = self._finish(request, response.status_code)
+        if profile is not None and getattr(settings, 'PROFILE_HEADER', False):
+            response['X-Profile'] = profile.header()
+        return response
@@ -0,0 +1,42 @@
+-- Precomputed table of the biclusters regulated by each transcription factor,
+-- either directly (via_combiner=false) or as part of an and-gate influence
+-- (via_combiner=true). Not a model class, but accessible through Gene objects.
+-- Rebuild for a network with: python manage.py rebuild_network_tables <network_id>
+create table tf_regulates_bicluster (
+  network_id int not null,
+  gene_id int not null,
+  bicluster_id int not null,
+  via_combiner boolean not null
+);
+CREATE INDEX tf_regulates_bicluster_network_gene_idx ON tf_regulates_bicluster (network_id, gene_id);
+CREATE INDEX tf_regulates_bicluster_bicluster_id_idx ON tf_regulates_bicluster (bicluster_id);
+
+-- Precomputed gene co-membership: for each pair of genes in a common bicluster
+-- of a network, the number of biclusters they share. Pairs are stored in both
+-- orders, and each gene is paired with itself.
+-- Rebuild for a network with: python manage.py rebuild_network_tables <network_id>
+create table gene_comembership (
+  network_id int not null,
+  gene_id int not null,
+  neighbor_id int not null,
+  shared_biclusters int not null
+);
+CREATE INDEX gene_comembership_network_gene_idx ON gene_comembership (network_id, gene_id, shared_biclusters);
+
+-- Coherence of each bicluster recomputed from expression data: mean squared
+-- and mean absolute residue, mean and variance of the submatrix, and the
+-- numbers of genes and conditions with data, stamped with the network's
+-- version_id. Not a model class. See networks/coherence.py.
+-- Rebuild for a network with: python manage.py refresh_bicluster_quality <network_id>
+create table bicluster_quality (
+  bicluster_id int primary key,
+  network_id int not null,
+  version_id varchar(255),
+  residue real,
+  abs_residue real,
+  mean real,
+  variance real,
+  genes int not null,
+  conditions int not null
+);
+CREATE INDEX bicluster_quality_network_idx ON bicluster_quality (network_id);
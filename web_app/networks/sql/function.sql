@@ -1,2 +1,32 @@
--- make the default value false. Lamely, Django doesn't do this.
-alter table networks_function alter column obsolete set default false;
+-- Transitive closure of the function hierarchies. Each function is paired with
+-- all of its ancestors, including itself at depth 0, along with the length of
+-- the shortest path between them and the relation the path implies. Paths
+-- made only of is_a (GO) or parent (KEGG, TIGR, COG) links have that type.
+-- Composing those with another relation, say part_of, gives part_of, as does
+-- a path of part_of links. Paths mixing other relations aren't included.
+-- The function_closure_paths view computes the closure, and is the only
+-- definition of it: Function.rebuild_closure and the import scripts copy it
+-- into the table, which is there for fast queries. scripts/scratch_db.py reads
+-- the view from this file. Rebuild with: python manage.py rebuild_function_closure
+create table function_closure (
+  ancestor_id int not null,
+  descendant_id int not null,
+  depth int not null,
+  type varchar(255) not null
+);
+CREATE UNIQUE INDEX function_closure_ancestor_descendant_idx ON function_closure (ancestor_id, descendant_id, type);
+CREATE INDEX function_closure_descendant_idx ON function_closure (descendant_id);
+create view function_closure_paths as
+with recursive paths (ancestor_id, descendant_id, depth, type) as (
+  select f.id, f.id, 0, case when f.type='go' then 'is_a' else 'parent' end
+  from networks_function f
+  union
+  select r.target_id, p.descendant_id, p.depth + 1,
+         case when r.type in ('is_a', 'parent') then p.type else r.type end
+  from paths p
+       join networks_function_relationships r on r.function_id=p.ancestor_id
+  where r.type in ('is_a', 'parent') or p.type in ('is_a', 'parent') or r.type=p.type
+)
+select ancestor_id, descendant_id, min(depth) as depth, type
+from paths
+group by ancestor_id, descendant_id, type;
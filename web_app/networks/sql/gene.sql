@@ -1,3 +1,3 @@
--- make the default value false. Lamely, Django doesn't do this.
-alter table networks_gene alter column transcription_factor set default false;
-
+-- genes are identified by name within a species. The bulk gene loader in
+-- scripts/bulk_load.py relies on this to update rather than duplicate genes.
+CREATE UNIQUE INDEX networks_gene_species_name_idx ON networks_gene (species_id, name);
@@ -9,3 +9,18 @@ create table pssms (
   t real not null
 );
 CREATE INDEX pssms_motif_id_idx ON pssms (motif_id);
+
+-- motif instances found by scanning chromosome sequences with a motif's PSSM.
+-- Coordinates are 1-based and inclusive on the forward strand.
+-- see networks/motif_scan.py and the scan_motifs management command
+create table motif_hits (
+  motif_id int NOT NULL,
+  chromosome_id int NOT NULL,
+  start int NOT NULL,
+  "end" int NOT NULL,
+  strand char(1) NOT NULL,
+  score real NOT NULL,
+  p_value double precision NOT NULL
+);
+CREATE INDEX motif_hits_motif_id_idx ON motif_hits (motif_id);
+CREATE INDEX motif_hits_chromosome_id_start_idx ON motif_hits (chromosome_id, start);
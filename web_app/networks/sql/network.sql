@@ -11,3 +11,25 @@ CREATE INDEX expression_condition_id_idx ON expression (condition_id);
 -- I had hoped clustering the table by the gene index would help
 -- speed up data loading, but it didn't help as far as i could tell
 -- CLUSTER expression_gene_id_idx ON expression;
+
+-- Precomputed co-expression: for each gene in a network, its top neighbors by
+-- correlation of expression, ranked from 1. Not a model class. Built with:
+-- python manage.py build_coexpression <network_id>
+create table coexpression (
+  network_id int not null,
+  gene_id int not null,
+  neighbor_id int not null,
+  method varchar(16) not null,
+  r real not null,
+  n int not null,
+  rank int not null
+);
+CREATE INDEX coexpression_network_gene_idx ON coexpression (network_id, gene_id, method, rank);
+
+-- Generation of the data, as far as caches are concerned. Bumped by the import
+-- scripts when they finish, which invalidates everything cached before. Not a
+-- model class. See networks/caching.py. Seeded with the time when first read,
+-- so a new DB doesn't pick up entries cached for an old one.
+create table cache_generation (
+  generation int not null
+);
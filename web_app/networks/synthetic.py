@@ -0,0 +1,172 @@
+"""
+Generate a synthetic species and network at a configurable scale, for
+benchmarking. Everything a real network has is filled in: chromosomes, genes,
+transcription factors, a network with conditions and expression data,
+biclusters with member genes, conditions and regulatory influences (including
+combiners), motifs with PSSMs and functional annotations.
+
+Rows are written in bulk through raw cursors rather than one model object at
+a time, so that large datasets can be generated in reasonable time. Data is
+random but reproducible given the seed.
+"""
+from datetime import datetime
+from django.db import connection, transaction
+import numpy as np
+
+from models import Species, Chromosome, Network, Function
+from db_util import insert_many
+
+# default scale, roughly that of a bacterial genome and cMonkey run
+DEFAULTS = {
+    'genes': 3000,
+    'chromosomes': 2,
+    'tfs': 150,
+    'combiners': 50,
+    'conditions': 200,
+    'biclusters': 1000,
+    'genes_per_bicluster': 20,
+    'conditions_per_bicluster': 50,
+    'influences_per_bicluster': 3,
+    'motifs_per_bicluster': 2,
+    'motif_length': 20,
+    'functions': 500,
+    'functions_per_gene': 3,
+}
+
+
+def _ids(cursor, sql, params):
+    """
+    Map the key in the second column of a query's results to the id in its first.
+    """
+    cursor.execute(sql, params)
+    return dict([ (key, id) for id, key in cursor.fetchall() ])
+
+
+def generate(name='Synthetic species', short_name=None, seed=0, log=None, **scale):
+    """
+    Generate a synthetic species and network. Keyword arguments override the
+    sizes in DEFAULTS. Returns the Network. Progress messages are passed to
+    the log function, if given.
+    """
+    s = dict(DEFAULTS)
+    s.update([ (key, value) for key, value in scale.items() if value is not None ])
+    rng = np.random.RandomState(seed)
+    short_name = short_name or "syn%d" % (seed,)
+    log = log or (lambda message: None)
+    now = datetime.now()
+
+    species = Species.objects.create(name=name, short_name=short_name, created_at=now)
+    genome_length = s['genes'] * 1000
+    chromosomes = [ Chromosome.objects.create(species=species, name="chromosome%d" % (i+1,),
+                                              length=genome_length // s['chromosomes'] + 1000,
+                                              topology='circular')
+                    for i in range(s['chromosomes']) ]
+    network = Network.objects.create(species=species, name="%s network" % (name,),
+                                     data_source='synthetic', description="synthetic network, seed=%d" % (seed,),
+                                     version_id="synthetic-%d" % (seed,), created_at=now)
+
+    cursor = connection.cursor()
+    try:
+        # genes, evenly spread over the chromosomes
+        log("genes")
+        per_chromosome = int(np.ceil(float(s['genes']) / s['chromosomes']))
+        tf_indexes = set(rng.choice(s['genes'], s['tfs'], replace=False).tolist())
+        gene_names = [ "%s%05d" % (short_name.upper(), i,) for i in range(s['genes']) ]
+        insert_many(cursor, 'networks_gene',
+                    ['species_id', 'chromosome_id', 'name', 'common_name', 'geneid', 'type',
+                     'start', '"end"', 'strand', 'description', 'transcription_factor'],
+                    ( (species.id, chromosomes[i // per_chromosome].id, gene_names[i],
+                       "syn%d" % (i,) if i % 3 == 0 else None, 100000 + i, 'CDS',
+                       (i % per_chromosome) * 1000 + 1, (i % per_chromosome) * 1000 + 900,
+                       '+' if rng.rand() < 0.5 else '-', "synthetic gene %d" % (i,), i in tf_indexes)
+                      for i in range(s['genes']) ))
+        gene_ids = _ids(cursor, "select id, name from networks_gene where species_id=%s", [species.id])
+        gene_ids = np.array([ gene_ids[name] for name in gene_names ])
+
+        # influences: one per transcription factor, plus and-gates of pairs of them
+        log("influences")
+        tf_genes = sorted(tf_indexes)
+        combiner_parts = [ rng.choice(len(tf_genes), 2, replace=False) for i in range(s['combiners']) ]
+        influence_names = [ gene_names[g] for g in tf_genes ] + \
+                          [ "%s~~%s~~min" % (gene_names[tf_genes[a]], gene_names[tf_genes[b]],) for a, b in combiner_parts ]
+        insert_many(cursor, 'networks_influence', ['name', 'gene_id', 'operation', 'type'],
+                    [ (gene_names[g], int(gene_ids[g]), None, 'tf') for g in tf_genes ] +
+                    [ (n, None, 'min', 'combiner') for n in influence_names[len(tf_genes):] ])
+        influence_ids = _ids(cursor, "select id, name from networks_influence where name like %s", [short_name.upper() + '%'])
+        influence_ids = np.array([ influence_ids[n] for n in influence_names ])
+        parts = []
+        for i, (a, b) in enumerate(combiner_parts):
+            combiner_id = int(influence_ids[len(tf_genes) + i])
+            for part in (a, b):
+                parts.append((combiner_id, int(influence_ids[part])))
+                parts.append((int(influence_ids[part]), combiner_id))
+        insert_many(cursor, 'networks_influence_parts', ['from_influence_id', 'to_influence_id'], parts)
+
+        # conditions and expression, with each bicluster's genes co-expressed
+        # over its conditions
+        log("conditions and expression")
+        condition_names = [ "condition_%04d" % (i,) for i in range(s['conditions']) ]
+        insert_many(cursor, 'networks_condition', ['network_id', 'name'],
+                    [ (network.id, n) for n in condition_names ])
+        condition_ids = _ids(cursor, "select id, name from networks_condition where network_id=%s", [network.id])
+        condition_ids = np.array([ condition_ids[n] for n in condition_names ])
+
+        bicluster_genes = [ rng.choice(s['genes'], s['genes_per_bicluster'], replace=False) for k in range(s['biclusters']) ]
+        bicluster_conditions = [ rng.choice(s['conditions'], s['conditions_per_bicluster'], replace=False) for k in range(s['biclusters']) ]
+        data = rng.normal(0.0, 1.0, (s['genes'], s['conditions'])).astype(np.float32)
+        for genes, conditions in zip(bicluster_genes, bicluster_conditions):
+            data[np.ix_(genes, conditions)] += rng.normal(0.0, 1.0, len(conditions))[np.newaxis, :]
+        insert_many(cursor, 'expression', ['gene_id', 'condition_id', 'value'],
+                    ( (int(gene_ids[g]), int(condition_ids[c]), float(data[g, c]))
+                      for g in range(s['genes']) for c in range(s['conditions']) ))
+
+        # biclusters and their members
+        log("biclusters")
+        insert_many(cursor, 'networks_bicluster', ['network_id', 'k', 'residual'],
+                    [ (network.id, k + 1, float(rng.uniform(0.2, 0.6))) for k in range(s['biclusters']) ])
+        bicluster_ids = _ids(cursor, "select id, k from networks_bicluster where network_id=%s", [network.id])
+        bicluster_ids = [ bicluster_ids[k + 1] for k in range(s['biclusters']) ]
+        insert_many(cursor, 'networks_bicluster_genes', ['bicluster_id', 'gene_id'],
+                    ( (b, int(gene_ids[g])) for b, genes in zip(bicluster_ids, bicluster_genes) for g in genes ))
+        insert_many(cursor, 'networks_bicluster_conditions', ['bicluster_id', 'condition_id'],
+                    ( (b, int(condition_ids[c])) for b, conditions in zip(bicluster_ids, bicluster_conditions) for c in conditions ))
+        n_influences = min(s['influences_per_bicluster'], len(influence_ids))
+        insert_many(cursor, 'networks_bicluster_influences', ['bicluster_id', 'influence_id'],
+                    ( (b, int(influence_ids[i])) for b in bicluster_ids
+                      for i in rng.choice(len(influence_ids), n_influences, replace=False) ))
+
+        # motifs with random PSSMs
+        log("motifs")
+        insert_many(cursor, 'networks_motif', ['bicluster_id', 'position', 'sites', 'e_value'],
+                    ( (b, p + 1, int(rng.randint(5, s['genes_per_bicluster'] + 1)), float(10 ** rng.uniform(-10, 1)))
+                      for b in bicluster_ids for p in range(s['motifs_per_bicluster']) ))
+        cursor.execute("""
+            select m.id from networks_motif m join networks_bicluster b on m.bicluster_id=b.id
+            where b.network_id=%s order by m.id""", [network.id])
+        motif_ids = [ row[0] for row in cursor.fetchall() ]
+        insert_many(cursor, 'pssms', ['motif_id', 'position', 'a', 'c', 'g', 't'],
+                    ( (motif_id, p + 1) + tuple(float(v) for v in rng.dirichlet([0.5] * 4))
+                      for motif_id in motif_ids for p in range(s['motif_length']) ))
+
+        # functions in a shallow hierarchy, and gene annotations
+        log("functions")
+        function_ids_native = [ "%s:%07d" % (short_name.upper(), i,) for i in range(s['functions']) ]
+        insert_many(cursor, 'networks_function', ['native_id', 'name', 'namespace', 'type', 'obsolete', 'description'],
+                    [ (native_id, "synthetic function %d" % (i,), 'synthetic', 'go', False, None)
+                      for i, native_id in enumerate(function_ids_native) ])
+        function_ids = _ids(cursor, "select id, native_id from networks_function where native_id like %s", [short_name.upper() + ':%'])
+        function_ids = [ function_ids[n] for n in function_ids_native ]
+        insert_many(cursor, 'networks_function_relationships', ['function_id', 'target_id', 'type'],
+                    [ (function_ids[i], function_ids[(i - 1) // 10], 'is_a') for i in range(1, len(function_ids)) ])
+        insert_many(cursor, 'networks_gene_function', ['function_id', 'gene_id', 'source'],
+                    ( (function_ids[f], int(gene_ids[g]), 'synthetic') for g in range(s['genes'])
+                      for f in rng.choice(len(function_ids), min(s['functions_per_gene'], len(function_ids)), replace=False) ))
+    finally:
+        cursor.close()
+    transaction.commit_unless_managed()
+
+    log("precomputed tables")
+    network.rebuild_tf_regulates_bicluster()
+    network.rebuild_gene_comembership()
+    Function.rebuild_closure()
+    return network
@@ -5,7 +5,33 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+from collections import namedtuple
+from datetime import datetime
+from django.db import connection
+from django.template import Template
 from django.test import TestCase
+from django.test.utils import override_settings
+from xml.dom import minidom
+import json
+import logging
+import numpy as np
+import os
+import shutil
+import tempfile
+import threading
+import zlib
+
+from web_app.networks import benchmarks, caching, coexpression, coherence, db_util, enrichment, expression_store
+from web_app.networks import motif_scan, motif_similarity, plots, profiling, synthetic, warmup
+from web_app.networks.helpers import get_nx_graph_for_biclusters
+from web_app.networks.management.commands.profile_report import summarize
+from web_app.networks.models import Species, Chromosome, Network, Gene, Influence, Bicluster, Motif, PSSM
+from web_app.networks.models import Function, Function_Relationships, Gene_Function, Bicluster_Function
+from web_app.networks.models import DataMatrix, expression_matrix, expression_matrix_from_db
+from web_app.networks.models import expression_matrix_to_tsv_chunks, expression_matrix_to_tsv
+from web_app.networks.motif_similarity import MotifIndex
+from web_app.networks.profiling import percentile
+from web_app.networks.views import make_circvis_data
 
 
 class SimpleTest(TestCase):
@@ -14,3 +40,904 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class PSSMTest(TestCase):
+    def setUp(self):
+        self.pssm = PSSM([[0.9, 0.05, 0.05, 0.0],
+                          [0.1, 0.5, 0.2, 0.2],
+                          [0.25, 0.25, 0.25, 0.25],
+                          [0.0, 0.0, 0.0, 1.0]])
+
+    def test_consensus(self):
+        self.assertEqual(self.pssm.consensus(), "Ac.T")
+
+    def test_positions_as_dicts(self):
+        self.assertEqual(len(self.pssm), 4)
+        self.assertEqual(self.pssm.get_position(0), {'a':0.9, 'c':0.05, 'g':0.05, 't':0.0})
+        self.assertEqual([ p['t'] for p in self.pssm ], [0.0, 0.2, 0.25, 1.0])
+
+    def test_add_position(self):
+        pssm = PSSM()
+        pssm.add_position({'a':0.1, 'c':0.2, 'g':0.3, 't':0.4})
+        self.assertEqual(len(pssm), 1)
+        self.assertEqual(pssm.consensus(), ".")
+
+    def test_reverse_complement(self):
+        self.assertEqual(self.pssm.reverse_complement().consensus(), "A.gT")
+
+    def test_information_content(self):
+        ic = self.pssm.information_content()
+        self.assertAlmostEqual(ic[2], 0.0, places=5)
+        self.assertAlmostEqual(ic[3], 2.0, places=5)
+
+    def test_to_logo(self):
+        logo = self.pssm.to_logo()
+        self.assertEqual(logo['alphabet'], ['A', 'C', 'T', 'G'])
+        self.assertEqual(logo['values'][1], [0.1, 0.5, 0.2, 0.2])
+
+    def test_as_string(self):
+        self.assertTrue(self.pssm.as_string().startswith("POSITION A C G T 1 0.9 0.05 0.05 0 2 "))
+
+
+def one_hot(sequence):
+    return [ [1.0 if base == b else 0.0 for b in 'acgt'] for base in sequence.lower() ]
+
+class MotifSimilarityTest(TestCase):
+    def setUp(self):
+        self.index = MotifIndex([1, 2, 3], [6, 6, 6],
+                                [one_hot('tataat'), one_hot('attata'), one_hot('gggccc')],
+                                [10, 10, 10])
+
+    def test_same_motif(self):
+        motif_id, score, offset, strand = self.index.similar(one_hot('tataat'), k=1)[0]
+        self.assertEqual((motif_id, offset, strand), (1, 0, '+'))
+        self.assertAlmostEqual(score, 1.0)
+
+    def test_reverse_complement(self):
+        motif_id, score, offset, strand = self.index.similar(one_hot('tataat'), k=1, exclude=1)[0]
+        self.assertEqual((motif_id, strand), (2, '-'))
+        self.assertAlmostEqual(score, 1.0)
+
+
+def content(response):
+    # read a response, streaming or not
+    if hasattr(response, 'streaming_content'):
+        return "".join(response.streaming_content)
+    return response.content
+
+class BiclusterGraphTest(TestCase):
+    def setUp(self):
+        species = Species.objects.create(name='Halobacterium salinarum NRC-1', short_name='hal', created_at=datetime.now())
+        network = Network.objects.create(species=species, name='test', version_id='1', created_at=datetime.now())
+        chromosome = Chromosome.objects.create(species=species, name='chromosome', length=2000000, topology='circular')
+        genes = [ Gene.objects.create(species=species, chromosome=chromosome, name='VNG%04dG' % (i,), start=1000*i+1, end=1000*i+900)
+                  for i in range(10) ]
+        self.network, self.genes = network, genes
+        tfs = [ Influence.objects.create(name='tf%d' % (i,), gene=genes[i], type='tf') for i in range(3) ]
+        self.biclusters = []
+        for k in range(5):
+            bicluster = Bicluster.objects.create(network=network, k=k+1)
+            bicluster.genes.add(*genes[k:k+4])
+            bicluster.influences.add(tfs[k % 3])
+            Motif.objects.create(bicluster=bicluster, position=1, sites=10, e_value=0.01)
+            self.biclusters.append(bicluster)
+
+    def test_graph(self):
+        graph = get_nx_graph_for_biclusters(Bicluster.objects.filter(id__in=[b.id for b in self.biclusters[:2]]))
+        # 2 biclusters, 5 genes, 2 influences and 2 motifs
+        self.assertEqual(graph.number_of_nodes(), 11)
+        self.assertEqual(graph.number_of_edges(), 12)
+
+    def test_gene_comembership(self):
+        self.network.rebuild_gene_comembership()
+        gene = self.genes[3]
+        neighbors = gene.neighbor_genes(self.network)
+        self.assertEqual([g.name for g in neighbors], [g.name for g in self.genes[0:7]])
+        self.assertEqual(dict([ (g.name, g.shared_biclusters) for g in neighbors ])[gene.name], 4)
+        ranked = gene.ranked_neighbor_genes(self.network.id, limit=3)
+        self.assertEqual([(g.name, g.shared_biclusters) for g in ranked],
+                         [('VNG0002G', 3), ('VNG0004G', 3), ('VNG0001G', 2)])
+
+    def test_gene_comembership_not_built(self):
+        # neighbors are counted from memberships until the table is built
+        gene = self.genes[3]
+        before = ([ (g.name, g.shared_biclusters) for g in gene.neighbor_genes(self.network) ],
+                  [ (g.name, g.shared_biclusters) for g in gene.ranked_neighbor_genes(self.network.id, limit=3) ],
+                  make_circvis_data(gene.name, self.network.id), make_circvis_data(gene.name))
+        self.assertEqual(len(before[0]), 7)
+        self.assertEqual(len(before[2]['network']), 6)
+        self.network.rebuild_gene_comembership()
+        after = ([ (g.name, g.shared_biclusters) for g in gene.neighbor_genes(self.network) ],
+                 [ (g.name, g.shared_biclusters) for g in gene.ranked_neighbor_genes(self.network.id, limit=3) ],
+                 make_circvis_data(gene.name, self.network.id), make_circvis_data(gene.name))
+        self.assertEqual(before, after)
+
+    def test_circvis(self):
+        self.network.rebuild_gene_comembership()
+        data = json.loads(self.client.get('/json/circvis/', {'gene':'VNG0003G', 'network_id':self.network.id}).content)
+        self.assertEqual(len(data['network']), 6)
+        self.assertEqual(len(data['genes']), 7)
+        self.assertEqual([link['linkValue'] for link in data['network']], [3, 3, 2, 2, 1, 1])
+        data = json.loads(self.client.get('/json/circvis/', {'gene':'VNG0003G', 'limit':2}).content)
+        self.assertEqual([link['node2']['start'] for link in data['network']], [2001, 4001])
+
+    def test_circvis_parameters(self):
+        for params in ({}, {'gene':'VNG0003G', 'limit':'all'}, {'gene':'VNG0003G', 'limit':0},
+                       {'gene':'VNG0003G', 'limit':-2}, {'gene':'VNG0003G', 'network_id':'first'}):
+            self.assertEqual(self.client.get('/json/circvis/', params).status_code, 400)
+        self.assertEqual(self.client.get('/json/circvis/', {'gene':'VNG9999G'}).status_code, 404)
+
+    def direct_and_combiner_biclusters(self, gene):
+        # the direct + combiner join Gene.regulated_biclusters used before
+        # tf_regulates_bicluster
+        cursor = connection.cursor()
+        cursor.execute("""
+            select distinct nb.id
+            from networks_bicluster nb
+                 join networks_bicluster_influences bi on nb.id=bi.bicluster_id
+                 join networks_influence ni on bi.influence_id=ni.id
+            where nb.network_id=%s
+            and ((ni.type='tf' and ni.gene_id=%s)
+            or (ni.type='combiner' and ni.id in (
+              select from_influence_id
+              from networks_influence_parts nip join networks_influence ni on nip.to_influence_id=ni.id
+              where ni.gene_id=%s)))
+            order by nb.id;""", (self.network.id, gene.id, gene.id,))
+        ids = [ row[0] for row in cursor.fetchall() ]
+        cursor.close()
+        return ids
+
+    def test_tf_regulates_bicluster(self):
+        tfs = list(Influence.objects.filter(type='tf').order_by('name'))
+        # a TF that only regulates biclusters through a combiner, and one that
+        # also regulates some directly
+        tfs.append(Influence.objects.create(name='tf5', gene=self.genes[5], type='tf'))
+        combiner = Influence.objects.create(name='tf1~~tf5', operation='min', type='combiner')
+        combiner.parts.add(tfs[1], tfs[3])
+        self.biclusters[0].influences.add(combiner)
+        self.biclusters[4].influences.add(combiner)
+        Gene.objects.filter(id__in=[ tf.gene_id for tf in tfs ]).update(transcription_factor=True)
+
+        self.assertEqual(self.network.rebuild_tf_regulates_bicluster(), 5 + 2 * 2)
+        for tf in tfs:
+            gene = Gene.objects.get(id=tf.gene_id)
+            expected = self.direct_and_combiner_biclusters(gene)
+            self.assertEqual([ b.id for b in gene.regulated_biclusters(self.network) ], expected)
+            self.assertEqual(gene.count_regulated_biclusters(self.network.id), len(expected))
+        gene = Gene.objects.get(id=tfs[3].gene_id)
+        self.assertEqual([ b.id for b in gene.regulated_biclusters(self.network) ],
+                         [self.biclusters[0].id, self.biclusters[4].id])
+        self.assertEqual(len(list(Gene.objects.get(id=tfs[1].gene_id).regulated_biclusters(self.network))), 3)
+
+    def test_graph_query_count(self):
+        # the number of queries doesn't grow with the number of biclusters
+        for biclusters in (self.biclusters[:1], self.biclusters):
+            with self.assertNumQueries(7):
+                get_nx_graph_for_biclusters(Bicluster.objects.filter(id__in=[b.id for b in biclusters]))
+
+    def test_graphml_query_count(self):
+        for biclusters in (self.biclusters[:1], self.biclusters):
+            with self.assertNumQueries(7):
+                response = self.client.get('/network/graphml', {'biclusters':",".join([str(b.id) for b in biclusters])})
+                content(response)
+            self.assertEqual(response.status_code, 200)
+
+    def test_graphml_export(self):
+        ids = [b.id for b in self.biclusters[:2]]
+        graph = get_nx_graph_for_biclusters(Bicluster.objects.filter(id__in=ids))
+        doc = minidom.parseString(content(self.client.get('/network/graphml', {'biclusters':",".join([str(id) for id in ids])})))
+        self.assertEqual(len(doc.getElementsByTagName('node')), graph.number_of_nodes())
+        self.assertEqual(len(doc.getElementsByTagName('edge')), graph.number_of_edges())
+
+    def test_gzipped_network_export(self):
+        network_id = self.biclusters[0].network_id
+        plain = content(self.client.get('/network/gml', {'network_id':network_id}))
+        response = self.client.get('/network/gml', {'network_id':network_id, 'gzip':'true'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(zlib.decompress(content(response), 16 + zlib.MAX_WBITS), plain)
+        self.assertEqual(plain.count('edge ['), 5 * 4 + 5 + 5)
+
+
+class ProfilingTest(TestCase):
+    def test_header(self):
+        with self.settings(PROFILE_HEADER=True, PROFILE_QUERY_SAMPLE=1.0):
+            response = self.client.get('/networks/')
+        self.assertTrue(response['X-Profile'].startswith('queries='))
+
+    def test_sampling(self):
+        use_debug_cursor = connection.use_debug_cursor
+        with self.settings(PROFILE_HEADER=True, PROFILE_QUERY_SAMPLE=0.0):
+            response = self.client.get('/networks/')
+        self.assertTrue(response['X-Profile'].startswith('template_ms='))
+        self.assertEqual(connection.use_debug_cursor, use_debug_cursor)
+
+    def test_exception(self):
+        # a view raising, here for a missing parameter, doesn't leave the debug cursor on
+        use_debug_cursor = connection.use_debug_cursor
+        with self.settings(PROFILE_QUERY_SAMPLE=1.0):
+            self.assertRaises(KeyError, self.client.get, '/json/motif_hits/')
+        self.assertEqual(connection.use_debug_cursor, use_debug_cursor)
+        self.assertEqual(profiling.current(), None)
+
+    def test_profiled_requests(self):
+        # requests within a profile don't reset its query log
+        with self.settings(PROFILE_HEADER=True, PROFILE_QUERY_SAMPLE=1.0):
+            with profiling.profiled('block') as profile:
+                Species.objects.count()
+                response = self.client.get('/networks/')
+        inner = int(response['X-Profile'].split(';')[0].split('=')[1])
+        self.assertTrue(profile.query_count >= inner + 1)
+
+    def test_install(self):
+        with self.settings(PROFILE_HOOKS=False):
+            self.assertFalse(profiling.install())
+        with self.settings(PROFILE_HOOKS=True):
+            self.assertTrue(profiling.install())
+            self.assertTrue(profiling.install())
+        self.assertTrue(Template.render.profiled)
+
+    def test_summarize(self):
+        self.assertEqual(percentile(range(1, 101), 95), 95)
+        records = [ {'name':'gene', 'total_ms':float(i), 'queries':i % 7, 'db_ms':1.0, 'template_ms':2.0} for i in range(1, 201) ]
+        summary = summarize(records)['gene']
+        self.assertEqual((summary['requests'], summary['p50_ms'], summary['p99_ms']), (200, 100.0, 198.0))
+        # requests without recorded queries
+        records = [ {'name':'gene', 'total_ms':1.0, 'queries':None, 'db_ms':None, 'template_ms':2.0} ]
+        summary = summarize(records)['gene']
+        self.assertEqual((summary['requests'], summary['max_queries'], summary['p95_db_ms']), (1, None, None))
+
+
+class SyntheticNetworkTestCase(TestCase):
+    """
+    Generates small synthetic networks, of the size given by network_scale.
+    """
+    network_scale = dict(genes=20, tfs=2, combiners=1, conditions=6, biclusters=4,
+                         genes_per_bicluster=5, conditions_per_bicluster=4, functions=4)
+
+    def generate_network(self, short_name):
+        return synthetic.generate(short_name=short_name, **self.network_scale)
+
+
+class SyntheticDataTest(SyntheticNetworkTestCase):
+    network_scale = dict(genes=60, tfs=6, combiners=2, conditions=8, biclusters=10,
+                         genes_per_bicluster=5, conditions_per_bicluster=4, functions=12)
+
+    def test_generate_and_benchmark(self):
+        network = self.generate_network('tst')
+        self.assertEqual(network.bicluster_set.count(), 10)
+        self.assertEqual(Gene.objects.filter(species=network.species).count(), 60)
+        self.assertEqual(len(network.condition_set.all()[0].expression()), 60)
+        self.assertEqual(len(Motif.objects.filter(bicluster__network=network)[0].pssm()), 20)
+
+        report = benchmarks.run(network, repeat=1, names=['bicluster', 'circvis', 'expression_matrix_db'])
+        self.assertEqual(report['results']['bicluster']['runs'], 1)
+        self.assertEqual(report['results']['circvis']['runs'], 1)
+        self.assertTrue(report['results']['expression_matrix_db']['queries'] > 0)
+
+        # timed runs render the pages rather than hitting the cache
+        target = benchmarks.Target(network)
+        for i in range(2):
+            with caching.bypassed():
+                response = target.client.get('/bicluster/%d' % (target.bicluster.id,))
+            self.assertNotEqual(response['X-Cache'], 'HIT')
+
+
+class FunctionClosureTest(TestCase):
+    def setUp(self):
+        species = Species.objects.create(name='Halobacterium salinarum NRC-1', short_name='hal', created_at=datetime.now())
+        chromosome = Chromosome.objects.create(species=species, name='chromosome', length=2000000, topology='circular')
+        genes = [ Gene.objects.create(species=species, chromosome=chromosome, name='VNG%04dG' % (i,), start=1000*i+1, end=1000*i+900)
+                  for i in range(2) ]
+        # root <-is_a- mid <-is_a- leaf, and part <-part_of- mid
+        self.root, self.mid, self.leaf, self.part = [ Function.objects.create(native_id='GO:%07d' % (i,), name=name, type='go')
+                                                      for i, name in enumerate(['root', 'mid', 'leaf', 'part']) ]
+        Function_Relationships.objects.create(function=self.mid, target=self.root, type='is_a')
+        Function_Relationships.objects.create(function=self.leaf, target=self.mid, type='is_a')
+        Function_Relationships.objects.create(function=self.part, target=self.mid, type='part_of')
+        Gene_Function.objects.create(gene=genes[0], function=self.leaf, source='test')
+        Gene_Function.objects.create(gene=genes[1], function=self.part, source='test')
+        Function.rebuild_closure()
+
+    def test_closure(self):
+        self.assertEqual([ (f.name, f.depth) for f in self.leaf.ancestors() ], [('mid', 1), ('root', 2)])
+        self.assertEqual([ (f.name, f.depth) for f in self.part.ancestors() ], [('mid', 1), ('root', 2)])
+        self.assertEqual(len(list(self.part.ancestors(relations=['is_a']))), 0)
+        self.assertEqual(sorted([ (f.depth, f.name) for f in self.root.descendants() ]), [(1, 'mid'), (2, 'leaf'), (2, 'part')])
+        self.assertEqual(self.root.count_descendant_genes(), 2)
+        self.assertEqual(self.root.count_descendant_genes(relations=['is_a']), 1)
+        self.assertEqual(self.leaf.count_descendant_genes(), 1)
+        self.assertTrue(self.root.has_descendant(self.part))
+        self.assertTrue(self.leaf.has_descendant(self.leaf))
+        self.assertFalse(self.leaf.has_descendant(self.root))
+
+
+class EnrichmentTest(SyntheticNetworkTestCase):
+    network_scale = SyntheticDataTest.network_scale
+
+    def test_hypergeometric(self):
+        # P(X >= 2) drawing 3 from 4 white and 6 black: (C(4,2)C(6,1) + C(4,3)) / C(10,3)
+        p = enrichment.hypergeometric_sf([2, 0, 4], [4, 4, 4], [6, 6, 6], [3, 3, 3])
+        self.assertAlmostEqual(p[0], (6 * 6 + 4) / 120.0)
+        self.assertAlmostEqual(p[1], 1.0)
+        self.assertAlmostEqual(p[2], 0.0)
+
+    def test_hypergeometric_tail(self):
+        # the observed count is in the tail, as by R's phyper(q - 1, m, n, k, lower.tail=FALSE):
+        # phyper(4, 10, 90, 20, lower.tail=FALSE) = 0.02546455
+        # phyper(5, 10, 90, 20, lower.tail=FALSE) = 0.003933076
+        p = enrichment.hypergeometric_sf([5, 6], [10, 10], [90, 90], [20, 20])
+        self.assertAlmostEqual(p[0], 0.02546455, places=7)
+        self.assertAlmostEqual(p[1], 0.003933076, places=8)
+
+    def test_corrections(self):
+        # as by R's p.adjust
+        p = [0.01, 0.04, 0.03, 0.2]
+        bh = enrichment.benjamini_hochberg(p)
+        self.assertEqual([ round(x, 6) for x in bh ], [0.04, 0.053333, 0.053333, 0.2])
+        self.assertEqual([ round(x, 6) for x in enrichment.bonferroni(p) ], [0.04, 0.16, 0.12, 0.8])
+
+    def test_enrich_network(self):
+        network = self.generate_network('enr')
+        counts = enrichment.enrich_network(network.id, ['go'])
+        results = Bicluster_Function.objects.filter(bicluster__network=network)
+        self.assertEqual(results.count(), counts['go'])
+        self.assertTrue(counts['go'] > 0)
+        background = set([ result.m + result.n for result in results ])
+        self.assertEqual(len(background), 1)
+        for result in results:
+            self.assertTrue(0.0 <= result.p <= result.p_bh <= result.p_b <= 1.0)
+            self.assertTrue(0 < result.gene_count <= min(result.m, result.k))
+
+
+class CoexpressionTest(SyntheticNetworkTestCase):
+    network_scale = dict(genes=30, tfs=2, combiners=1, conditions=10, biclusters=4,
+                         genes_per_bicluster=5, conditions_per_bicluster=6, functions=2)
+
+    def setUp(self):
+        nan = float('nan')
+        self.data = np.array([[1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+                              [2.0, 4.0, 6.0, 8.0, 10.0, nan],
+                              [6.0, 5.0, 4.0, 3.0, 2.0, 1.0],
+                              [1.0, 8.0, 27.0, 64.0, 125.0, 216.0],
+                              [1.0, nan, nan, 2.0, 3.0, nan]])
+
+    def test_ranks(self):
+        ranks = coexpression.ranks(self.data)
+        self.assertEqual(list(ranks[2]), [6.0, 5.0, 4.0, 3.0, 2.0, 1.0])
+        self.assertEqual(list(ranks[4][[0, 3, 4]]), [1.0, 2.0, 3.0])
+        self.assertTrue(np.isnan(ranks[4][1]))
+
+    def test_pearson(self):
+        values, mask = coexpression.prepare(self.data, 'pearson')
+        r, n = coexpression.correlate_block(values, mask, [0])
+        # row 1 is missing a value, so is compared over the other five
+        self.assertEqual(list(n[0]), [6, 5, 6, 6, 3])
+        self.assertAlmostEqual(r[0, 1], 1.0)
+        self.assertAlmostEqual(r[0, 2], -1.0)
+        self.assertTrue(0.9 < r[0, 3] < 1.0)
+        # too few shared conditions
+        self.assertTrue(np.isnan(r[0, 4]))
+
+    def test_spearman(self):
+        values, mask = coexpression.prepare(self.data, 'spearman')
+        r, n = coexpression.correlate_block(values, mask, [0])
+        self.assertAlmostEqual(r[0, 3], 1.0)
+        self.assertAlmostEqual(r[0, 2], -1.0)
+
+    def test_more_than_stored(self):
+        network = self.generate_network('cox')
+        gene = network.species.gene_set.order_by('name')[0]
+        self.assertEqual(coexpression.build(network.id, k=3, processes=1), 30 * 3)
+        stored = coexpression.neighbors(network.id, gene.id, k=3)
+        self.assertEqual(len(stored), 3)
+        # more neighbors than were stored are computed on request
+        live = coexpression.neighbors(network.id, gene.id, k=10)
+        self.assertEqual(len(live), 10)
+        self.assertEqual([ match[0] for match in live[:3] ], [ match[0] for match in stored ])
+
+    def test_view(self):
+        network = self.generate_network('cov')
+        response = self.client.get('/json/coexpression/', {'gene':'COV00001', 'k':5})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual((data['network_id'], len(data['neighbors'])), (network.id, 5))
+        for params in ({}, {'gene':'COV00001', 'k':'many'}, {'gene':'COV00001', 'k':-1},
+                       {'gene':'COV00001', 'network_id':'first'}):
+            self.assertEqual(self.client.get('/json/coexpression/', params).status_code, 400)
+        for params in ({'gene':'COV99999'}, {'gene':'COV00001', 'network_id':network.id + 100}):
+            self.assertEqual(self.client.get('/json/coexpression/', params).status_code, 404)
+
+
+class CoherenceTest(SyntheticNetworkTestCase):
+    network_scale = dict(genes=40, tfs=4, combiners=2, conditions=10, biclusters=6,
+                         genes_per_bicluster=5, conditions_per_bicluster=6, functions=4)
+
+    def test_additive(self):
+        # rows that differ by a constant shift fit perfectly
+        nan = float('nan')
+        data = np.array([[1.0, 2.0, 4.0], [2.0, 3.0, 5.0], [0.0, 1.0, 3.0], [nan, nan, nan]])
+        result = coherence.quality(data)
+        self.assertAlmostEqual(result['residue'], 0.0)
+        self.assertAlmostEqual(result['abs_residue'], 0.0)
+        self.assertEqual((result['genes'], result['conditions']), (3, 3))
+
+    def test_outlier(self):
+        data = np.array([[1.0, 2.0, 3.0, 4.0]] * 5 + [[4.0, 1.0, 3.0, 2.0]])
+        result = coherence.quality(data)
+        self.assertTrue(result['residue'] > 0.0)
+        self.assertEqual(np.argmax(result['gene_z']), 5)
+        self.assertTrue(result['gene_z'][5] > coherence.OUTLIER_Z)
+
+    def test_refresh(self):
+        network = self.generate_network('coh')
+        self.assertEqual(coherence.refresh(network.id, processes=1), 6)
+        bicluster = network.bicluster_set.all()[0]
+        stored = coherence.stored_quality(bicluster.id)
+        self.assertEqual(stored['version_id'], network.version_id)
+        genes, conditions, result = coherence.bicluster_quality(bicluster)
+        self.assertAlmostEqual(stored['residue'], result['residue'], places=4)
+
+        # the page takes the summary from the table while it's up to date
+        cursor = connection.cursor()
+        cursor.execute("update bicluster_quality set residue=123.0 where bicluster_id=%s", (bicluster.id,))
+        cursor.close()
+        panel = coherence.quality_panel(bicluster)
+        self.assertEqual(panel['residue'], 123.0)
+        self.assertEqual(len(panel['profile']), bicluster.conditions.count())
+        network.version_id = network.version_id + '.1'
+        network.save()
+        panel = coherence.quality_panel(Bicluster.objects.get(id=bicluster.id))
+        self.assertAlmostEqual(panel['residue'], result['residue'])
+
+    def test_submatrix(self):
+        network = self.generate_network('csm')
+        bicluster = network.bicluster_set.all()[0]
+        conditions = list(bicluster.conditions.order_by('-id'))
+        full = expression_matrix_from_db(conditions)
+        genes = list(bicluster.genes.all())
+        gene_ids = set([ gene.id for gene in genes ])
+        rows = [ i for i, gene in enumerate(full.genes) if gene.id in gene_ids ]
+
+        store_dir = tempfile.mkdtemp()
+        try:
+            with override_settings(EXPRESSION_STORE_DIR=store_dir):
+                for build in (False, True):
+                    if build:
+                        expression_store.build_store(network)
+                    matrix = coherence.submatrix(genes, conditions)
+                    self.assertEqual([ gene.id for gene in matrix.genes ], [ full.genes[i].id for i in rows ])
+                    self.assertEqual(matrix.conditions, conditions)
+                    np.testing.assert_array_almost_equal(matrix.data, full.data[rows], decimal=5)
+                self.assertEqual(coherence.submatrix([], conditions).data.shape, (0, len(conditions)))
+        finally:
+            expression_store._stores.pop(network.id, None)
+            shutil.rmtree(store_dir)
+
+    def test_network_biclusters(self):
+        network = self.generate_network('cnb')
+        data, biclusters = coherence.network_biclusters(network.id)
+        self.assertEqual(len(biclusters), 6)
+        for bicluster_id, rows, columns in biclusters:
+            # rows and columns are in the matrix's order, whatever order the
+            # memberships come back from the database in
+            self.assertEqual((len(rows), len(columns)), (5, 6))
+            self.assertTrue((np.diff(rows) > 0).all() and (np.diff(columns) > 0).all())
+
+
+class PlotTest(SyntheticNetworkTestCase):
+    network_scale = CoherenceTest.network_scale
+
+    def setUp(self):
+        self.plot_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.plot_dir)
+
+    def test_render_svg(self):
+        nan = float('nan')
+        svg = plots.render_svg([[1.0, 2.0, nan, 4.0], [2.0, 1.0, 0.5, 3.0]], "Bicluster 1")
+        minidom.parseString(svg)
+        self.assertTrue("Bicluster 1" in svg)
+        self.assertTrue("No expression data" in plots.render_svg(np.empty((0, 3))))
+
+    def test_render_network(self):
+        network = self.generate_network('plt')
+        with override_settings(PLOT_DIR=self.plot_dir):
+            self.assertEqual(plots.render_network(network.id, processes=1), 6)
+            self.assertEqual(plots.render_network(network.id, processes=1), 0)
+            bicluster = network.bicluster_set.all()[0]
+            self.assertTrue(os.path.exists(plots.plot_path(network.id, network.version_id, bicluster.id)))
+            self.assertTrue(plots.bicluster_plot_url(bicluster).endswith("bicluster_%d.svg" % (bicluster.id,)))
+
+
+class TemporaryCacheTestCase(SyntheticNetworkTestCase):
+    """
+    Caches pages in a temporary directory and logs request profiles there,
+    rather than in web_app/cache and web_app/profile.log.
+    """
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_settings = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': os.path.join(self.cache_dir, 'cache'),
+            },
+            'local': {
+                'BACKEND': 'web_app.networks.caching.LRUCache',
+                'LOCATION': self.cache_dir,
+            },
+        })
+        self.cache_settings.enable()
+        self.profile_logger = logging.getLogger('networks.profiling')
+        self.profile_handlers = self.profile_logger.handlers
+        self.profile_logger.handlers = [ logging.FileHandler(os.path.join(self.cache_dir, 'profile.log')) ]
+
+    def tearDown(self):
+        for handler in self.profile_logger.handlers:
+            handler.close()
+        self.profile_logger.handlers = self.profile_handlers
+        self.cache_settings.disable()
+        shutil.rmtree(self.cache_dir)
+
+
+class CachingTest(TemporaryCacheTestCase):
+    def test_lru(self):
+        lru = caching.LRUCache('test_lru', {'OPTIONS':{'MAX_ENTRIES':2}})
+        lru.clear()
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        # b was used least recently
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual((lru.get('a'), lru.get('c')), (1, 3))
+        stats = lru.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['entries']), (3, 1, 1, 2))
+
+    def test_cached_view(self):
+        caching.invalidate()
+        self.generate_network('cch')
+        first = self.client.get('/json/circvis/', {'gene':'CCH00001'})
+        second = self.client.get('/json/circvis/', {'gene':'CCH00001'})
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(first.content, second.content)
+        caching.invalidate()
+        self.assertEqual(self.client.get('/json/circvis/', {'gene':'CCH00001'})['X-Cache'], 'MISS')
+
+        # parameters the view doesn't read, and their order, don't make new entries
+        self.assertEqual(self.client.get('/json/circvis/?gene=CCH00001&_=123')['X-Cache'], 'HIT')
+        self.client.get('/json/circvis/?gene=CCH00001&limit=5')
+        self.assertEqual(self.client.get('/json/circvis/?limit=5&x=1&gene=CCH00001')['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get('/json/circvis/?gene=CCH00002')['X-Cache'], 'MISS')
+
+
+class WarmupTest(TemporaryCacheTestCase):
+    def test_warm_cache(self):
+        caching.invalidate()
+        network = self.generate_network('wrm')
+        paths = warmup.warmup_paths(network, ('gene', 'circvis'))
+        self.assertEqual(len(paths), 40)
+        tfs = set([ "/gene/%s" % (gene.name,) for gene in network.species.gene_set.filter(transcription_factor=True) ])
+        self.assertEqual(set([ path for kind, path in paths[:4] if kind == 'gene' ]), tfs)
+
+        summary = warmup.summarize(warmup.crawl(paths, threads=1))
+        self.assertEqual(summary['gene']['errors'], 0)
+        self.assertEqual(summary['gene']['hits'], 0)
+        summary = warmup.summarize(warmup.crawl(paths, threads=1))
+        self.assertEqual((summary['gene']['hits'], summary['circvis']['hits']), (20, 20))
+
+    def test_threads(self):
+        # the species list needs no data, so worker threads, whose own
+        # connections don't see this test's, can render it. The data version
+        # is read here, so they don't write the cache generation.
+        caching.invalidate()
+        caching.data_version()
+        paths = [ ('species', '/species/') ] * 3
+        results = list(warmup.crawl(paths, threads=3))
+        self.assertEqual([ result[2] for result in results ], [200] * 3)
+        results = list(warmup.crawl(paths, threads=3))
+        self.assertEqual([ (result[2], result[4]) for result in results ], [(200, 'HIT')] * 3)
+
+        # views failing in worker threads still give one result per path
+        paths = [ ('pssm', "/json/pssm/?motif_id=%d" % (i,)) for i in range(10) ]
+        threads = threading.active_count()
+        results = list(warmup.crawl(paths, threads=3))
+        self.assertEqual(sorted([ result[1] for result in results ]), sorted([ path for kind, path in paths ]))
+        self.assertEqual(threading.active_count(), threads)
+
+        # stopping early leaves no threads behind
+        crawl = warmup.crawl(paths, threads=3)
+        crawl.next()
+        crawl.close()
+        self.assertEqual(threading.active_count(), threads)
+
+
+class MotifScanTest(TestCase):
+    # GATTACAG, reverse complement CTGTAATC
+    motif = 'GATTACAG'
+
+    def setUp(self):
+        self.values = [ [0.97 if base == b else 0.01 for b in 'ACGT'] for base in self.motif ]
+        random = np.random.RandomState(7)
+        self.sequence = "".join(random.choice(list('ACGT'), 2000))
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def plant(self, sequence, position, site):
+        return sequence[:position] + site + sequence[position + len(site):]
+
+    def write_fasta(self, name, sequence):
+        path = os.path.join(self.dir, name + '.fa')
+        with open(path, 'w') as f:
+            f.write(">%s\n" % (name,))
+            for i in range(0, len(sequence), 60):
+                f.write(sequence[i:i+60] + "\n")
+        return path
+
+    def test_log_odds(self):
+        background = np.array([0.25, 0.25, 0.25, 0.25])
+        matrix = motif_scan.log_odds([[1.0, 0.0, 0.0, 0.0]], background)
+        self.assertAlmostEqual(matrix[0][0], np.log2((1.01 / 1.04) / 0.25))
+        self.assertAlmostEqual(matrix[0][1], np.log2((0.01 / 1.04) / 0.25))
+        scores = motif_scan.score_windows(motif_scan.encode('ACGTN'), matrix)
+        self.assertEqual(scores[0], matrix[0][0])
+        self.assertEqual(scores[2], matrix[0][2])
+        self.assertEqual(scores[4], -np.inf)
+
+    def test_score_distribution(self):
+        # two positions scoring 1 for an a, 0 otherwise, over uniform background
+        dist = motif_scan.ScoreDistribution(np.array([[1.0, 0.0, 0.0, 0.0]] * 2), [0.25] * 4)
+        self.assertEqual([ round(p, 6) for p in dist.p_values([0.0, 1.0, 2.0]) ], [1.0, 0.4375, 0.0625])
+        threshold = dist.threshold(0.0625)
+        self.assertTrue(1.0 < threshold <= 2.0)
+        self.assertEqual(dist.threshold(0.01), np.inf)
+
+    def test_scan_strands(self):
+        sequence = self.plant(self.sequence, 100, self.motif)
+        sequence = self.plant(sequence, 500, 'CTGTAATC')
+        encoded = motif_scan.encode(sequence)
+        background = motif_scan.background_frequencies(encoded)
+        hits = motif_scan.scan(encoded, self.values, background)
+        hits_by_site = dict([ ((start, end, strand), (score, p)) for start, end, strand, score, p in hits ])
+        self.assertTrue((101, 108, '+') in hits_by_site)
+        self.assertTrue((501, 508, '-') in hits_by_site)
+        # a perfect match scores the sum of the best entries of the log-odds matrix
+        best = motif_scan.log_odds(self.values, background).max(axis=1).sum()
+        self.assertAlmostEqual(hits_by_site[(101, 108, '+')][0], best)
+        self.assertAlmostEqual(hits_by_site[(501, 508, '-')][0], best)
+        for start, end, strand, score, p in hits:
+            self.assertEqual(end - start + 1, len(self.motif))
+            self.assertTrue(p <= motif_scan.DEFAULT_P_VALUE)
+
+    def test_scan_circular(self):
+        # a site spanning the origin
+        sequence = self.motif[3:] + self.sequence[5:-3] + self.motif[:3]
+        encoded = motif_scan.encode(sequence)
+        background = motif_scan.background_frequencies(encoded)
+        site = (len(sequence) - 2, len(sequence) + 5, '+')
+        linear = motif_scan.scan(encoded, self.values, background)
+        circular = motif_scan.scan(encoded, self.values, background, circular=True)
+        self.assertFalse(site in [ hit[:3] for hit in linear ])
+        self.assertTrue(site in [ hit[:3] for hit in circular ])
+        self.assertTrue(all([ end <= len(sequence) for start, end, strand, score, p in linear ]))
+        self.assertTrue(set(linear) <= set(circular))
+
+    def test_scan_genome(self):
+        chromosomes = [ (1, self.write_fasta('chr', self.plant(self.sequence, 100, self.motif)), True),
+                        (2, self.write_fasta('plasmid', self.plant(self.sequence[:800], 300, 'CTGTAATC')), False) ]
+        motifs = [ (10, self.values), (11, self.values[::-1]) ]
+        inline = sum(motif_scan.scan_genome(chromosomes, motifs, processes=1, motifs_per_task=1), [])
+        pooled = sum(motif_scan.scan_genome(chromosomes, motifs, processes=2, motifs_per_task=1), [])
+        self.assertEqual(sorted(inline), sorted(pooled))
+        self.assertTrue((10, 1, 101, 108, '+') in [ hit[:5] for hit in inline ])
+        self.assertTrue((10, 2, 301, 308, '-') in [ hit[:5] for hit in inline ])
+
+
+class ExpressionDataTestCase(SyntheticNetworkTestCase):
+    network_scale = dict(genes=20, tfs=2, combiners=1, conditions=5, biclusters=3,
+                         genes_per_bicluster=4, conditions_per_bicluster=3, functions=4)
+
+    def setUp(self):
+        self.network = self.generate_network('exm')
+        genes = list(Gene.objects.filter(species=self.network.species).order_by('id'))
+        conditions = list(self.network.condition_set.order_by('id'))
+        cursor = connection.cursor()
+        # a gene with data for only some conditions, a gene with no data for
+        # the first three conditions and a missing value
+        cursor.execute("delete from expression where gene_id=%s and condition_id in (%s, %s);",
+                       (genes[1].id, conditions[0].id, conditions[3].id,))
+        cursor.execute("delete from expression where gene_id=%s and condition_id in (%s, %s, %s);",
+                       (genes[2].id, conditions[0].id, conditions[1].id, conditions[2].id,))
+        cursor.execute("update expression set value=null where gene_id=%s and condition_id=%s;",
+                       (genes[3].id, conditions[4].id,))
+        cursor.close()
+        self.genes = genes
+        self.conditions = conditions
+
+
+class ExpressionMatrixTest(ExpressionDataTestCase):
+    def per_condition_matrix(self, conditions):
+        # one query per condition, as expression_matrix used to do, with
+        # values placed by gene id rather than by position in the result
+        cursor = connection.cursor()
+        columns = []
+        for condition in conditions:
+            cursor.execute("select gene_id, value from expression where condition_id=%s;", (condition.id,))
+            columns.append(dict(cursor.fetchall()))
+        cursor.close()
+        gene_ids = sorted(set(sum([ column.keys() for column in columns ], [])))
+        data = np.array([ [ column.get(id) for column in columns ] for id in gene_ids ], dtype=float)
+        return gene_ids, data
+
+    def test_matrix_from_db(self):
+        for conditions in (self.conditions, self.conditions[2::-1], self.conditions[:3], self.conditions[4:]):
+            matrix = expression_matrix_from_db(conditions)
+            gene_ids, data = self.per_condition_matrix(conditions)
+            self.assertEqual([ gene.id for gene in matrix.genes ], gene_ids)
+            self.assertEqual([ c.id for c in matrix.conditions ], [ c.id for c in conditions ])
+            np.testing.assert_array_equal(matrix.data, data)
+        self.assertEqual(np.isnan(expression_matrix_from_db(self.conditions).data).sum(), 6)
+        matrix = expression_matrix_from_db(self.conditions[:3])
+        self.assertFalse(self.genes[2] in matrix.genes)
+        self.assertEqual(np.isnan(matrix.data).sum(), 1)
+        self.assertEqual(expression_matrix_from_db([]).data.shape, (0, 0))
+
+
+class ExpressionStoreTest(ExpressionDataTestCase):
+    def setUp(self):
+        ExpressionDataTestCase.setUp(self)
+        self.store_dir = tempfile.mkdtemp()
+        self.store_settings = override_settings(EXPRESSION_STORE_DIR=self.store_dir)
+        self.store_settings.enable()
+
+    def tearDown(self):
+        expression_store._stores.pop(self.network.id, None)
+        self.store_settings.disable()
+        shutil.rmtree(self.store_dir)
+
+    def test_build_store(self):
+        path = expression_store.store_path(self.network.id)
+        # left behind by a build that didn't finish
+        os.makedirs(path + '.tmp')
+        self.assertEqual(expression_store.build_store(self.network), (20, 5))
+        self.assertEqual(expression_store.build_store(self.network), (20, 5))
+        self.assertEqual(sorted(os.listdir(self.store_dir)), [ os.path.basename(path) ])
+
+        store = expression_store.get_store(self.network.id)
+        self.assertEqual(store.version_id, self.network.version_id)
+        # the last condition leaves gene 3 with only a null value
+        for conditions in (self.conditions, self.conditions[2::-1], self.conditions[:3], self.conditions[4:]):
+            from_store = store.matrix(conditions)
+            from_db = expression_matrix_from_db(conditions)
+            self.assertEqual(from_store.genes, from_db.genes)
+            # the store holds single precision
+            np.testing.assert_array_equal(from_store.data, from_db.data.astype(np.float32))
+        self.assertEqual(store.column(self.conditions[0].id)[0].tolist(),
+                         [ gene.id for gene in expression_matrix_from_db(self.conditions[:1]).genes ])
+
+    def test_stale_store(self):
+        expression_store.build_store(self.network)
+        self.assertTrue(expression_store.get_store(self.network.id) is not None)
+        Network.objects.filter(id=self.network.id).update(version_id='reloaded')
+        self.assertEqual(expression_store.get_store(self.network.id), None)
+        # falls back to the DB
+        matrix = expression_matrix(self.conditions)
+        np.testing.assert_array_equal(matrix.data, expression_matrix_from_db(self.conditions).data)
+
+        self.network = Network.objects.get(id=self.network.id)
+        expression_store.build_store(self.network)
+        self.assertEqual(expression_store.get_store(self.network.id).version_id, 'reloaded')
+
+    def test_network_matrix(self):
+        gene_ids, condition_ids, data = expression_store.network_matrix(self.network.id)
+        expression_store.build_store(self.network)
+        store_gene_ids, store_condition_ids, store_data = expression_store.network_matrix(self.network.id)
+        self.assertEqual(store_gene_ids.tolist(), gene_ids.tolist())
+        self.assertEqual(store_condition_ids.tolist(), [ c.id for c in self.conditions ])
+        self.assertEqual(condition_ids.tolist(), [ c.id for c in self.conditions ])
+        np.testing.assert_array_equal(store_data, data.astype(np.float32))
+
+
+Named = namedtuple('Named', 'name')
+
+class ExpressionTSVTest(TestCase):
+    def test_tsv_chunks(self):
+        nan = float('nan')
+        genes = [ Named("G%04d" % (i,)) for i in range(2500) ]
+        conditions = [ Named(name) for name in ('heat', 'cold', 'dark') ]
+        data = np.zeros((2500, 3))
+        data[0] = [1.0 / 3, 1234567.89, 1e-10]
+        data[999] = [-0.5, nan, 2.0]
+        data[1000] = [nan, nan, nan]
+        matrix = DataMatrix(genes, conditions, data)
+
+        chunks = list(expression_matrix_to_tsv_chunks(matrix))
+        self.assertEqual(chunks[0], "GENE\theat\tcold\tdark\n")
+        # a chunk per 1000 rows
+        self.assertEqual([ chunk.count("\n") for chunk in chunks[1:] ], [1000, 1000, 500])
+        # values keep the 12 significant digits of str()
+        self.assertTrue(chunks[1].startswith("G0000\t0.333333333333\t1234567.89\t1e-10\nG0001\t0\t0\t0\n"))
+        self.assertTrue(chunks[1].endswith("G0999\t-0.5\tnan\t2\n"))
+        self.assertTrue(chunks[2].startswith("G1000\tnan\tnan\tnan\n"))
+        self.assertTrue(chunks[3].endswith("G2499\t0\t0\t0\n"))
+
+        text = "".join(chunks)
+        self.assertEqual(expression_matrix_to_tsv(matrix), text)
+        self.assertEqual("".join(expression_matrix_to_tsv_chunks(matrix, block_size=7)), text)
+        empty = DataMatrix([], conditions, np.empty((0, 3)))
+        self.assertEqual(list(expression_matrix_to_tsv_chunks(empty)), ["GENE\theat\tcold\tdark\n"])
+
+
+class MotifPSSMTest(TemporaryCacheTestCase):
+    def setUp(self):
+        TemporaryCacheTestCase.setUp(self)
+        species = Species.objects.create(name='Halobacterium salinarum NRC-1', short_name='hal', created_at=datetime.now())
+        network = Network.objects.create(species=species, name='test', version_id='1', created_at=datetime.now())
+        bicluster = Bicluster.objects.create(network=network, k=1)
+        self.motifs = [ Motif.objects.create(bicluster=bicluster, position=i+1, sites=10, e_value=0.01) for i in range(3) ]
+        # the last motif has no PSSM
+        self.values = {self.motifs[0].id: [[0.9, 0.05, 0.05, 0.0], [0.0, 0.0, 0.0, 1.0]],
+                       self.motifs[1].id: [[0.25, 0.25, 0.25, 0.25], [0.1, 0.5, 0.2, 0.2], [0.0, 1.0, 0.0, 0.0]]}
+        cursor = connection.cursor()
+        db_util.insert_many(cursor, 'pssms', ['motif_id', 'position', 'a', 'c', 'g', 't'],
+                              [ (motif_id, i + 1) + tuple(row)
+                                for motif_id, rows in self.values.items() for i, row in enumerate(rows) ])
+        cursor.close()
+
+    def test_pssms_for(self):
+        with self.assertNumQueries(1):
+            pssms = Motif.pssms_for([ motif.id for motif in self.motifs ])
+        self.assertEqual(sorted(pssms.keys()), sorted(self.values.keys()))
+        for motif_id, values in self.values.items():
+            np.testing.assert_array_almost_equal(pssms[motif_id].values, values)
+        self.assertEqual(Motif.pssms_for([self.motifs[2].id]), {})
+        self.assertEqual(Motif.pssms_for([]), {})
+
+    def test_prefetch_pssms(self):
+        motifs = list(Motif.objects.filter(id__in=[ motif.id for motif in self.motifs ]).order_by('id'))
+        with self.assertNumQueries(1):
+            Motif.prefetch_pssms(motifs)
+        with self.assertNumQueries(0):
+            self.assertEqual([ len(motif.pssm()) for motif in motifs ], [2, 3, 0])
+            self.assertEqual(motifs[0].pssm().consensus(), "AT")
+            # already loaded
+            Motif.prefetch_pssms(motifs)
+
+    def test_pssm_view(self):
+        response = self.client.get('/json/pssm/', {'motif_id':self.motifs[1].id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['values'], self.values[self.motifs[1].id])
+        self.assertEqual(self.client.get('/json/pssm/', {'motif_id':self.motifs[2].id}).status_code, 404)
+
+    def test_motif_hits_view(self):
+        response = self.client.get('/json/motif_hits/', {'motif_id':self.motifs[0].id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/json/motif_hits/', {'motif_id':self.motifs[2].id + 100}).status_code, 404)
+
+    def test_motif_index_from_db(self):
+        with override_settings(MOTIF_INDEX_PATH=os.path.join(self.cache_dir, 'missing.npz')):
+            index = motif_similarity.get_index()
+            self.assertEqual(sorted(index.motif_ids.tolist()), sorted(self.values.keys()))
+            self.assertTrue(motif_similarity.get_index() is index)
+
+            # a new motif is picked up once the data version changes
+            motif = Motif.objects.create(bicluster=self.motifs[0].bicluster, position=4, sites=10, e_value=0.01)
+            cursor = connection.cursor()
+            db_util.insert_many(cursor, 'pssms', ['motif_id', 'position', 'a', 'c', 'g', 't'],
+                                  [(motif.id, 1, 0.0, 0.0, 1.0, 0.0)])
+            cursor.close()
+            caching.invalidate()
+            self.assertTrue(motif.id in motif_similarity.get_index().motif_ids.tolist())
+
+    def test_motif_similar_view(self):
+        with override_settings(MOTIF_INDEX_PATH=os.path.join(self.cache_dir, 'missing.npz')):
+            path = '/motif/%d/similar' % (self.motifs[0].id,)
+            response = self.client.get(path, {'k':1000})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([ match['motif_id'] for match in json.loads(response.content)['similar'] ],
+                             [self.motifs[1].id])
+            for k in ('many', '0', '-3'):
+                self.assertEqual(self.client.get(path, {'k':k}).status_code, 400)
@@ -8,16 +8,29 @@ from web_app.networks.models import Gene
 from django.template import RequestContext
 from django.http import HttpResponse
 from django.http import Http404
+from django.http import HttpResponseBadRequest
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # before Django 1.5, an HttpResponse given an iterator streams its content
+    StreamingHttpResponse = HttpResponse
 from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import render_to_response
 from django.db.models import Q
+from django.db import connection
 from web_app.networks.models import *
 from web_app.networks.functions import functional_systems
-from web_app.networks.helpers import nice_string, get_influence_biclusters, get_nx_graph_for_biclusters
+from web_app.networks.helpers import nice_string, get_influence_biclusters
+from web_app.networks import graph_export
+from web_app.networks import motif_similarity
+from web_app.networks import coexpression as coexpression_engine
+from web_app.networks import coherence
+from web_app.networks import plots
+from web_app.networks import caching
+from web_app.networks.caching import cached_view
 from pprint import pprint
 from django.utils import simplejson
 import json
-import networkx as nx
 import re
 import sys, traceback
 
@@ -59,42 +72,54 @@ def network_cytoscape_web(request):
         expand = ""
     return render_to_response('network_cytoscape_web.html', locals())
 
-def network_as_graphml(request):
-    if request.GET.has_key('biclusters'):
-        bicluster_ids = re.split( r'[\s,;]+', request.GET['biclusters'] )
-        biclusters = Bicluster.objects.filter(id__in=bicluster_ids)
+def _graph_export_response(request, chunks, content_type, extension):
+    """
+    Stream an exported network, gzip-compressed if the request asks for it
+    with gzip=true.
+    """
+    if request.GET.get('gzip') == 'true':
+        response = StreamingHttpResponse(graph_export.gzip_chunks(chunks), content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+    if request.GET.has_key('network_id'):
+        response['Content-Disposition'] = 'attachment; filename=network_%d.%s' % (int(request.GET['network_id']), extension,)
+    return response
+
+def _graph_export_scope(request):
+    """
+    Select the biclusters to export: a whole network, a list of biclusters or
+    the biclusters a gene belongs to.
+    """
+    if request.GET.has_key('network_id'):
+        return graph_export.Scope.network(request.GET['network_id'])
+    elif request.GET.has_key('biclusters'):
+        bicluster_ids = re.split( r'[\s,;]+', request.GET['biclusters'].strip() )
+        return graph_export.Scope.biclusters([ id for id in bicluster_ids if id != '' ])
     elif request.GET.has_key('gene'):
-        biclusters = Bicluster.objects.filter(genes__name=request.GET['gene'])
-    
-    expand = request.GET.has_key('expand') and request.GET['expand']=='true'
-    
-    graph = get_nx_graph_for_biclusters(biclusters, expand)
-    
-    # write graphml to response
-    writer = nx.readwrite.graphml.GraphMLWriter(encoding='utf-8',prettyprint=True)
-    writer.add_graph_element(graph)
-    response = HttpResponse(content_type='application/xml')
-    writer.dump(response)
+        return graph_export.Scope.gene(request.GET['gene'])
+    raise Http404("Specify a network_id, biclusters or a gene")
 
-    return response
+def network_as_graphml(request):
+    scope = _graph_export_scope(request)
+    expand = request.GET.has_key('expand') and request.GET['expand']=='true'
+    return _graph_export_response(request, graph_export.graphml_chunks(scope, expand), 'application/xml', 'graphml')
 
 def network_as_gml(request):
-    if request.GET.has_key('biclusters'):
-        bicluster_ids = re.split( r'[\s,;]+', request.GET['biclusters'] )
-        biclusters = Bicluster.objects.filter(id__in=bicluster_ids)
-    elif request.GET.has_key('gene'):
-        biclusters = Bicluster.objects.filter(genes__name=request.GET['gene'])
-    
+    scope = _graph_export_scope(request)
     expand = request.GET.has_key('expand') and request.GET['expand']=='true'
-    
-    graph = get_nx_graph_for_biclusters(biclusters, expand)
-    
-    # write graphml to response
-    response = HttpResponse(content_type='application/xml')
-    nx.write_gml(graph, response)
+    return _graph_export_response(request, graph_export.gml_chunks(scope, expand), 'text/plain', 'gml')
 
+def network_expression(request, network_id=None):
+    """Stream the expression matrix for a network as tab-separated values"""
+    network = Network.objects.get(id=network_id)
+    matrix = expression_matrix(network.condition_set.order_by('id'))
+    coords = request.GET.has_key('coords') and request.GET['coords']=='true'
+    response = StreamingHttpResponse(expression_matrix_to_tsv_chunks(matrix, coords), content_type='application/tsv')
+    response['Content-Disposition'] = 'attachment; filename=network_%d_expression.tsv' % (network.id,)
     return response
 
+@cached_view('id')
 def species(request, species=None, species_id=None):
     try:
         if species:
@@ -177,6 +202,7 @@ def genes(request, species=None, species_id=None):
         # else:
         #     raise Http404("No species specified.")
 
+@cached_view('view', 'id', 'format')
 def gene(request, gene=None, network_id=None):
     if request.GET.has_key('view'):
         view = request.GET['view']
@@ -201,7 +227,7 @@ def gene(request, gene=None, network_id=None):
     if network_id:
         network_id = int(network_id)
     elif gene.species.network_set.count() > 0:
-        network = gene.species.network_set.all()[0]
+        network = gene.species.network_set.order_by('id')[0]
         network_id = network.id
     else:
         network_id = None
@@ -223,23 +249,22 @@ def gene(request, gene=None, network_id=None):
         systems.append(system)
 
     # if the gene is a transcription factor, how many biclusters does it regulate?
-    count_regulated_biclusters = gene.count_regulated_biclusters(network_id)
     #regulated_biclusters = Bicluster.objects.distinct().filter(influences__name__contains=gene.name)
-    regulated_biclusters = gene.regulated_biclusters(network_id)
+    regulated_biclusters = list(gene.regulated_biclusters(network_id))
+    count_regulated_biclusters = len(regulated_biclusters)
 
-    bicluster_pssms = {}
+    # fetch the motifs of all member biclusters in one query, then their PSSMs in another
+    motifs_by_bicluster = {}
+    for motif in Motif.objects.filter(bicluster__in=member_biclusters).order_by('id'):
+        motifs_by_bicluster.setdefault(motif.bicluster_id, []).append(motif)
     preview_motifs = []
     all_motifs = []
     for mbicl in member_biclusters:
-        motifs = mbicl.motif_set.all()
+        motifs = motifs_by_bicluster.get(mbicl.id, [])
         all_motifs.extend(motifs)
-        pssms = __make_pssms(motifs)
-        preview_added = False
-        for motif_id, pssm in pssms.items():
-            bicluster_pssms[motif_id] = pssm
-            if not preview_added:
-                preview_motifs.append(motif_id)
-                preview_added = True
+        if len(motifs) > 0:
+            preview_motifs.append(motifs[0].id)
+    bicluster_pssms = __make_pssms(all_motifs)
     motifs = all_motifs  # used in template
     preview_motifs = preview_motifs[:2]  # restrict to 2 motifs on the front tab to improve load time
 
@@ -250,10 +275,11 @@ def gene(request, gene=None, network_id=None):
     
     return render_to_response('gene.html', locals())
 
+@cached_view('format')
 def bicluster(request, bicluster_id=None):
     bicluster = Bicluster.objects.get(id=bicluster_id)
     genes = bicluster.genes.all()
-    motifs = bicluster.motif_set.all()
+    motifs = Motif.prefetch_pssms(bicluster.motif_set.all())
     gene_count = len(genes)
     influences = bicluster.influences.all()
     conditions = bicluster.conditions.all()
@@ -262,24 +288,8 @@ def bicluster(request, bicluster_id=None):
     # set species for use in template
     species = bicluster.network.species
     
-    # TODO FIXME this should be in the database on a per-network basis
-    species_sh_name =  species.short_name
-    if (species_sh_name == "dvu"):
-        img_url_prefix = "http://baliga.systemsbiology.net/cmonkey/enigma/cmonkey_4.8.2_dvu_3491x739_11_Mar_02_17:37:51/svgs/"
-    elif (species_sh_name == "mmp"):
-        img_url_prefix = "http://baliga.systemsbiology.net/cmonkey/enigma/mmp/cmonkey_4.8.8_mmp_1661x58_11_Oct_11_16:14:07/svgs/"
-    else:
-        img_url_prefix = "http://baliga.systemsbiology.net/cmonkey/enigma/hal/cmonkey_4.5.4_hal_2072x268_10_Jul_13_11:04:39_EGRIN1_ORIGINAL_CLUSTERS/svgs/"
-
-    if (len(str(bicluster.k)) <= 1):
-        cluster_id = "cluster000" + str(bicluster.k) 
-    elif (len(str(bicluster.k)) <= 2): 
-        cluster_id = "cluster00" + str(bicluster.k) 
-    else:
-        cluster_id = "cluster0" + str(bicluster.k) 
-
-    img_url = img_url_prefix + cluster_id + ".svgz"
-    print img_url
+    # expression plot, rendered locally and cached on disk
+    img_url = plots.bicluster_plot_url(bicluster)
 
     # create motif object to hand to wei-ju's logo viewer
     pssm_logo_dict = __make_pssms(motifs)
@@ -300,35 +310,32 @@ def bicluster(request, bicluster_id=None):
                                                function.namespace, function.name, f.gene_count, f.m, f.n, f.k, f.p,
                                                f.p_bh, f.p_b)])
 
+    # coherence of the bicluster's expression, recomputed from expression data
+    quality = coherence.quality_panel(bicluster)
+
     variables = locals()
     variables.update({'functional_systems':functional_systems})
     
     return render_to_response('bicluster.html', variables)
 
 def __make_pssms(motifs):
-    """reusable function to generate a dictionary of motif id -> PSSMs"""
+    """
+    reusable function to generate a dictionary of motif id -> PSSMs. PSSMs for
+    all the motifs are loaded in a single query.
+    """
     pssm_logo_dict = {}
-    alphabet = ['A','C','T','G']
-    for m in motifs:
-        motif = Motif.objects.get(id=m.id)
-        pssm_list = []
-        for positions in motif.pssm():
-            position_list = []
-            for pos, val in positions.items():
-                position_list.append(val)
-            pssm_list.append(position_list)
-
-        pssm_logo = {'alphabet':alphabet, 'values':pssm_list }
-        pssm_logo_dict[m.id] = pssm_list
+    for m in Motif.prefetch_pssms(motifs):
+        pssm_logo_dict[m.id] = m.pssm().to_logo()['values']
     return pssm_logo_dict
 
 def regulated_by(request, network_id, regulator):
     gene = Gene.objects.get(name=regulator)
     network = Network.objects.get(id=network_id)
-    biclusters = gene.regulated_biclusters(network)
+    biclusters = list(gene.regulated_biclusters(network))
     bicluster_ids = [bicluster.id for bicluster in biclusters]
     return render_to_response('biclusters.html', locals())
 
+@cached_view()
 def regulator(request, regulator=None):
     influence = Influence.objects.get(name=regulator)
     parts = influence.parts.all()
@@ -356,56 +363,245 @@ def motif(request, motif_id=None):
     motif = Motif.objects.get(id=motif_id)
     return render_to_response('motif_snippet.html', locals())
 
+@cached_view('motif_id')
 def pssm(request):
     """Returns a JSON representation of the specified motif's PSSM"""
-    motif_id = request.GET['motif_id']
-    motif = Motif.objects.get(id=motif_id)
-    alphabet = ['A','C','T','G']
-    pssm_list = []
-    for positions in motif.pssm():
-        position_list = []
-        for pos, val in positions.items():
-            position_list.append(val)
-        pssm_list.append(position_list)
-
-    data = {'alphabet':alphabet, 'values':pssm_list }
+    motif_id = int(request.GET['motif_id'])
+    pssms = Motif.pssms_for([motif_id])
+    if motif_id not in pssms:
+        raise Http404("Couldn't find a PSSM for motif with id=%d" % (motif_id,))
+
+    return HttpResponse(simplejson.dumps(pssms[motif_id].to_logo()), mimetype='application/json')
+
+def motif_hits(request):
+    """
+    Returns a JSON list of the stored genome-wide hits for a motif, optionally
+    restricted to a chromosome and region or to p-values below a cutoff.
+    """
+    motif_id = int(request.GET['motif_id'])
+    try:
+        motif = Motif.objects.select_related('bicluster__network').get(id=motif_id)
+    except Motif.DoesNotExist:
+        raise Http404("Couldn't find motif with id=%d" % (motif_id,))
+    chromosomes = dict([ (ch.id, ch) for ch in Chromosome.objects.filter(species=motif.bicluster.network.species_id) ])
+    sql = """
+        select chromosome_id, start, "end", strand, score, p_value
+        from motif_hits
+        where motif_id=%s"""
+    params = [motif_id]
+    if request.GET.has_key('chromosome'):
+        matches = [ ch.id for ch in chromosomes.values() if ch.name == request.GET['chromosome'] ]
+        if len(matches) == 0:
+            raise Http404("Couldn't find chromosome: " + request.GET['chromosome'])
+        sql += " and chromosome_id=%s"
+        params.append(matches[0])
+        if request.GET.has_key('start'):
+            sql += ' and "end" >= %s'
+            params.append(int(request.GET['start']))
+        if request.GET.has_key('end'):
+            sql += " and start <= %s"
+            params.append(int(request.GET['end']))
+    if request.GET.has_key('p_value'):
+        sql += " and p_value <= %s"
+        params.append(float(request.GET['p_value']))
+    sql += " order by chromosome_id, start;"
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        hits = [ {'chr':chromosomes[row[0]].name, 'start':row[1], 'end':row[2],
+                  'strand':row[3], 'score':row[4], 'p_value':row[5]} for row in cursor.fetchall() ]
+    finally:
+        cursor.close()
+
+    data = {'motif_id':motif_id, 'consensus':motif.consensus(), 'hits':hits}
+    return HttpResponse(simplejson.dumps(data), mimetype='application/json')
+
+MOTIF_SIMILAR_MAX_MATCHES = 50
+
+def motif_similar(request, motif_id=None):
+    """
+    Returns a JSON list of the motifs, from any network, most similar to the
+    given motif. Takes optional parameters k (number of matches, default 10,
+    at most MOTIF_SIMILAR_MAX_MATCHES) and metric (pearson or allr).
+    """
+    motif_id = int(motif_id)
+    try:
+        k = int(request.GET.get('k', 10))
+    except ValueError:
+        return HttpResponseBadRequest("k must be a number: " + request.GET['k'])
+    if k < 1:
+        return HttpResponseBadRequest("k must be positive: " + request.GET['k'])
+    # more matches than the index turns up means comparing against every motif
+    k = min(k, MOTIF_SIMILAR_MAX_MATCHES)
+    metric = request.GET.get('metric', 'pearson')
+    if metric not in ('pearson', 'allr'):
+        raise Http404("Unknown metric: " + metric)
+    try:
+        motif = Motif.objects.get(id=motif_id)
+    except Motif.DoesNotExist:
+        raise Http404("Couldn't find motif with id=%d" % (motif_id,))
+
+    pssms = Motif.pssms_for([motif_id])
+    if motif_id not in pssms:
+        raise Http404("Couldn't find a PSSM for motif with id=%d" % (motif_id,))
+    matches = motif_similarity.get_index().similar(pssms[motif_id].values, motif.sites, k=k,
+                                                   metric=metric, exclude=motif_id)
+
+    motifs = Motif.objects.select_related('bicluster').in_bulk([match[0] for match in matches])
+    similar = [ {'motif_id':id, 'bicluster_id':motifs[id].bicluster_id,
+                 'network_id':motifs[id].bicluster.network_id,
+                 'score':round(score, 4), 'offset':offset, 'strand':strand}
+                for id, score, offset, strand in matches if id in motifs ]
+    data = {'motif_id':motif_id, 'metric':metric, 'similar':similar}
     return HttpResponse(simplejson.dumps(data), mimetype='application/json')
 
+COEXPRESSION_MAX_NEIGHBORS = 100
+
+def coexpression(request):
+    """
+    Returns a JSON list of the genes whose expression correlates best with a
+    gene's, given by name or id with gene. Takes optional parameters
+    network_id (default the first network of the gene's species), method
+    (pearson or spearman) and k (number of neighbors, default 20, at most
+    COEXPRESSION_MAX_NEIGHBORS). Malformed parameters get a 400 response.
+    """
+    if not request.GET.get('gene'):
+        return HttpResponseBadRequest("Specify a gene")
+    try:
+        gene = Gene.objects.get(id=int(request.GET['gene']))
+    except ValueError:
+        try:
+            gene = find_gene_by_name(request.GET['gene'])
+        except ObjectDoesNotExist:
+            raise Http404("Couldn't find gene: " + request.GET['gene'])
+    except Gene.DoesNotExist:
+        raise Http404("Couldn't find gene with id=" + request.GET['gene'])
+    method = request.GET.get('method', 'pearson')
+    if method not in coexpression_engine.METHODS:
+        raise Http404("Unknown method: " + method)
+    try:
+        k = int(request.GET.get('k', 20))
+    except ValueError:
+        return HttpResponseBadRequest("k must be a number: " + request.GET['k'])
+    if k < 1:
+        return HttpResponseBadRequest("k must be positive: " + request.GET['k'])
+    k = min(k, COEXPRESSION_MAX_NEIGHBORS)
+    if request.GET.get('network_id'):
+        try:
+            network_id = int(request.GET['network_id'])
+        except ValueError:
+            return HttpResponseBadRequest("network_id must be a number: " + request.GET['network_id'])
+        if not Network.objects.filter(id=network_id).exists():
+            raise Http404("Couldn't find network with id=%d" % (network_id,))
+    else:
+        networks = gene.species.network_set.order_by('id')[:1]
+        if not networks:
+            raise Http404("No network for gene: " + gene.name)
+        network_id = networks[0].id
+
+    matches = coexpression_engine.neighbors(network_id, gene.id, method, k) or []
+    genes = Gene.objects.in_bulk([ match[0] for match in matches ])
+    neighbors = [ {'gene_id':id, 'name':genes[id].name, 'common_name':genes[id].common_name,
+                   'r':round(r, 4), 'n':n}
+                  for id, r, n in matches if id in genes ]
+    data = {'gene':gene.name, 'network_id':network_id, 'method':method, 'neighbors':neighbors}
+    return HttpResponse(simplejson.dumps(data), mimetype='application/json')
+
+CIRCVIS_MAX_LINKS = 100
+
+@cached_view('gene', 'network_id', 'limit')
 def circvis(request):
-    gene = request.GET['gene']
-    data = make_circvis_data(gene)
+    """
+    Returns JSON data for the CircVis plot of a gene's co-membership links,
+    optionally restricted to one network with network_id and to the top
+    links with limit (at most CIRCVIS_MAX_LINKS). Malformed parameters get a
+    400 response.
+    """
+    gene = request.GET.get('gene')
+    if not gene:
+        return HttpResponseBadRequest("Specify a gene")
+    try:
+        network_id = int(request.GET['network_id']) if request.GET.get('network_id') else None
+    except ValueError:
+        return HttpResponseBadRequest("network_id must be a number: " + request.GET['network_id'])
+    try:
+        limit = int(request.GET.get('limit', CIRCVIS_MAX_LINKS))
+    except ValueError:
+        return HttpResponseBadRequest("limit must be a number: " + request.GET['limit'])
+    if limit < 1:
+        return HttpResponseBadRequest("limit must be positive: " + request.GET['limit'])
+    limit = min(limit, CIRCVIS_MAX_LINKS)
+    try:
+        data = make_circvis_data(gene, network_id, limit)
+    except Gene.DoesNotExist:
+        raise Http404("Couldn't find gene: " + gene)
     return HttpResponse(simplejson.dumps(data), mimetype='application/json')
 
-def make_circvis_data(gene):
-    """helper function to build a CircVis object"""
-    gene1 = Gene.objects.filter(name=gene)[0]
-    species = gene1.species
-    chromosomes = [{'name': ch.name, 'length': ch.length} for ch in species.chromosome_set.all()]
+def cache_stats(request):
+    """
+    Returns JSON hit and miss counts of the caches of the process serving
+    the request.
+    """
+    return HttpResponse(simplejson.dumps(caching.stats()), mimetype='application/json')
+
+def make_circvis_data(gene, network_id=None, limit=CIRCVIS_MAX_LINKS):
+    """
+    helper function to build a CircVis object. Links go from the gene to each
+    of the genes it shares biclusters with, one link per gene pair, weighted
+    by the number of shared biclusters, keeping only the top limit links. Links
+    are counted in the given network, or summed over all networks.
+    """
+    matches = list(Gene.objects.select_related('chromosome').filter(name=gene)[:1])
+    if not matches:
+        raise Gene.DoesNotExist("Couldn't find gene: " + gene)
+    gene1 = matches[0]
+    chromosomes = [{'name': ch.name, 'length': ch.length} for ch in Chromosome.objects.filter(species=gene1.species_id)]
+
+    source, params = comembership_rows(gene1.id, network_id)
+    sql = """
+        select g.name, ch.name, g.start, g."end", sum(gc.shared_biclusters) as shared
+        from %s
+             join networks_gene g on gc.neighbor_id=g.id
+             join networks_chromosome ch on g.chromosome_id=ch.id
+        where gc.gene_id=%%s and gc.neighbor_id<>gc.gene_id""" % (source,)
+    params.append(gene1.id)
+    if network_id is not None:
+        sql += " and gc.network_id=%s"
+        params.append(network_id)
+    sql += """
+        group by g.name, ch.name, g.start, g."end"
+        order by shared desc, g.name
+        limit %s;"""
+    params.append(limit)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        neighbors = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    genes = []
     network = []
-    used_genes = [gene1]
-    gene_biclusters = Bicluster.objects.filter(genes__name=gene)
-    for bicluster in gene_biclusters:
-        for gene2 in bicluster.genes.all():
-            if gene2 != gene1:
-                used_genes.append(gene2)
+    if gene1.chromosome is not None:
+        genes.append({'name': gene1.name, 'chr': gene1.chromosome.name, 'start': gene1.start, 'end': gene1.end})
+        max_shared = max([ row[4] for row in neighbors ] or [1])
+        for name, chr, start, end, shared in neighbors:
+            genes.append({'name': name, 'chr': chr, 'start': start, 'end': end})
+            thickness = 1.0 + 4.0 * shared / max_shared
             network.append({
-                    'linkValue': 4.123,
+                    'linkValue': shared,
                     'node1': {
                         'chr': gene1.chromosome.name,
-                        'options': 'color=dorange,thickness=4.078,z=0.2452',
+                        'options': 'label=%s,color=dorange,thickness=%.3f,z=0.2452' % (gene1.name, thickness,),
                         'start': gene1.start,
                         'end': gene1.end
                         },
                     'node2': {
-                        'chr': gene2.chromosome.name,
-                        'options': 'color=dorange,thickness=4.078,z=0.2452',
-                        'start': gene2.start,
-                        'end': gene2.end
+                        'chr': chr,
+                        'options': 'label=%s,color=dorange,thickness=%.3f,z=0.2452' % (name, thickness,),
+                        'start': start,
+                        'end': end
                         }
                     })
-
-    genes = [{'name': g.name,
-              'chr': g.chromosome.name,
-              'start': g.start,
-              'end': g.end} for g in used_genes]
     return {'chromosomes': chromosomes, 'genes': genes, 'network': network}
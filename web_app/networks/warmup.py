@@ -0,0 +1,171 @@
+"""
+Warming the cache after an import or a deploy, so the first visitors to the
+busiest pages don't pay for rendering them.
+
+The pages and JSON data of every gene, bicluster, regulator and motif of a
+network are requested through Django's test client, in-process, by a pool of
+threads. The most connected objects come first: transcription factors, then
+genes, biclusters and regulators by degree. Each request is timed, so a
+warm-up doubles as a benchmark of every page.
+
+Warm up with: python manage.py warm_cache
+"""
+from django.db import connection
+from django.db.models import Count
+from django.test.client import Client
+from django.utils.http import urlquote
+import Queue
+import threading
+import time
+
+from models import Gene, Influence, Motif
+from profiling import percentile
+
+KINDS = ('species', 'gene', 'circvis', 'bicluster', 'regulator', 'pssm')
+
+
+def _counts(sql, params):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def warmup_paths(network, kinds=KINDS):
+    """
+    The paths to request to warm the cache for a network, as a list of
+    (kind, path), most connected objects first.
+    """
+    gene_degree = _counts("""
+        select bg.gene_id, count(*)
+        from networks_bicluster_genes bg join networks_bicluster b on bg.bicluster_id=b.id
+        where b.network_id=%s
+        group by bg.gene_id;""", (network.id,))
+    bicluster_size = _counts("""
+        select bg.bicluster_id, count(*)
+        from networks_bicluster_genes bg join networks_bicluster b on bg.bicluster_id=b.id
+        where b.network_id=%s
+        group by bg.bicluster_id;""", (network.id,))
+    regulated = _counts("""
+        select gene_id, count(distinct bicluster_id)
+        from tf_regulates_bicluster
+        where network_id=%s
+        group by gene_id;""", (network.id,))
+
+    # (transcription factor, degree, kind, path)
+    paths = [ (True, 1 << 30, 'species', "/species/%s" % (urlquote(network.species.short_name),)) ]
+    for id, name, tf in Gene.objects.filter(species=network.species_id).values_list('id', 'name', 'transcription_factor'):
+        degree = gene_degree.get(id, 0) + regulated.get(id, 0)
+        paths.append((tf, degree, 'gene', "/gene/%s" % (urlquote(name),)))
+        # as requested by the gene page
+        paths.append((tf, degree, 'circvis', "/json/circvis/?gene=%s&network_id=%d" % (urlquote(name), network.id,)))
+    for id, size in bicluster_size.items():
+        paths.append((False, size, 'bicluster', "/bicluster/%d" % (id,)))
+    for name, n in Influence.objects.filter(bicluster__network=network).annotate(n=Count('bicluster')).values_list('name', 'n'):
+        paths.append((False, n, 'regulator', "/regulator/%s" % (urlquote(name),)))
+    for id, bicluster_id in Motif.objects.filter(bicluster__network=network).values_list('id', 'bicluster_id'):
+        paths.append((False, bicluster_size.get(bicluster_id, 0), 'pssm', "/json/pssm/?motif_id=%d" % (id,)))
+
+    paths.sort(key=lambda path: (path[0], path[1]), reverse=True)
+    return [ (kind, path) for tf, degree, kind, path in paths if kind in kinds ]
+
+
+_local = threading.local()
+
+def _fetch(task):
+    # each thread has its own test client, and its own DB connection
+    kind, path = task
+    if not hasattr(_local, 'client'):
+        _local.client = Client()
+    started = time.time()
+    try:
+        response = _local.client.get(path)
+        # read streamed content, too
+        response.content
+    except Exception:
+        # the test client raises the exceptions of views
+        return kind, path, 500, (time.time() - started) * 1000, None
+    return kind, path, response.status_code, (time.time() - started) * 1000, response.get('X-Cache')
+
+
+# put on the results queue by a thread that has run out of work
+_DONE = object()
+
+def _work(tasks, results):
+    # fetch paths until there are none left, then close the thread's DB
+    # connection, which the test client leaves open after each request
+    try:
+        while True:
+            try:
+                task = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            results.put(_fetch(task))
+    finally:
+        try:
+            connection.close()
+        finally:
+            results.put(_DONE)
+
+
+def crawl(paths, threads=4):
+    """
+    Request paths, as from warmup_paths, with a pool of threads. Use
+    threads=1 to work in the calling thread. Generates (kind, path, status
+    code, milliseconds, X-Cache header) as each request is finished. Each
+    thread closes its DB connection when it's done.
+    """
+    if threads == 1:
+        for path in paths:
+            yield _fetch(path)
+        return
+    tasks = Queue.Queue()
+    for path in paths:
+        tasks.put(path)
+    results = Queue.Queue()
+    workers = [ threading.Thread(target=_work, args=(tasks, results)) for i in range(threads) ]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    try:
+        running = len(workers)
+        while running:
+            result = results.get()
+            if result is _DONE:
+                running -= 1
+            else:
+                yield result
+    finally:
+        # if the caller stops early, drop the paths not yet requested
+        try:
+            while True:
+                tasks.get_nowait()
+        except Queue.Empty:
+            pass
+        for worker in workers:
+            worker.join()
+
+
+def summarize(results):
+    """
+    Requests, errors, hits and response time percentiles by kind of page,
+    from the results of crawl.
+    """
+    by_kind = {}
+    for result in results:
+        by_kind.setdefault(result[0], []).append(result)
+    summary = {}
+    for kind, group in by_kind.items():
+        ms = [ r[3] for r in group ]
+        summary[kind] = {
+            'requests': len(group),
+            'errors': len([ r for r in group if r[2] != 200 ]),
+            'hits': len([ r for r in group if r[4] == 'HIT' ]),
+            'p50_ms': percentile(ms, 50),
+            'p95_ms': percentile(ms, 95),
+            'p99_ms': percentile(ms, 99),
+            'max_ms': max(ms),
+        }
+    return summary
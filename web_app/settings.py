@@ -59,6 +59,50 @@ MEDIA_URL = ''
 # Example: "/home/media/media.lawrence.com/static/"
 STATIC_ROOT = ''
 
+# Absolute path to the directory holding precomputed per-network expression
+# matrices. See networks/expression_store.py and the build_expression_store
+# management command.
+EXPRESSION_STORE_DIR = os.path.join(os.path.dirname(__file__), 'expression_store').replace('\\','/')
+
+# Absolute path to the directory holding chromosome sequences as FASTA files,
+# one subdirectory per species, for motif scanning. See Chromosome.sequence_path.
+SEQUENCE_DIR = os.path.join(os.path.dirname(__file__), 'sequences').replace('\\','/')
+
+# Absolute path of the motif similarity index. See networks/motif_similarity.py
+# and the build_motif_index management command.
+MOTIF_INDEX_PATH = os.path.join(os.path.dirname(__file__), 'motif_index.npz').replace('\\','/')
+
+# Absolute path to the directory caching rendered bicluster expression plots,
+# and the URL they're served from. In production, have the web server serve
+# the directory at that URL. See networks/plots.py and the
+# render_bicluster_plots management command.
+PLOT_DIR = os.path.join(os.path.dirname(__file__), 'plots').replace('\\','/')
+PLOT_URL = '/plots/'
+
+# Caches. 'local' is a per-process LRU cache in front of 'default', which is
+# shared between processes. Here that's a file based cache. In production,
+# use memcached instead:
+#    'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#    'LOCATION': '127.0.0.1:11211',
+# Cached entries are versioned by import generation and network version_id,
+# which each process rechecks every CACHE_GENERATION_CHECK seconds. See
+# networks/caching.py.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(os.path.dirname(__file__), 'cache').replace('\\','/'),
+        'TIMEOUT': 7 * 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    'local': {
+        'BACKEND': 'web_app.networks.caching.LRUCache',
+        'LOCATION': 'network_portal',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+CACHE_GENERATION_CHECK = 10
+
 # URL prefix for static files.
 # Example: "http://media.lawrence.com/static/"
 STATIC_URL = '/static/'
@@ -97,6 +141,7 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'web_app.networks.profiling.QueryProfilerMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -144,13 +189,41 @@ INSTALLED_APPS = (
 # the site admins on every HTTP 500 error.
 # See http://docs.djangoproject.com/en/dev/topics/logging for
 # more details on how to customize your logging configuration.
+# Per-request profiling, see networks/profiling.py. Each request's query count,
+# DB time, slowest queries and template time are logged as a line of JSON to
+# PROFILE_LOG, which is summarized by the profile_report management command.
+# Set PROFILE_HEADER to also report them in an X-Profile response header.
+# Recording queries has a cost, so in production only the fraction
+# PROFILE_QUERY_SAMPLE of requests have them recorded. PROFILE_HOOKS lets the
+# profiler time templates and keep the query log of profiled threads across
+# requests, by patching Django's Template.render and request_started handling.
+PROFILE_LOG = os.path.join(os.path.dirname(__file__), 'profile.log').replace('\\','/')
+PROFILE_HEADER = DEBUG
+PROFILE_QUERY_SAMPLE = 1.0 if DEBUG else 0.02
+PROFILE_HOOKS = True
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'message': {
+            'format': '%(message)s'
+        }
+    },
     'handlers': {
         'mail_admins': {
             'level': 'ERROR',
             'class': 'django.utils.log.AdminEmailHandler'
+        },
+        'console': {
+            'level': 'WARNING',
+            'class': 'logging.StreamHandler'
+        },
+        'profile': {
+            'level': 'INFO',
+            'class': 'logging.handlers.WatchedFileHandler',
+            'filename': PROFILE_LOG,
+            'formatter': 'message'
         }
     },
     'loggers': {
@@ -159,5 +232,14 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'networks': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+        'networks.profiling': {
+            'handlers': ['profile'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     }
 }
@@ -37,7 +37,9 @@ urlpatterns = patterns('',
     url(r'^networks/$', 'web_app.networks.views.networks', name='networks'),
     url(r'^network/(?P<network_id>\d+)$', 'web_app.networks.views.network', name='network'),
     url(r'^network/graphml', 'web_app.networks.views.network_as_graphml', name='network'),
+    url(r'^network/gml', 'web_app.networks.views.network_as_gml', name='network_gml'),
     url(r'^network/(?P<network_id>\d+)/regulated_by/(?P<regulator>.*)$', 'web_app.networks.views.regulated_by', name='regulated by'),
+    url(r'^network/(?P<network_id>\d+)/expression$', 'web_app.networks.views.network_expression', name='network_expression'),
     url(r'^network/(?P<network_id>\d+)/gene/(?P<gene>.*)$', 'web_app.networks.views.gene', name='network_gene'),
     url(r'^network', 'web_app.networks.views.network_cytoscape_web', name='network'),
 
@@ -48,6 +50,7 @@ urlpatterns = patterns('',
     url(r'^gene/(?P<gene>.*)$', 'web_app.networks.views.gene', name='gene'),
     
     url(r'^motif/(?P<motif_id>\d+)$', 'web_app.networks.views.motif', name='motif'),
+    url(r'^motif/(?P<motif_id>\d+)/similar$', 'web_app.networks.views.motif_similar', name='motif_similar'),
     
     url(r'^bicluster/(?P<bicluster_id>\d+)$', 'web_app.networks.views.bicluster', name='biclusters'),
 
@@ -75,9 +78,19 @@ urlpatterns = patterns('',
     (r'^analysis/function/$', 'networks.views.function'),
     (r'^json/circvis/$', 'networks.views.circvis'),
     (r'^json/pssm/$', 'networks.views.pssm'),
+    (r'^json/motif_hits/$', 'networks.views.motif_hits'),
+    (r'^json/coexpression/$', 'networks.views.coexpression'),
+    (r'^json/cache_stats/$', 'networks.views.cache_stats'),
 
     #(r'^static/(?P<path>.*)$', 'django.views.static.serve', {'document_root': settings.STATIC_URL }),
 
 )
 #urlpatterns += staticfiles_urlpatterns()
 
+# rendered plots are served by the web server in production
+if settings.DEBUG:
+    urlpatterns += patterns('',
+        (r'^%s(?P<path>.*)$' % (settings.PLOT_URL.lstrip('/'),), 'django.views.static.serve',
+         {'document_root': settings.PLOT_DIR}),
+    )
+